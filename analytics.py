@@ -0,0 +1,301 @@
+from datetime import date, datetime, timedelta, timezone
+
+# Revenue and utilization aggregates. Rather than scanning Rentals, every
+# rent and return updates a few small aggregate tables in the same
+# transaction (see rental_tx), so the dashboard reads are constant time:
+#
+#     RevenueByBike   bike_id -> revenue, booked hours, rentals
+#     RevenueByType   type    -> revenue, booked hours, rentals, active rentals
+#     RevenueByDay    day     -> revenue, booked hours, rentals
+#     RentalTotals    one row -> revenue, booked hours, rentals, active rentals
+#
+# Revenue is booked when a bike is rented (the app charges up front); a
+# return only ends the rental. Days are UTC dates, like Rentals.rented_at.
+# Rentals from before timestamps existed count in every total except
+# RevenueByDay.
+
+_numpy = None
+
+PERIODS = ("day", "week", "month")
+
+
+def create_tables(db):
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS RevenueByBike (
+                    bike_id INTEGER PRIMARY KEY,
+                    revenue REAL NOT NULL DEFAULT 0,
+                    hours INTEGER NOT NULL DEFAULT 0,
+                    rentals INTEGER NOT NULL DEFAULT 0
+                )"""
+    )
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS RevenueByType (
+                    type TEXT PRIMARY KEY,
+                    revenue REAL NOT NULL DEFAULT 0,
+                    hours INTEGER NOT NULL DEFAULT 0,
+                    rentals INTEGER NOT NULL DEFAULT 0,
+                    active INTEGER NOT NULL DEFAULT 0
+                )"""
+    )
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS RevenueByDay (
+                    day TEXT PRIMARY KEY,
+                    revenue REAL NOT NULL DEFAULT 0,
+                    hours INTEGER NOT NULL DEFAULT 0,
+                    rentals INTEGER NOT NULL DEFAULT 0
+                )"""
+    )
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS RentalTotals (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    revenue REAL NOT NULL DEFAULT 0,
+                    hours INTEGER NOT NULL DEFAULT 0,
+                    rentals INTEGER NOT NULL DEFAULT 0,
+                    active INTEGER NOT NULL DEFAULT 0
+                )"""
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_revenue_by_bike_revenue ON RevenueByBike (revenue)"
+    )
+
+
+def rebuild(db):
+    # Recompute every aggregate from Rentals and the rental history
+    # partitions still in the database, e.g. after rows were written without
+    # going through rental_tx. Run inside a write transaction.
+    for table in ("RevenueByBike", "RevenueByType", "RevenueByDay", "RentalTotals"):
+        db.execute(f"DELETE FROM {table}")
+
+    # Every rental still on record (open ones are active). Bikes deleted
+    # since have no type any more, so they drop out of RevenueByType.
+    history = [
+        row[0]
+        for row in db.execute(
+            """SELECT name FROM sqlite_master
+               WHERE type = 'table' AND name LIKE 'RentalHistory\\_%' ESCAPE '\\'"""
+        )
+    ]
+    rentals = " UNION ALL ".join(
+        ["SELECT bike_id, hours, total_cost, rented_at, 1 AS active FROM Rentals"]
+        + [
+            f"SELECT bike_id, hours, total_cost, rented_at, 0 FROM {table}"
+            for table in history
+        ]
+    )
+
+    db.execute(
+        f"""INSERT INTO RevenueByBike (bike_id, revenue, hours, rentals)
+            SELECT bike_id, SUM(total_cost), SUM(hours), COUNT(*)
+            FROM ({rentals}) GROUP BY bike_id"""
+    )
+    db.execute(
+        f"""INSERT INTO RevenueByType (type, revenue, hours, rentals, active)
+            SELECT Bikes.type, SUM(total_cost), SUM(hours), COUNT(*), SUM(active)
+            FROM ({rentals}) AS r JOIN Bikes ON Bikes.id = r.bike_id
+            GROUP BY Bikes.type"""
+    )
+    db.execute(
+        f"""INSERT INTO RevenueByDay (day, revenue, hours, rentals)
+            SELECT date(rented_at), SUM(total_cost), SUM(hours), COUNT(*)
+            FROM ({rentals}) WHERE rented_at IS NOT NULL GROUP BY date(rented_at)"""
+    )
+    db.execute(
+        f"""INSERT INTO RentalTotals (id, revenue, hours, rentals, active)
+            SELECT 1, COALESCE(SUM(total_cost), 0), COALESCE(SUM(hours), 0),
+                   COUNT(*), COALESCE(SUM(active), 0)
+            FROM ({rentals})"""
+    )
+
+
+# Writes, called inside the rent/return transaction
+
+
+def record_rent(db, bike_id, bike_type, hours, total_cost):
+    db.execute(
+        """INSERT INTO RevenueByBike (bike_id, revenue, hours, rentals)
+           VALUES (?, ?, ?, 1)
+           ON CONFLICT (bike_id) DO UPDATE SET
+               revenue = revenue + excluded.revenue,
+               hours = hours + excluded.hours,
+               rentals = rentals + 1""",
+        (bike_id, total_cost, hours),
+    )
+    db.execute(
+        """INSERT INTO RevenueByType (type, revenue, hours, rentals, active)
+           VALUES (?, ?, ?, 1, 1)
+           ON CONFLICT (type) DO UPDATE SET
+               revenue = revenue + excluded.revenue,
+               hours = hours + excluded.hours,
+               rentals = rentals + 1,
+               active = active + 1""",
+        (bike_type, total_cost, hours),
+    )
+    db.execute(
+        """INSERT INTO RevenueByDay (day, revenue, hours, rentals)
+           VALUES (date('now'), ?, ?, 1)
+           ON CONFLICT (day) DO UPDATE SET
+               revenue = revenue + excluded.revenue,
+               hours = hours + excluded.hours,
+               rentals = rentals + 1""",
+        (total_cost, hours),
+    )
+    db.execute(
+        """INSERT INTO RentalTotals (id, revenue, hours, rentals, active)
+           VALUES (1, ?, ?, 1, 1)
+           ON CONFLICT (id) DO UPDATE SET
+               revenue = revenue + excluded.revenue,
+               hours = hours + excluded.hours,
+               rentals = rentals + 1,
+               active = active + 1""",
+        (total_cost, hours),
+    )
+
+
+def record_end(db, bike_type, count=1):
+    # count rentals of a bike_type bike ended (returned, or the bike deleted)
+    if count:
+        db.execute(
+            "UPDATE RevenueByType SET active = MAX(active - ?, 0) WHERE type = ?",
+            (count, bike_type),
+        )
+        db.execute(
+            "UPDATE RentalTotals SET active = MAX(active - ?, 0) WHERE id = 1",
+            (count,),
+        )
+
+
+# Reads
+
+
+def totals(conn):
+    row = conn.execute(
+        "SELECT revenue, hours, rentals, active FROM RentalTotals WHERE id = 1"
+    ).fetchone()
+    revenue, hours, rentals, active = row or (0.0, 0, 0, 0)
+    return {"revenue": revenue, "hours": hours, "rentals": rentals, "active": active}
+
+
+def utc_today():
+    return datetime.now(timezone.utc).date()
+
+
+def day_totals(conn, day=None):
+    day = day or utc_today().isoformat()
+    row = conn.execute(
+        "SELECT revenue, hours, rentals FROM RevenueByDay WHERE day = ?", (day,)
+    ).fetchone()
+    revenue, hours, rentals = row or (0.0, 0, 0)
+    return {"day": day, "revenue": revenue, "hours": hours, "rentals": rentals}
+
+
+def by_type(conn):
+    columns = ("type", "revenue", "hours", "rentals", "active")
+    return [
+        dict(zip(columns, row))
+        for row in conn.execute(
+            """SELECT type, revenue, hours, rentals, active
+               FROM RevenueByType ORDER BY revenue DESC"""
+        )
+    ]
+
+
+def top_bikes(conn, limit=10):
+    columns = ("bike_id", "name", "revenue", "hours", "rentals")
+    return [
+        dict(zip(columns, row))
+        for row in conn.execute(
+            """SELECT RevenueByBike.bike_id, Bikes.name, revenue, hours, rentals
+               FROM RevenueByBike LEFT JOIN Bikes ON Bikes.id = RevenueByBike.bike_id
+               ORDER BY revenue DESC LIMIT ?""",
+            (limit,),
+        )
+    ]
+
+
+def dashboard(conn, today=None):
+    # Everything the admin dashboard shows, from the aggregate tables only
+    return {
+        "totals": totals(conn),
+        "today": day_totals(conn, today),
+        "by_type": by_type(conn),
+        "top_bikes": top_bikes(conn),
+    }
+
+
+# Date-range rollups
+
+
+def load_numpy():
+    # NumPy is optional and slow to import; only load it for a rollup
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy
+
+
+def period_start(day, period):
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+def rollup(conn, start, end, period="day"):
+    # Revenue, booked hours and rentals per day, week (from Monday) or month
+    # between start and end (ISO dates, inclusive). Returns a list of
+    # (period start, revenue, hours, rentals), oldest first.
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period: {period!r}")
+    rows = conn.execute(
+        """SELECT day, revenue, hours, rentals FROM RevenueByDay
+           WHERE day BETWEEN ? AND ? ORDER BY day""",
+        (start, end),
+    ).fetchall()
+    if not rows:
+        return []
+
+    np = load_numpy()
+    if np:
+        return _rollup_numpy(np, rows, period)
+
+    buckets = {}
+    for day, revenue, hours, rentals in rows:
+        key = period_start(date.fromisoformat(day), period).isoformat()
+        bucket = buckets.setdefault(key, [0.0, 0, 0])
+        bucket[0] += revenue
+        bucket[1] += hours
+        bucket[2] += rentals
+    return [(key, *bucket) for key, bucket in sorted(buckets.items())]
+
+
+def _rollup_numpy(np, rows, period):
+    days = np.array([row[0] for row in rows], dtype="datetime64[D]")
+    revenue = np.array([row[1] for row in rows], dtype=np.float64)
+    hours = np.array([row[2] for row in rows], dtype=np.int64)
+    rentals = np.array([row[3] for row in rows], dtype=np.int64)
+
+    if period == "month":
+        keys = days.astype("datetime64[M]").astype("datetime64[D]")
+    elif period == "week":
+        # 1970-01-01 was a Thursday, so shift by 3 to land on Mondays
+        offset = (days.astype(np.int64) + 3) % 7
+        keys = days - offset.astype("timedelta64[D]")
+    else:
+        keys = days
+
+    # Rows are sorted by day, so each period is one contiguous run
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return [
+        (str(key), float(rev), int(hrs), int(cnt))
+        for key, rev, hrs, cnt in zip(
+            keys[starts],
+            np.add.reduceat(revenue, starts),
+            np.add.reduceat(hours, starts),
+            np.add.reduceat(rentals, starts),
+        )
+    ]
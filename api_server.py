@@ -0,0 +1,546 @@
+"""HTTP/JSON API over the rental service.
+
+    python api_server.py --host 127.0.0.1 --port 8080 --db bike-rental.db
+    python api_server.py --depots depots.json
+
+Runs on asyncio with HTTP/1.1 keep-alive, so kiosks and apps can reuse one
+connection for many requests. Reads run on a small thread pool with one
+SQLite connection per thread. Writes from all clients are queued and a single
+writer commits them in batches (one transaction, one savepoint per request),
+so a burst of rentals costs one commit instead of one per request; see
+group_commit. With --journal NAME, acknowledged writes are also kept in a
+local journal file and replayed on startup if a crash lost them.
+
+Endpoints (JSON bodies, JSON responses):
+
+    POST   /login          {"username", "password"} -> {"token", "username", "role"}
+    POST   /users          {"username", "password", "is_admin"}
+    GET    /bikes          ?after=<id>&limit=<n>                     (logged in)
+    GET    /bikes/free     ?start=<time>&end=<time>&type=<t>&after=<id>&limit=<n>
+                                                                     (logged in)
+    GET    /bikes/<id>                                               (logged in)
+    POST   /bikes          {"name", "type", "price_per_hour", "depot"}  (admin)
+    DELETE /bikes/<id>                                               (admin)
+    GET    /rentals                                                  (logged in)
+    POST   /rentals        {"bike_id", "customer_name", "hours"}     (logged in)
+    POST   /returns        {"bike_id"}                               (logged in)
+    GET    /reservations   ?bike_id=<id>                             (logged in)
+    POST   /reservations   {"bike_id", "customer_name", "start", "end"}  (logged in)
+    DELETE /reservations/<id>                                        (logged in)
+    POST   /batch          [{"op": "rent", ...}, ...]                (logged in)
+    GET    /changes        ?after=<seq>                              (logged in)
+    POST   /sync           {"kiosk", "operations": [...]}            (logged in)
+    GET    /metrics        Prometheus text (?format=json for JSON)  (with --metrics)
+
+With --depots, every depot of the manifest is served (see depots), each
+with a writer of its own. Users are kept in the first depot. A request
+about a bike or reservation goes to the depot its id belongs to; lists are
+put together from every depot in id order. New bikes go to the first depot
+unless "depot" names another (by name or number).
+
+/changes and /sync are how kiosks keep their replicas (see kiosk): /changes
+without after gives the current end of the change log, which with several
+depots is one seq per depot joined with commas. A replica id belongs to the
+first account that syncs it; any other account except an admin gets 403.
+
+Logged-in requests send "Authorization: Bearer <token>". Times are
+"YYYY-MM-DD HH:MM" in the server's local time or ISO 8601 with an offset;
+responses give them in UTC.
+"""
+
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import group_commit
+import depots
+import instrumentation
+import kiosk
+import rental_service
+from auth import SessionCache
+from db import DB_FILE
+from rental_tx import RentalError
+
+READ_THREADS = 4
+MAX_BODY = 1024 * 1024
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+# Messages that mean "no such thing" rather than "not allowed right now"
+NOT_FOUND_MESSAGES = {"Bike ID not found.", "Reservation not found."}
+
+ADMIN_OPERATIONS = {"add_bike", "delete_bike"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def error_status(error):
+    if error.title == "Input Error":
+        return 400
+    if error.title == "Login Error":
+        return 401
+    if error.title == "Permission Error":
+        return 403
+    if str(error) in NOT_FOUND_MESSAGES:
+        return 404
+    return 409
+
+
+class RentalApi:
+    def __init__(
+        self,
+        path=DB_FILE,
+        profile=None,
+        journal=None,
+        max_batch=group_commit.BATCH_MAX,
+        max_delay=group_commit.BATCH_WINDOW,
+        manifest=None,
+    ):
+        # With a manifest, every depot it lists (see depots); else the one
+        # file at path
+        self.sessions = SessionCache()
+        self._readers = ThreadPoolExecutor(READ_THREADS, thread_name_prefix="api-read")
+        if manifest:
+            self.depots = depots.open_depots(manifest, profile)
+        else:
+            self.depots = depots.open_file(path, profile)
+        self.depots.start_group_commit(
+            journal,
+            max_batch,
+            max_delay,
+            {
+                "sync_outbox": kiosk.apply_outbox,
+                "sync_depot_outbox": kiosk.apply_depot_outbox,
+            },
+        )
+
+    @property
+    def replayed(self):
+        # Writes the committers replayed from their journals at startup
+        committers = self.depots.committers.values()
+        return sum(committer.replayed for committer in committers)
+
+    def close(self):
+        self.depots.shutdown()
+
+    # Database access
+
+    async def read(self, func, *args):
+        # func(depot_set, *args) on the read pool; DepotSet connections are
+        # per thread, so each pool thread reuses its own
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._readers, lambda: func(self.depots, *args)
+        )
+
+    async def prepare(self, name, params):
+        # Sign-ups are hashed on the read pool (see group_commit.prepare);
+        # submit would otherwise run the slow KDF on the event loop and hold
+        # up every connection
+        if name != "sign_up":
+            return name, params
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._readers, group_commit.prepare, name, params
+        )
+
+    def route(self, name, params):
+        # (depot, params) of a write: the depot of its bike or reservation
+        # (see depots); a new bike goes to the depot named or numbered by its
+        # "depot" parameter, the home depot by default
+        if name != "add_bike":
+            return depots.operation_depot(self.depots, name, params), params
+        params = dict(params)
+        choice = params.pop("depot", None)
+        if choice is None:
+            return self.depots.home, params
+        try:
+            return self.depots.find(str(choice)), params
+        except ValueError as e:
+            raise HttpError(400, str(e))
+
+    def submit(self, depot, name, params):
+        committer = self.depots.committers[depot.number]
+        return asyncio.wrap_future(committer.submit(name, params))
+
+    async def write(self, name, params):
+        depot, params = self.route(name, params)
+        name, params = await self.prepare(name, params)
+        return await self.submit(depot, name, params)
+
+    async def write_many(self, operations):
+        routed = []
+        for name, params in operations:
+            depot, params = self.route(name, params)
+            routed.append((depot, name, params))
+        prepared = await asyncio.gather(
+            *(self.prepare(name, params) for _, name, params in routed)
+        )
+        futures = [
+            self.submit(depot, name, params)
+            for (depot, _, _), (name, params) in zip(routed, prepared)
+        ]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        return [
+            (False, result) if isinstance(result, Exception) else (True, result)
+            for result in results
+        ]
+
+    async def sync(self, user, replica_id, operations):
+        # POST /sync. The home depot's sync_outbox checks the account and the
+        # seqs of the whole batch and applies the operations on its own
+        # bikes; then each other depot applies those on its bikes.
+        groups = {}
+        if isinstance(operations, list):
+            for operation in operations:
+                params = operation.get("params") if isinstance(operation, dict) else None
+                if not isinstance(params, dict):
+                    continue  # sync_outbox refuses the batch
+                depot = self.depots.owner(params.get("bike_id"))
+                if depot is not self.depots.home:
+                    groups.setdefault(depot.number, (depot, []))[1].append(operation)
+        results = await self.submit(
+            self.depots.home,
+            "sync_outbox",
+            {
+                "kiosk": replica_id,
+                "operations": operations,
+                "username": user["username"],
+                "is_admin": user["role"] == "admin",
+                "elsewhere": [
+                    operation["seq"]
+                    for _, group in groups.values()
+                    for operation in group
+                    if isinstance(operation.get("seq"), int)
+                ],
+            },
+        )
+        for depot_results in await asyncio.gather(
+            *(
+                self.submit(
+                    depot,
+                    "sync_depot_outbox",
+                    {"kiosk": replica_id, "operations": group},
+                )
+                for depot, group in groups.values()
+            )
+        ):
+            results += depot_results
+        return sorted(results, key=lambda result: result["seq"])
+
+    # Sessions
+
+    def user_for(self, headers, admin=False):
+        auth = headers.get("authorization", "")
+        token = auth[7:] if auth.lower().startswith("bearer ") else ""
+        user = self.sessions.get(token)
+        if user is None:
+            raise HttpError(401, "Please log in first.")
+        if admin and user["role"] != "admin":
+            raise HttpError(403, "Only admins can do that.")
+        return user
+
+    # Routing
+
+    async def handle(self, method, path, query, headers, body):
+        parts = [part for part in path.split("/") if part]
+
+        if method == "GET" and parts == ["metrics"] and instrumentation.enabled():
+            if query.get("format") == "json":
+                return instrumentation.metrics.snapshot()
+            return instrumentation.prometheus()
+
+        if method == "POST" and parts == ["login"]:
+            user = await self.read(
+                depots.login, body.get("username"), body.get("password")
+            )
+            return dict(user, token=self.sessions.create(user))
+
+        if method == "POST" and parts == ["users"]:
+            # Only an admin may create another admin
+            params = {
+                "username": body.get("username"),
+                "password": body.get("password"),
+                "is_admin": bool(body.get("is_admin")),
+            }
+            if params["is_admin"]:
+                self.user_for(headers, admin=True)
+            return await self.write("sign_up", params)
+
+        if parts[:1] == ["bikes"]:
+            if method == "GET":
+                self.user_for(headers)
+            if method == "GET" and len(parts) == 1:
+                return await self.read(
+                    depots.list_bikes,
+                    query.get("after", 0),
+                    query.get("limit", 100),
+                )
+            if method == "GET" and parts[1:] == ["free"]:
+                return await self.read(
+                    depots.list_free_bikes,
+                    query.get("start"),
+                    query.get("end"),
+                    query.get("type"),
+                    query.get("after", 0),
+                    query.get("limit", 100),
+                )
+            if method == "GET" and len(parts) == 2:
+                return await self.read(depots.get_bike, parts[1])
+            if method == "POST" and len(parts) == 1:
+                self.user_for(headers, admin=True)
+                return await self.write(
+                    "add_bike",
+                    {
+                        "name": body.get("name"),
+                        "bike_type": body.get("type"),
+                        "price_per_hour": body.get("price_per_hour"),
+                        "depot": body.get("depot"),
+                    },
+                )
+            if method == "DELETE" and len(parts) == 2:
+                self.user_for(headers, admin=True)
+                return await self.write("delete_bike", {"bike_id": parts[1]})
+
+        if parts == ["rentals"]:
+            self.user_for(headers)
+            if method == "GET":
+                return await self.read(depots.list_rentals)
+            if method == "POST":
+                return await self.write(
+                    "rent",
+                    {
+                        "bike_id": body.get("bike_id"),
+                        "customer_name": body.get("customer_name"),
+                        "hours": body.get("hours"),
+                    },
+                )
+
+        if method == "POST" and parts == ["returns"]:
+            self.user_for(headers)
+            return await self.write("return", {"bike_id": body.get("bike_id")})
+
+        if parts[:1] == ["reservations"]:
+            if method == "GET" and len(parts) == 1:
+                self.user_for(headers)
+                return await self.read(depots.list_reservations, query.get("bike_id"))
+            if method == "POST" and len(parts) == 1:
+                self.user_for(headers)
+                return await self.write(
+                    "reserve",
+                    {
+                        "bike_id": body.get("bike_id"),
+                        "customer_name": body.get("customer_name"),
+                        "starts_at": body.get("start"),
+                        "ends_at": body.get("end"),
+                    },
+                )
+            if method == "DELETE" and len(parts) == 2:
+                self.user_for(headers)
+                return await self.write(
+                    "cancel_reservation", {"reservation_id": parts[1]}
+                )
+
+        if method == "GET" and parts == ["changes"]:
+            self.user_for(headers)
+            if "after" not in query:
+                return {"seq": await self.read(depots.latest_changes)}
+            return await self.read(depots.changes_since, query["after"])
+
+        if method == "POST" and parts == ["sync"]:
+            user = self.user_for(headers)
+            return await self.sync(user, body.get("kiosk"), body.get("operations"))
+
+        if method == "POST" and parts == ["batch"]:
+            user = self.user_for(headers)
+            if not isinstance(body, list):
+                raise HttpError(400, "Expected a list of operations.")
+            operations = []
+            for item in body:
+                if not isinstance(item, dict):
+                    raise HttpError(400, "Each operation must be an object.")
+                params = dict(item)
+                name = params.pop("op", None)
+                # Only the public operations: the writer also runs internal
+                # ones (a sign-up with a ready-made hash, kiosk syncs)
+                if name not in rental_service.WRITE_OPERATIONS:
+                    raise HttpError(400, f"Unknown operation: {name}")
+                if name in ADMIN_OPERATIONS and user["role"] != "admin":
+                    raise HttpError(403, "Only admins can do that.")
+                if name == "sign_up" and params.get("is_admin") and user["role"] != "admin":
+                    raise HttpError(403, "Only admins can do that.")
+                operations.append((name, params))
+            results = await self.write_many(operations)
+            return [
+                {"ok": True, "result": result}
+                if ok
+                else {"ok": False, "error": str(result)}
+                for ok, result in results
+            ]
+
+        raise HttpError(404, "Not found.")
+
+    # HTTP
+
+    async def serve_client(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, raw_body = request
+                status, payload = await self.respond(method, target, headers, raw_body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(encode_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except HttpError as e:
+            writer.write(encode_response(e.status, {"error": str(e)}, False))
+        finally:
+            writer.close()
+
+    async def respond(self, method, target, headers, raw_body):
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            body = json.loads(raw_body) if raw_body else {}
+        except ValueError:
+            return 400, {"error": "Request body is not valid JSON."}
+        if not isinstance(body, (dict, list)):
+            return 400, {"error": "Request body must be a JSON object or list."}
+        if isinstance(body, list) and url.path.rstrip("/") != "/batch":
+            return 400, {"error": "Request body must be a JSON object."}
+
+        # Timed per route, with ids folded: "GET /bikes/<id>"
+        route = "/".join(
+            "<id>" if part.isdigit() else part for part in url.path.split("/")
+        )
+        try:
+            with instrumentation.span(f"api {method} {route}"):
+                return 200, await self.handle(method, url.path, query, headers, body)
+        except HttpError as e:
+            return e.status, {"error": str(e)}
+        except RentalError as e:
+            return error_status(e), {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": f"An error occurred: {str(e)}"}
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.serve_client, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+async def read_request(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "Malformed request line.")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    # Digits only: int() would also take "-1", " 1" and "1_000"
+    length = headers.get("content-length") or "0"
+    if not (length.isascii() and length.isdigit()):
+        raise HttpError(400, "Invalid Content-Length header.")
+    length = int(length)
+    if length > MAX_BODY:
+        raise HttpError(413, "Request body too large.")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, headers, body
+
+
+def encode_response(status, payload, keep_alive):
+    # Text payloads (the Prometheus metrics) are sent as they are
+    if isinstance(payload, str):
+        body, content_type = payload.encode(), "text/plain; version=0.0.4"
+    else:
+        body, content_type = json.dumps(payload).encode(), "application/json"
+    head = (
+        f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    )
+    return head.encode("latin-1") + body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bike rental HTTP/JSON API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument(
+        "--depots", help="serve every depot of this manifest (see depots) instead"
+    )
+    parser.add_argument("--profile", default=None, help="database tuning profile")
+    parser.add_argument(
+        "--metrics", action="store_true", help="record timings, served at /metrics"
+    )
+    parser.add_argument("--slow-ms", type=float, help="log SQL slower than this")
+    parser.add_argument("--journal", help="keep acknowledged writes in a journal")
+    parser.add_argument(
+        "--batch-max", type=int, default=group_commit.BATCH_MAX, help="writes per commit"
+    )
+    parser.add_argument(
+        "--batch-ms",
+        type=float,
+        default=group_commit.BATCH_WINDOW * 1000,
+        help="how long to wait for more writes",
+    )
+    args = parser.parse_args()
+
+    if args.metrics or args.slow_ms is not None:
+        instrumentation.enable(args.slow_ms)
+
+    try:
+        api = RentalApi(
+            args.db,
+            args.profile,
+            args.journal,
+            args.batch_max,
+            args.batch_ms / 1000,
+            args.depots,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    if api.replayed:
+        print(f"Replayed {api.replayed} writes from the journals.")
+    print(f"Serving bike rental API on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(api.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+# Password hashing for Users.password. Hashes are stored as
+#
+#     pbkdf2_sha256$<iterations>$<salt>$<hash>
+#
+# with base64 salt and hash. Anything else in the column is a plaintext
+# password from before hashing existed; it still logs in once and is replaced
+# by a hash on that login. The work factor can be tuned with
+# BIKE_RENT_PBKDF2_ITERATIONS; stored hashes with a different count are
+# rehashed on the next successful login.
+
+ALGORITHM = "pbkdf2_sha256"
+ITERATIONS = int(os.environ.get("BIKE_RENT_PBKDF2_ITERATIONS", "120000"))
+SALT_BYTES = 16
+
+AUTH_CACHE_TTL = 300  # seconds a verified password skips the KDF
+SESSION_TTL = 8 * 60 * 60  # seconds an API token stays valid without use
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def hash_password(password, iterations=None):
+    iterations = iterations or ITERATIONS
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"{ALGORITHM}${iterations}${_b64(salt)}${_b64(digest)}"
+
+
+def is_hashed(stored):
+    return stored.startswith(ALGORITHM + "$")
+
+
+def verify_password(stored, password):
+    # Returns (matches, needs_rehash)
+    if not is_hashed(stored):
+        return hmac.compare_digest(stored.encode(), password.encode()), True
+
+    try:
+        _, iterations, salt, digest = stored.split("$")
+        iterations = int(iterations)
+        salt = base64.b64decode(salt)
+        digest = base64.b64decode(digest)
+    except ValueError:
+        return False, False
+
+    candidate = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    matches = hmac.compare_digest(candidate, digest)
+    return matches, matches and iterations != ITERATIONS
+
+
+class AuthCache:
+    # Remembers recent successful logins so a repeat login with the same
+    # password skips the KDF. Entries are keyed by username and hold an HMAC
+    # of (stored hash, password) under a per-process secret, so the cache
+    # never holds the password and a changed password or hash misses.
+
+    def __init__(self, ttl=AUTH_CACHE_TTL):
+        self.ttl = ttl
+        self._secret = secrets.token_bytes(32)
+        self._entries = {}  # username -> (proof, expires)
+        self._lock = threading.Lock()
+
+    def _proof(self, stored, password):
+        message = stored.encode() + b"\0" + password.encode()
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def check(self, username, stored, password):
+        with self._lock:
+            entry = self._entries.get(username)
+        if entry is None:
+            return False
+        proof, expires = entry
+        if expires < time.monotonic():
+            with self._lock:
+                self._entries.pop(username, None)
+            return False
+        return hmac.compare_digest(proof, self._proof(stored, password))
+
+    def remember(self, username, stored, password):
+        entry = (self._proof(stored, password), time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[username] = entry
+
+    def forget(self, username):
+        with self._lock:
+            self._entries.pop(username, None)
+
+
+class SessionCache:
+    # Bearer tokens handed out by the API; each use extends the token's life
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}  # token -> (user, expires)
+        self._lock = threading.Lock()
+
+    def create(self, user):
+        token = secrets.token_urlsafe(24)
+        with self._lock:
+            self._sessions[token] = (user, time.monotonic() + self.ttl)
+        return token
+
+    def get(self, token):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < now:
+                del self._sessions[token]
+                return None
+            self._sessions[token] = (user, now + self.ttl)
+        return user
+
+    def revoke(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+
+auth_cache = AuthCache()
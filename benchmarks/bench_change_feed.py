@@ -0,0 +1,114 @@
+"""Change feed: what following other counters costs, against reloading.
+
+    python benchmarks/bench_change_feed.py --bikes 100000 --changes 20
+
+Times, on a temporary database:
+
+    idle poll  change_feed.read_changes when nothing changed (what an open
+               counter does every POLL_INTERVAL_MS)
+    poll       read_changes plus apply_changes to a FleetStore after
+               --changes rentals by another connection
+    reload     loading the whole fleet again, which is what a counter had
+               to do before to see those rentals
+    write      one rent+return through rental_service, with the change log
+               triggers and with them dropped (the cost every write pays)
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import change_feed  # noqa: E402
+from db import connect  # noqa: E402
+from fleet_store import FleetStore  # noqa: E402
+from migrations import migrate  # noqa: E402
+import rental_service  # noqa: E402
+
+TRIGGERS = [
+    f"{table}_changes_{event}"
+    for table in ("bikes", "rentals")
+    for event in ("insert", "update", "delete")
+]
+
+
+def rent_and_return(conn, n_bikes, cycles):
+    # On the last 1000 bikes, which the polls leave alone
+    start = time.perf_counter()
+    for i in range(cycles):
+        bike_id = n_bikes - i % 1000
+        rental_service.rent_bike(conn, bike_id, "Bench", 1)
+        rental_service.return_bike(conn, bike_id)
+    return (time.perf_counter() - start) / cycles
+
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bikes", type=int, default=100_000)
+    parser.add_argument("--changes", type=int, default=20, help="rentals per poll")
+    parser.add_argument("--cycles", type=int, default=500, help="rent+return timed")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "feed.db")
+        conn = connect(path)
+        migrate(conn)
+        conn.executemany(
+            "INSERT INTO Bikes (name, type, price_per_hour, available) VALUES (?, ?, ?, 1)",
+            ((f"Bike {i}", "City", 10) for i in range(args.bikes)),
+        )
+        conn.commit()
+        other = connect(path)
+
+        print(f"{args.bikes} bikes")
+        fleet = FleetStore()
+        seq = change_feed.latest_seq(conn)
+        fleet.load(conn)
+        idle = best_of(20, lambda: change_feed.read_changes(conn, seq))
+        print(f"  {'idle poll':<22}{idle * 1e6:9.0f}us")
+
+        polls = []
+        for round_number in range(10):
+            for i in range(args.changes):
+                bike_id = round_number * args.changes + i + 1
+                rental_service.rent_bike(other, bike_id, "Elsewhere", 2)
+            start = time.perf_counter()
+            seq, changed = change_feed.read_changes(conn, seq)
+            change_feed.apply_changes(fleet, changed)
+            polls.append(time.perf_counter() - start)
+        assert not fleet.is_available(1) and fleet.get_rental(1) is not None
+        print(f"  {f'poll, {args.changes} changes':<22}{min(polls) * 1e6:9.0f}us")
+
+        reload = best_of(3, lambda: FleetStore().load(conn))
+        print(f"  {'reload':<22}{reload * 1e6:9.0f}us")
+
+        # Last, as it drops the triggers
+        with_log = rent_and_return(other, args.bikes, args.cycles)
+        for trigger in TRIGGERS:
+            conn.execute(f"DROP TRIGGER {trigger}")
+        conn.commit()
+        without_log = rent_and_return(other, args.bikes, args.cycles)
+        print(
+            f"  {'write, change log':<22}{with_log * 1e6:9.0f}us/rent+return\n"
+            f"  {'write, no change log':<22}{without_log * 1e6:9.0f}us/rent+return"
+        )
+
+        other.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
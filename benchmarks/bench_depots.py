@@ -0,0 +1,194 @@
+"""One database for every depot versus one database file per depot.
+
+    python benchmarks/bench_depots.py --depots 4 --counters 2 --cycles 300
+
+Writes: every counter is a process renting and returning bikes of its own
+depot as fast as it can, with --counters processes per depot. The same run
+is done twice:
+
+    shared    all depots' bikes in one file, so every commit in every depot
+              queues on the same write lock
+    sharded   one file per depot (depots.DepotSet), so counters only queue
+              behind counters of their own depot
+
+and reports throughput and the time spent waiting for the write lock.
+
+Reads: the fleet load and the revenue dashboard over all depots, asking
+the depots one after the other versus all at once on the fan-out pool
+(DepotSet picks between the two by CPU count; this forces each).
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import connect  # noqa: E402
+import depots  # noqa: E402
+from migrations import migrate  # noqa: E402
+from rental_tx import RentalError  # noqa: E402
+import rental_service  # noqa: E402
+
+
+def add_bikes(conn, n_bikes, depot_number):
+    conn.executemany(
+        "INSERT INTO Bikes (name, type, price_per_hour, available) VALUES (?, ?, ?, 1)",
+        (
+            (f"Depot {depot_number} bike {i}", ("Road", "City")[i % 2], 10 + i % 5)
+            for i in range(n_bikes)
+        ),
+    )
+    conn.commit()
+
+
+def setup_shared(path, n_depots, n_bikes):
+    conn = connect(path)
+    migrate(conn)
+    for number in range(n_depots):
+        add_bikes(conn, n_bikes, number)
+    conn.close()
+
+
+def setup_sharded(tmp, n_depots, n_bikes):
+    depot_list = []
+    for number in range(n_depots):
+        path = os.path.join(tmp, f"depot-{number}.db")
+        depot = depots.Depot(number, f"Depot {number}", path)
+        conn = connect(depot.path)
+        depots.init_depot(conn, depot)
+        add_bikes(conn, n_bikes, number)
+        conn.close()
+        depot_list.append(depot)
+    return depot_list
+
+
+def counter(target, depot_number, worker_id, n_bikes, per_depot, cycles, results):
+    # Rent and return bikes of one depot; target is a file (shared) or a
+    # list of Depots (sharded)
+    rng = random.Random(worker_id)
+    if isinstance(target, str):
+        conn = connect(target)
+        first = depot_number * n_bikes + 1
+
+        def rent(bike_id, stats):
+            return rental_service.rent_bike(conn, bike_id, "Bench", 1, stats)
+
+        def give_back(bike_id, stats):
+            return rental_service.return_bike(conn, bike_id, stats)
+
+    else:
+        depot_set = depots.DepotSet(target)
+        first = depot_number * depots.ID_BLOCK + 1
+
+        def rent(bike_id, stats):
+            return depots.rent_bike(depot_set, bike_id, "Bench", 1, stats)
+
+        def give_back(bike_id, stats):
+            return depots.return_bike(depot_set, bike_id, stats)
+
+    # Counters of the same depot use separate bikes, so every rent succeeds
+    own = list(range(first + worker_id % per_depot, first + n_bikes, per_depot))
+    stats = {}
+    start = time.perf_counter()
+    for _ in range(cycles):
+        bike_id = rng.choice(own)
+        try:
+            rent(bike_id, stats)
+            give_back(bike_id, stats)
+        except RentalError:
+            stats["refused"] = stats.get("refused", 0) + 1
+    results.put((time.perf_counter() - start, stats))
+
+
+def run_counters(target, n_depots, per_depot, n_bikes, cycles):
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=counter,
+            args=(target, i // per_depot, i, n_bikes, per_depot, cycles, results),
+        )
+        for i in range(n_depots * per_depot)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+    lock_wait = sum(stats.get("lock_wait", 0.0) for _, stats in outcomes)
+    retries = sum(stats.get("retries", 0) for _, stats in outcomes)
+    refused = sum(stats.get("refused", 0) for _, stats in outcomes)
+    return elapsed, lock_wait / len(outcomes), retries, refused
+
+
+def time_reads(depot_list, repeat):
+    results = {}
+    for mode, depot_set in (
+        ("one by one", depots.DepotSet(depot_list, threads=1)),
+        ("fan-out", depots.DepotSet(depot_list, threads=len(depot_list))),
+    ):
+        for name, func in (
+            ("fleet load", depots.load_fleet),
+            ("dashboard", depots.dashboard),
+        ):
+            func(depot_set)  # warm up connections and caches
+            start = time.perf_counter()
+            for _ in range(repeat):
+                func(depot_set)
+            results[(name, mode)] = (time.perf_counter() - start) / repeat
+        depot_set.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--depots", type=int, default=4)
+    parser.add_argument("--counters", type=int, default=2, help="processes per depot")
+    parser.add_argument("--bikes", type=int, default=200, help="bikes per depot")
+    parser.add_argument("--cycles", type=int, default=300, help="rent+return per process")
+    parser.add_argument("--read-bikes", type=int, default=100_000, help="per depot")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shared = os.path.join(tmp, "shared.db")
+        setup_shared(shared, args.depots, args.bikes)
+        depot_list = setup_sharded(tmp, args.depots, args.bikes)
+
+        processes = args.depots * args.counters
+        operations = processes * args.cycles * 2
+        print(
+            f"{args.depots} depots x {args.counters} counters, "
+            f"{args.cycles} rent+return cycles each"
+        )
+        for name, target in (("shared", shared), ("sharded", depot_list)):
+            elapsed, lock_wait, retries, refused = run_counters(
+                target, args.depots, args.counters, args.bikes, args.cycles
+            )
+            print(
+                f"  {name:<9}{operations / elapsed:8.0f} ops/s   "
+                f"lock wait {lock_wait:6.2f}s per counter   "
+                f"{retries} busy retries, {refused} refused"
+            )
+
+        read_depots = []
+        for depot in depot_list:
+            read = depots.Depot(depot.number, depot.name, depot.path + ".read")
+            conn = connect(read.path)
+            depots.init_depot(conn, read)
+            add_bikes(conn, args.read_bikes, depot.number)
+            conn.close()
+            read_depots.append(read)
+        print(f"Reads over {args.depots} depots of {args.read_bikes} bikes")
+        for (name, mode), seconds in sorted(time_reads(read_depots, args.repeat).items()):
+            print(f"  {name:<12}{mode:<12}{seconds * 1e3:9.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
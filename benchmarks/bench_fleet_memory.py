@@ -0,0 +1,108 @@
+"""Resident memory of the in-memory fleet: dict per row versus columns.
+
+    python benchmarks/bench_fleet_memory.py --bikes 1000000 --rentals 500000
+
+Loads the same synthetic database twice and measures, with tracemalloc,
+how much memory each representation keeps after loading:
+
+    dicts     what FleetStore used to hold: a dict per bike and per rental,
+              keyed by id, plus sets of ids per type and availability
+    columns   the current FleetStore: typed arrays, name blob, bitmaps and
+              interned strings
+
+Also times the load and a few lookups on each.
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import connect  # noqa: E402
+from fleet_store import (  # noqa: E402
+    BIKE_COLUMNS,
+    RENTAL_COLUMNS,
+    FleetStore,
+    bike_from_row,
+    rental_from_row,
+)
+from synthetic import cached_db  # noqa: E402
+
+
+class DictFleet:
+    # The previous FleetStore layout, kept here for comparison
+
+    def __init__(self):
+        self.bikes = {}
+        self.rentals = {}
+        self.available_ids = set()
+        self.by_type = {}
+        self.available_by_type = {}
+
+    def load(self, conn):
+        for row in conn.execute(f"SELECT {BIKE_COLUMNS} FROM Bikes ORDER BY id"):
+            bike = bike_from_row(row)
+            self.bikes[bike["id"]] = bike
+            self.by_type.setdefault(bike["type"], set()).add(bike["id"])
+            if bike["available"]:
+                self.available_ids.add(bike["id"])
+                self.available_by_type.setdefault(bike["type"], set()).add(bike["id"])
+        for row in conn.execute(f"SELECT {RENTAL_COLUMNS} FROM Rentals"):
+            rental = rental_from_row(row)
+            self.rentals[rental["bike_id"]] = rental
+
+    def get_bike(self, bike_id):
+        return self.bikes.get(bike_id)
+
+
+def measure(make, conn):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    fleet = make()
+    fleet.load(conn)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return fleet, current, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bikes", type=int, default=1_000_000)
+    parser.add_argument("--rentals", type=int, default=None, help="default: half")
+    parser.add_argument("--lookups", type=int, default=100_000)
+    args = parser.parse_args()
+    rentals = args.bikes // 2 if args.rentals is None else args.rentals
+
+    conn = connect(cached_db(args.bikes, rentals))
+    rng = random.Random(0)
+    bike_ids = [rng.randint(1, args.bikes) for _ in range(args.lookups)]
+
+    print(f"{args.bikes} bikes, {rentals} rentals")
+    results = {}
+    for name, make in (("dicts", DictFleet), ("columns", FleetStore)):
+        fleet, current, peak, elapsed = measure(make, conn)
+        start = time.perf_counter()
+        for bike_id in bike_ids:
+            fleet.get_bike(bike_id)["price_per_hour"]
+        lookup = (time.perf_counter() - start) / len(bike_ids)
+        results[name] = current
+        print(
+            f"  {name:<8}{current / 2**20:9.1f} MiB kept "
+            f"({current / args.bikes:6.1f} bytes/bike), peak {peak / 2**20:8.1f} MiB, "
+            f"load {elapsed:6.2f}s, get_bike {lookup * 1e6:5.2f}us"
+        )
+        del fleet
+    conn.close()
+    print(f"  columns use {results['dicts'] / results['columns']:.1f}x less memory")
+
+
+if __name__ == "__main__":
+    main()
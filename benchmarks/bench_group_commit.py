@@ -0,0 +1,176 @@
+"""Group commit versus one commit per operation.
+
+    python benchmarks/bench_group_commit.py --threads 16 --cycles 100
+
+Every thread plays a busy counter: it rents and returns its own bikes as
+fast as it can. The same run is done with each write mode:
+
+    direct     every operation is its own BEGIN IMMEDIATE transaction on the
+               thread's connection (what the app does by default)
+    group      operations go through one group_commit.GroupCommitter
+    journal    the same, also appending each group to a journal with one
+               fsync before the operations are acknowledged
+
+for each database profile ("fast" only fsyncs at checkpoints, "safe" on
+every commit), and reports throughput and per-operation latency. --batch-ms
+shows the latency/throughput trade-off of waiting for bigger groups.
+
+Before timing anything it checks that every write the app makes (sign-up,
+add bike, rent, return) goes through the group committers of a
+depots.DepotSet with a journal, as bike-rent.py --group-commit --journal
+runs them.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import connect  # noqa: E402
+import depots  # noqa: E402
+from group_commit import BATCH_MAX, GroupCommitter  # noqa: E402
+from migrations import migrate  # noqa: E402
+from rental_tx import RentalError  # noqa: E402
+import rental_service  # noqa: E402
+
+
+def setup(path, n_bikes, profile):
+    conn = connect(path, profile)
+    migrate(conn)
+    conn.executemany(
+        "INSERT INTO Bikes (name, type, price_per_hour, available) VALUES (?, ?, ?, 1)",
+        ((f"Bike {i}", "City", 10) for i in range(n_bikes)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def check_depot_set(tmp):
+    depot_list = []
+    for number in range(2):
+        depot = depots.Depot(number, f"Depot {number}", os.path.join(tmp, f"d{number}.db"))
+        conn = connect(depot.path)
+        depots.init_depot(conn, depot)
+        conn.close()
+        depot_list.append(depot)
+    depot_set = depots.DepotSet(depot_list)
+    depot_set.start_group_commit("check")
+    try:
+        depots.sign_up(depot_set, "alice", "secret1")
+        assert depots.login(depot_set, "alice", "secret1")["username"] == "alice"
+        bike = depots.add_bike(depot_set, depot_list[1], "Check", "City", 10)
+        assert depot_set.owner(bike["id"]) is depot_list[1]
+        depots.rent_bike(depot_set, bike["id"], "alice", 1)
+        depots.return_bike(depot_set, bike["id"])
+    finally:
+        depot_set.shutdown()
+        depot_set.close()
+
+
+def counter(mode, path, profile, committer, bikes, cycles, latencies):
+    conn = connect(path, profile) if mode == "direct" else None
+
+    def write(name, params):
+        if conn is not None:
+            return rental_service.run_batch(conn, [(name, params)])[0]
+        return committer.call(name, params)
+
+    for i in range(cycles):
+        bike_id = bikes[i % len(bikes)]
+        for name, params in (
+            ("rent", {"bike_id": bike_id, "customer_name": "Bench", "hours": 1}),
+            ("return", {"bike_id": bike_id}),
+        ):
+            start = time.perf_counter()
+            try:
+                write(name, params)
+            except RentalError:
+                pass
+            latencies.append(time.perf_counter() - start)
+    if conn is not None:
+        conn.close()
+
+
+def run(mode, profile, args, tmp):
+    path = os.path.join(tmp, f"{mode}-{profile}.db")
+    setup(path, args.threads * args.bikes, profile)
+    committer = None
+    if mode != "direct":
+        committer = GroupCommitter(
+            path,
+            "bench" if mode == "journal" else None,
+            profile,
+            args.batch_max,
+            args.batch_ms / 1000,
+        )
+    latencies = []
+    threads = [
+        threading.Thread(
+            target=counter,
+            args=(
+                mode,
+                path,
+                profile,
+                committer,
+                list(range(i * args.bikes + 1, (i + 1) * args.bikes + 1)),
+                args.cycles,
+                latencies,
+            ),
+        )
+        for i in range(args.threads)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    groups = None
+    if committer is not None:
+        groups = committer.stats["groups"]
+        committer.close()
+    latencies.sort()
+    return (
+        len(latencies) / elapsed,
+        statistics.median(latencies),
+        latencies[int(len(latencies) * 0.99)],
+        groups,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--bikes", type=int, default=10, help="bikes per thread")
+    parser.add_argument("--cycles", type=int, default=100, help="rent+return per thread")
+    parser.add_argument("--batch-max", type=int, default=BATCH_MAX)
+    parser.add_argument("--batch-ms", type=float, default=2.0)
+    parser.add_argument("--profiles", default="fast,safe")
+    args = parser.parse_args()
+
+    print(
+        f"{args.threads} counters x {args.cycles} rent+return, "
+        f"groups of up to {args.batch_max} within {args.batch_ms}ms"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        check_depot_set(tmp)
+        for profile in args.profiles.split(","):
+            for mode in ("direct", "group", "journal"):
+                ops, median, p99, groups = run(mode, profile, args, tmp)
+                per_group = ""
+                if groups:
+                    operations = args.threads * args.cycles * 2
+                    per_group = f"   {operations / groups:5.1f} ops/commit"
+                print(
+                    f"  {profile:<5} {mode:<8}{ops:8.0f} ops/s   "
+                    f"median {median * 1e3:7.2f}ms   p99 {p99 * 1e3:7.2f}ms{per_group}"
+                )
+
+
+if __name__ == "__main__":
+    main()
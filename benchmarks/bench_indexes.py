@@ -0,0 +1,102 @@
+"""Lookup latency on the legacy schema versus the migrated one.
+
+Builds a throwaway database with the original (index-less, TEXT availability)
+schema, times the lookups the app does on every rent/return, runs the
+migrations and times the same lookups again.
+
+    python benchmarks/bench_indexes.py --bikes 100000 --rentals 50000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import create_base_tables, migrate  # noqa: E402
+
+TYPES = ["Mountain", "Road", "Cruiser", "Sport", "Classic", "Touring", "Racing"]
+
+
+def build_legacy_db(path, n_bikes, n_rentals, seed=0):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    create_base_tables(conn)
+    conn.executemany(
+        "INSERT INTO Bikes (name, type, price_per_hour, available) VALUES (?, ?, ?, ?)",
+        (
+            (f"Bike {i}", rng.choice(TYPES), rng.randint(5, 30), "1")
+            for i in range(n_bikes)
+        ),
+    )
+    rented = rng.sample(range(1, n_bikes + 1), min(n_rentals, n_bikes))
+    conn.executemany(
+        "INSERT INTO Rentals (bike_id, customer_name, hours, total_cost) VALUES (?, ?, ?, ?)",
+        ((bike_id, f"Customer {bike_id}", 2, 20.0) for bike_id in rented),
+    )
+    conn.executemany(
+        "UPDATE Bikes SET available = '0' WHERE id = ?", ((b,) for b in rented)
+    )
+    conn.commit()
+    return conn
+
+
+def time_queries(conn, bike_ids, repeat):
+    results = {}
+    queries = {
+        "rental_by_bike_id": (
+            "SELECT customer_name FROM Rentals WHERE bike_id = ?",
+            [(bike_id,) for bike_id in bike_ids],
+        ),
+        "available_of_type": (
+            "SELECT COUNT(*) FROM Bikes WHERE available = 1 AND type = ?",
+            [(TYPES[i % len(TYPES)],) for i in range(len(bike_ids))],
+        ),
+    }
+    for name, (sql, params) in queries.items():
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for args in params:
+                conn.execute(sql, args).fetchall()
+            best = min(best, time.perf_counter() - start)
+        results[name] = best / len(params) * 1e6  # microseconds per lookup
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bikes", type=int, default=100_000)
+    parser.add_argument("--rentals", type=int, default=20_000)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = build_legacy_db(os.path.join(tmp, "bench.db"), args.bikes, args.rentals)
+        rng = random.Random(1)
+        bike_ids = [rng.randint(1, args.bikes) for _ in range(args.lookups)]
+
+        before = time_queries(conn, bike_ids, args.repeat)
+        start = time.perf_counter()
+        migrate(conn)
+        migrate_seconds = time.perf_counter() - start
+        after = time_queries(conn, bike_ids, args.repeat)
+        conn.close()
+
+    print(f"{args.bikes} bikes, {args.rentals} rentals")
+    print(f"migration took {migrate_seconds:.2f}s")
+    print(f"{'query':<20}{'before (us)':>14}{'after (us)':>14}{'speedup':>10}")
+    for name in before:
+        print(
+            f"{name:<20}{before[name]:>14.1f}{after[name]:>14.1f}"
+            f"{before[name] / after[name]:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
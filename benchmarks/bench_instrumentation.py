@@ -0,0 +1,93 @@
+"""What instrumentation costs: rent/return cycles with metrics off and on.
+
+    python benchmarks/bench_instrumentation.py --cycles 2000
+
+Runs the same rent + return loop (two BEGIN IMMEDIATE transactions, about
+fifteen statements) on a temporary database three times:
+
+    off        instrumentation disabled: plain sqlite3 connections
+    on         TracedConnection, trace callback, spans around each call
+    baseline   off again, to show the run-to-run noise
+
+and times a call through a @timed function while disabled against calling
+the undecorated function.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import connect  # noqa: E402
+import instrumentation  # noqa: E402
+from migrations import migrate  # noqa: E402
+from rental_tx import rent, return_bike  # noqa: E402
+
+
+def cycles(path, n):
+    conn = connect(path)
+    start = time.perf_counter()
+    for i in range(n):
+        bike_id = i % 10 + 1
+        with instrumentation.span("rent"):
+            rent(conn, bike_id, "Bench", 1)
+        with instrumentation.span("return"):
+            return_bike(conn, bike_id)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cycles", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        conn = connect(path)
+        migrate(conn)
+        conn.executemany(
+            "INSERT INTO Bikes (name, type, price_per_hour, available) "
+            "VALUES (?, 'Road', 10, 1)",
+            ((f"Bike {i}",) for i in range(10)),
+        )
+        conn.commit()
+        conn.close()
+
+        cycles(path, 100)  # warm up
+        results = {}
+        for name, enabled in (("off", False), ("on", True), ("baseline", False)):
+            if enabled:
+                instrumentation.enable(slow_ms=1e9)
+            else:
+                instrumentation.disable()
+            results[name] = cycles(path, args.cycles)
+        statements = sum(
+            h["count"] for h in instrumentation.metrics.snapshot()["sql"].values()
+        )
+
+    print(f"{args.cycles} rent/return cycles")
+    for name, elapsed in results.items():
+        print(
+            f"  {name:<9}{elapsed:7.3f}s   {elapsed / args.cycles * 1e6:8.1f}us/cycle"
+            f"   {(elapsed / results['off'] - 1) * 100:+6.1f}% vs off"
+        )
+    print(f"  ({statements} statements timed while on)")
+
+    def plain():
+        return None
+
+    traced = instrumentation.timed("noop")(plain)
+    n = 1_000_000
+    plain_ns = timeit.timeit(plain, number=n) / n * 1e9
+    traced_ns = timeit.timeit(traced, number=n) / n * 1e9
+    print(f"@timed call while off: {traced_ns:.0f}ns vs {plain_ns:.0f}ns undecorated")
+
+
+if __name__ == "__main__":
+    main()
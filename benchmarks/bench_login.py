@@ -0,0 +1,111 @@
+"""Login latency with hashed passwords, checked against a p99 target.
+
+    python benchmarks/bench_login.py --users 200 --logins 500 --target-ms 150
+
+Creates a throwaway database of users with hashed passwords and measures
+rental_service.login for three cases:
+
+    first     first login of each user (full key derivation)
+    repeat    the same users again (served by the auth cache, no KDF)
+    legacy    plaintext rows from before hashing (verify + rehash + write)
+
+Pass --threads to log in from several threads at once, as the API's read
+pool does. The exit status is 1 if the p99 of "first" logins is over
+--target-ms, so the work factor (BIKE_RENT_PBKDF2_ITERATIONS) can be tuned
+to the hardware the counters run on.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth  # noqa: E402
+import rental_service  # noqa: E402
+from db import connect  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def report(name, samples):
+    ms = [sample * 1e3 for sample in samples]
+    print(
+        f"  {name:<8}n={len(ms):<6}p50 {percentile(ms, 0.50):8.2f}ms"
+        f"   p95 {percentile(ms, 0.95):8.2f}ms   p99 {percentile(ms, 0.99):8.2f}ms"
+    )
+    return percentile(ms, 0.99)
+
+
+def timed_logins(path, usernames, threads):
+    # One connection per worker thread, like the API's read pool
+    local = threading.local()
+
+    def one(username):
+        if not hasattr(local, "conn"):
+            local.conn = connect(path)
+        start = time.perf_counter()
+        rental_service.login(local.conn, username, "secret-" + username)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(one, usernames))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--logins", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--target-ms", type=float, default=150.0)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"PBKDF2-SHA256 with {auth.ITERATIONS} iterations, {args.threads} thread(s)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "login.db")
+        conn = connect(path)
+        migrate(conn)
+        users = [f"user{i:05d}" for i in range(args.users)]
+        legacy = [f"old{i:05d}" for i in range(args.users)]
+        conn.executemany(
+            "INSERT INTO Users (username, password, role) VALUES (?, ?, 'user')",
+            [(name, auth.hash_password("secret-" + name)) for name in users]
+            + [(name, "secret-" + name) for name in legacy],
+        )
+        conn.commit()
+
+        first = timed_logins(path, users, args.threads)
+        repeat_names = [rng.choice(users) for _ in range(args.logins)]
+        repeat = timed_logins(path, repeat_names, args.threads)
+        legacy_times = timed_logins(path, legacy, args.threads)
+
+        rehashed = conn.execute(
+            "SELECT COUNT(*) FROM Users WHERE username LIKE 'old%' AND password LIKE ?",
+            (auth.ALGORITHM + "$%",),
+        ).fetchone()[0]
+        conn.close()
+
+    p99 = report("first", first)
+    report("repeat", repeat)
+    report("legacy", legacy_times)
+    print(f"  {rehashed}/{len(legacy)} plaintext passwords rehashed on login")
+
+    if p99 > args.target_ms:
+        print(f"FAILED: first-login p99 {p99:.1f}ms is over the {args.target_ms}ms target")
+        sys.exit(1)
+    print(f"OK: first-login p99 {p99:.1f}ms is within the {args.target_ms}ms target")
+
+
+if __name__ == "__main__":
+    main()
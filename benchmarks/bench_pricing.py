@@ -0,0 +1,162 @@
+"""Cost of dynamic pricing: quotes and whole-fleet hourly rates.
+
+    python benchmarks/bench_pricing.py --bikes 1000000 --quotes 100000
+
+Quotes: pricing.quote as rent_bike calls it, against a rule set with every
+kind of rule, compared with applying the same rules directly hour by hour
+(what a quote would cost without the compiled tables and the memo). The
+memo is cleared before the "cold" run.
+
+Fleet: the current hourly rate of every bike of a FleetStore, computed at
+once from its columns (pricing.fleet_rates, NumPy when installed) versus
+one pricing.quote per bike.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics  # noqa: E402
+from db import connect  # noqa: E402
+from fleet_store import FleetStore  # noqa: E402
+from migrations import migrate  # noqa: E402
+import pricing  # noqa: E402
+
+TYPES = ("Road", "City", "Mountain", "Cargo", "Electric")
+RULES = (
+    ("hours", 1.5, 7, 10, None),
+    ("hours", 1.3, 16, 19, None),
+    ("hours", 0.7, 22, 6, None),
+    ("weekend", 1.2, None, None, "Road"),
+    ("type", 1.1, None, None, "Electric"),
+    ("duration", 0.9, 4, None, None),
+    ("duration", 0.75, 24, None, None),
+    ("demand", 1.25, 0.5, None, None),
+)
+
+
+def direct_quote(conn, rules, bike_type, price, hours, start):
+    # The same rules applied without compiled tables or memo
+    factor = 0.0
+    for i in range(hours):
+        moment = start + timedelta(hours=i)
+        multiplier = 1.0
+        for rule in rules:
+            if rule["bike_type"] not in (None, bike_type):
+                continue
+            if rule["kind"] == "hours" and pricing.in_hours(
+                moment.hour, rule["low"], rule["high"]
+            ):
+                multiplier *= rule["multiplier"]
+            elif rule["kind"] == "weekend" and moment.weekday() >= 5:
+                multiplier *= rule["multiplier"]
+        factor += multiplier
+    duration = demand = (None, 1.0)
+    share = pricing.utilization(conn, bike_type)
+    for rule in rules:
+        if rule["bike_type"] not in (None, bike_type):
+            continue
+        if rule["kind"] == "type":
+            factor *= rule["multiplier"]
+        elif rule["kind"] == "duration" and hours >= rule["low"]:
+            if duration[0] is None or rule["low"] >= duration[0]:
+                duration = (rule["low"], rule["multiplier"])
+        elif rule["kind"] == "demand" and share >= rule["low"]:
+            if demand[0] is None or rule["low"] >= demand[0]:
+                demand = (rule["low"], rule["multiplier"])
+    return round(price * factor * duration[1] * demand[1], 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bikes", type=int, default=1_000_000)
+    parser.add_argument("--quotes", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = connect(os.path.join(tmp, "pricing.db"))
+        migrate(conn)
+        conn.executemany(
+            "INSERT INTO Bikes (name, type, price_per_hour, available) VALUES (?, ?, ?, ?)",
+            (
+                (f"Bike {i}", TYPES[i % len(TYPES)], 5 + i % 20, int(rng.random() > 0.6))
+                for i in range(10_000)
+            ),
+        )
+        conn.commit()
+        for kind, multiplier, low, high, bike_type in RULES:
+            pricing.add_rule(conn, kind, multiplier, low, high, bike_type)
+        rules = pricing.list_rules(conn)
+
+        # Rentals start on the hour at the counter, so start buckets repeat
+        base = datetime(2024, 6, 3)
+        requests = [
+            (
+                rng.choice(TYPES),
+                rng.randint(5, 25),
+                rng.choice((1, 1, 2, 2, 3, 4, 8, 24)),
+                base + timedelta(hours=rng.randrange(pricing.HOURS_PER_WEEK)),
+            )
+            for _ in range(args.quotes)
+        ]
+        for bike_type, price, hours, start in requests[:200]:
+            # Equal up to rounding half a cent the other way
+            expected = direct_quote(conn, rules, bike_type, price, hours, start)
+            quoted = pricing.quote(conn, bike_type, price, hours, start)
+            assert abs(quoted - expected) < 0.011
+
+        print(f"{args.quotes} quotes, {len(RULES)} rules")
+        direct_requests = requests[: max(1, args.quotes // 20)]
+        start_time = time.perf_counter()
+        for bike_type, price, hours, start in direct_requests:
+            direct_quote(conn, rules, bike_type, price, hours, start)
+        per_quote = (time.perf_counter() - start_time) / len(direct_requests)
+        print(f"  {'rules applied directly':<26}{per_quote * 1e6:8.1f}us/quote")
+        for name in ("compiled, cold memo", "compiled, warm memo"):
+            if name.endswith("cold memo"):
+                pricing._compiled.clear()
+            start_time = time.perf_counter()
+            for bike_type, price, hours, start in requests:
+                pricing.quote(conn, bike_type, price, hours, start)
+            per_quote = (time.perf_counter() - start_time) / len(requests)
+            print(f"  {name:<26}{per_quote * 1e6:8.1f}us/quote")
+
+        fleet = FleetStore()
+        fleet.load_rows(
+            (
+                (i, f"Bike {i}", TYPES[i % len(TYPES)], 5 + i % 20, 1)
+                for i in range(1, args.bikes + 1)
+            ),
+            (),
+        )
+        print(
+            f"{args.bikes} bikes, hourly rate of every bike "
+            f"({'NumPy' if analytics.load_numpy() else 'no NumPy'})"
+        )
+        start_time = time.perf_counter()
+        _, rates = pricing.fleet_rates(conn, fleet, base)
+        print(f"  {'fleet_rates':<26}{(time.perf_counter() - start_time) * 1e3:8.1f}ms")
+        sample = range(1, args.bikes + 1, max(1, args.bikes // 10_000))
+        start_time = time.perf_counter()
+        for bike_id in sample:
+            bike = fleet.get_bike(bike_id)
+            rate = pricing.quote(conn, bike.type, bike.price_per_hour, 1, base)
+            assert abs(rate - rates[bike_id - 1]) < 0.01
+        per_bike = (time.perf_counter() - start_time) / len(sample)
+        print(
+            f"  {'one quote per bike':<26}{per_bike * args.bikes * 1e3:8.1f}ms "
+            f"(from {len(sample)} bikes)"
+        )
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Reservation engine: conflict checks, free-bike queries and concurrent booking.
+
+    python benchmarks/bench_reservations.py --bikes 1000 --reservations 300000
+
+Fills a temporary database with non-overlapping future reservations and
+times, per call:
+
+    conflict      reservations.conflict: one probe of the (bike_id,
+                  starts_at) index, whatever the number of reservations
+    overlap_scan  the textbook overlap test (starts_at < end AND ends_at >
+                  start), which has to walk every earlier reservation of the
+                  bike; what the check would cost without the no-overlap
+                  invariant
+    free_page     reservations.free_bikes, one page of 100 free bikes
+
+Then several processes book random slots on a few bikes at once through
+rental_tx.reserve, and the result is checked for overlapping reservations.
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import connect  # noqa: E402
+from migrations import migrate  # noqa: E402
+from rental_tx import RentalError, reserve  # noqa: E402
+import reservations  # noqa: E402
+
+EPOCH = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(days=1)
+
+
+def at(hours):
+    return (EPOCH + timedelta(hours=hours)).strftime(reservations.TIME_FORMAT)
+
+
+def setup_db(path, n_bikes, n_reservations, seed=1):
+    rng = random.Random(seed)
+    conn = connect(path)
+    migrate(conn)
+    conn.executemany(
+        "INSERT INTO Bikes (name, type, price_per_hour, available) VALUES (?, ?, ?, 1)",
+        ((f"Bike {i}", "Road", 10) for i in range(n_bikes)),
+    )
+
+    # Back-to-back bookings of 1-4 hours with gaps of 0-6 hours, per bike
+    def rows():
+        per_bike = n_reservations // n_bikes
+        for bike_id in range(1, n_bikes + 1):
+            hour = rng.randint(0, 6)
+            for _ in range(per_bike):
+                length = rng.randint(1, 4)
+                yield bike_id, f"Customer {bike_id}", at(hour), at(hour + length)
+                hour += length + rng.randint(0, 6)
+
+    conn.executemany(
+        """INSERT INTO Reservations (bike_id, customer_name, starts_at, ends_at)
+           VALUES (?, ?, ?, ?)""",
+        rows(),
+    )
+    conn.commit()
+    (horizon,) = conn.execute("SELECT MAX(ends_at) FROM Reservations").fetchone()
+    conn.close()
+    return horizon
+
+
+def overlap_scan(conn, bike_id, starts_at, ends_at):
+    return conn.execute(
+        """SELECT 1 FROM Reservations
+           WHERE bike_id = ? AND starts_at < ? AND ends_at > ? LIMIT 1""",
+        (bike_id, ends_at, starts_at),
+    ).fetchone()
+
+
+def report(name, samples):
+    ms = sorted(sample * 1e3 for sample in samples)
+    p95 = ms[int(len(ms) * 0.95) - 1]
+    print(
+        f"  {name:<14}median {statistics.median(ms):8.3f}ms"
+        f"   p95 {p95:8.3f}ms   ({len(ms)} calls)"
+    )
+
+
+def time_queries(path, n_bikes, horizon_hours, calls):
+    rng = random.Random(2)
+    conn = connect(path)
+    results = {"conflict": [], "overlap_scan": [], "free_page": []}
+    for _ in range(calls):
+        bike_id = rng.randint(1, n_bikes)
+        # Late slots are the worst case for the scan
+        hour = rng.uniform(horizon_hours * 0.5, horizon_hours)
+        slot = (at(hour), at(hour + rng.randint(1, 4)))
+        for name, func in (
+            ("conflict", reservations.conflict),
+            ("overlap_scan", overlap_scan),
+        ):
+            start = time.perf_counter()
+            func(conn, bike_id, *slot)
+            results[name].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        reservations.free_bikes(conn, *slot)
+        results["free_page"].append(time.perf_counter() - start)
+    conn.close()
+    return results
+
+
+def booker(path, worker_id, n_ops, n_bikes, results):
+    rng = random.Random(100 + worker_id)
+    conn = connect(path)
+    booked = 0
+    for _ in range(n_ops):
+        hour = rng.randint(0, 48)
+        try:
+            reserve(
+                conn,
+                rng.randint(1, n_bikes),
+                f"Terminal {worker_id}",
+                at(hour),
+                at(hour + rng.randint(1, 3)),
+            )
+            booked += 1
+        except RentalError:
+            pass
+    conn.close()
+    results.put(booked)
+
+
+def overlaps(path):
+    # Pairs of consecutive reservations of a bike that overlap
+    conn = connect(path)
+    (count,) = conn.execute(
+        """SELECT COUNT(*) FROM (
+               SELECT starts_at, LAG(ends_at) OVER (
+                   PARTITION BY bike_id ORDER BY starts_at
+               ) AS previous_end
+               FROM Reservations
+           ) WHERE starts_at < previous_end"""
+    ).fetchone()
+    conn.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bikes", type=int, default=1000)
+    parser.add_argument("--reservations", type=int, default=300000)
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=200, help="bookings per process")
+    parser.add_argument("--contended-bikes", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "reservations.db")
+        start = time.perf_counter()
+        horizon = setup_db(path, args.bikes, args.reservations)
+        print(
+            f"{args.reservations} reservations on {args.bikes} bikes "
+            f"(built in {time.perf_counter() - start:.1f}s)"
+        )
+        horizon_hours = (
+            datetime.strptime(horizon, reservations.TIME_FORMAT).replace(
+                tzinfo=timezone.utc
+            )
+            - EPOCH
+        ).total_seconds() / 3600
+        for name, samples in time_queries(
+            path, args.bikes, horizon_hours, args.calls
+        ).items():
+            report(name, samples)
+
+        contended = os.path.join(tmp, "contended.db")
+        setup_db(contended, args.contended_bikes, 0)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=booker,
+                args=(contended, i, args.ops, args.contended_bikes, results),
+            )
+            for i in range(args.processes)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        booked = sum(results.get() for _ in processes)
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        total = args.processes * args.ops
+        print(
+            f"{total} booking attempts from {args.processes} processes on "
+            f"{args.contended_bikes} bikes in {elapsed:.2f}s: {booked} booked"
+        )
+        found = overlaps(contended)
+        if found:
+            print(f"FAILED: {found} overlapping reservations")
+            sys.exit(1)
+        print("OK: no overlapping reservations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Thumbnail cost: the old synchronous resize against the thumbnail cache.
+
+    python benchmarks/bench_thumbnails.py --photos 20 --width 4000 --height 3000
+
+Writes synthetic JPEG photos to a temporary directory and times, per photo:
+
+    full_decode   Image.open + resize((200, 200)), what viewDetails used to
+                  do on the Tk thread on every open
+    cold          bike_images.make_thumbnail with an empty cache (draft
+                  decode + thumbnail + PNG write), now on a worker thread
+    warm          make_thumbnail when the thumbnail is already on disk
+
+Needs Pillow.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bike_images  # noqa: E402
+
+try:
+    from PIL import Image
+except ImportError:
+    sys.exit("bench_thumbnails needs Pillow (pip install pillow)")
+
+
+def make_photo(path, width, height, seed):
+    # A gradient with some noise, so JPEG has real work to do
+    image = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + seed % 20)
+    Image.merge("RGB", (image, noise, image.rotate(90))).save(path, quality=90)
+
+
+def report(name, samples):
+    ms = sorted(sample * 1e3 for sample in samples)
+    print(
+        f"  {name:<12}median {statistics.median(ms):9.2f}ms"
+        f"   max {ms[-1]:9.2f}ms   ({len(ms)} photos)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--photos", type=int, default=10)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        photos = []
+        for i in range(args.photos):
+            path = os.path.join(tmp, f"photo-{i}.jpg")
+            make_photo(path, args.width, args.height, i)
+            photos.append((path, bike_images.file_digest(path)))
+        cache_dir = os.path.join(tmp, "thumbnails")
+
+        results = {"full_decode": [], "cold": [], "warm": []}
+        for path, digest in photos:
+            start = time.perf_counter()
+            with Image.open(path) as image:
+                image.resize(bike_images.DETAIL_SIZE)
+            results["full_decode"].append(time.perf_counter() - start)
+
+            for phase in ("cold", "warm"):
+                start = time.perf_counter()
+                bike_images.make_thumbnail(
+                    path, digest, bike_images.DETAIL_SIZE, cache_dir
+                )
+                results[phase].append(time.perf_counter() - start)
+
+    print(f"{args.photos} photos of {args.width}x{args.height}")
+    for name, samples in results.items():
+        report(name, samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Stand-in for ttk.Treeview when no display is available.
+
+Implements the part of the Treeview API that TreeSync uses and counts every
+widget call, so refresh benchmarks can report both time and how many
+insert/item/delete/move calls a real Treeview would have received.
+"""
+
+import itertools
+import os
+
+
+class FakeTreeview:
+    def __init__(self):
+        self.order = []
+        self.values = {}
+        self.calls = 0
+        self._ids = itertools.count()
+
+    def insert(self, parent, index, values=(), tags=()):
+        self.calls += 1
+        item = f"I{next(self._ids):06X}"
+        if index == "end":
+            self.order.append(item)
+        else:
+            self.order.insert(index, item)
+        self.values[item] = (values, tags)
+        return item
+
+    def item(self, item, values=(), tags=()):
+        self.calls += 1
+        self.values[item] = (values, tags)
+
+    def delete(self, *items):
+        for item in items:
+            self.calls += 1
+            self.order.remove(item)
+            del self.values[item]
+
+    def move(self, item, parent, index):
+        self.calls += 1
+        self.order.remove(item)
+        self.order.insert(index, item)
+
+    def get_children(self, item=""):
+        return tuple(self.order)
+
+
+def make_treeview():
+    # A real Treeview when a display is available, otherwise the stand-in.
+    # Returns (tree, root); root is None for the stand-in.
+    if os.environ.get("DISPLAY"):
+        try:
+            from tkinter import Tk, ttk
+
+            root = Tk()
+            root.withdraw()
+            return ttk.Treeview(root, columns=tuple(range(5)), show="headings"), root
+        except Exception:
+            pass
+    return FakeTreeview(), None
@@ -0,0 +1,272 @@
+"""Two kiosks, a network partition and a stand-in primary.
+
+    python benchmarks/kiosk_sim.py --bikes 200 --offline-ops 1000 --depots 2
+
+Runs api_server.py on temporary depots (see depots) in a separate process
+as the primary store and gives two kiosk replicas (see kiosk) a partition.
+The bikes are spread over the depots and the contested bike is in the last
+one, so rentals and returns made at the kiosks reach every depot:
+
+1. Both kiosks are created from the primary. Kiosk A rents a bike and
+   kiosk B sees it after a sync.
+2. The primary process is stopped. Both kiosks rent the same bike to
+   different customers, kiosk B then takes its customer's bike back, and
+   kiosk A works through --offline-ops more rentals and returns. All of
+   this succeeds locally and waits in the outboxes; a sync fails with
+   Offline.
+3. The primary is started again (forgetting its sessions). Kiosk A syncs
+   first and wins the contested bike. Kiosk B's rental and return of it come
+   back as conflicts, and after the next pull both replicas agree with the
+   primary.
+4. A batch that kiosk A already pushed is sent again, as after a lost
+   answer, and must change nothing.
+5. Kiosk A is set up again under the same name on a new replica file, as
+   after a disk swap. Its first rental must reach the primary, not be
+   taken for one of the old replica's operations.
+6. Another account sends operations under that kiosk's id, and the kiosk's
+   own account sends one that skips ahead of its outbox. Both are refused.
+
+Prints how long the backlog took to sync and checks every step.
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import connect  # noqa: E402
+import depots  # noqa: E402
+import kiosk  # noqa: E402
+import rental_service  # noqa: E402
+from rental_tx import RentalError  # noqa: E402
+
+USER, PASSWORD = "clerk", "kiosk-pass"
+OTHER_USER = "intruder"
+
+
+def setup_primary(tmp, n_bikes, n_depots):
+    # The depots' manifest; every depot gets its share of the bikes
+    depot_list = []
+    for number in range(n_depots):
+        path = os.path.join(tmp, f"primary-{number}.db")
+        depot = depots.Depot(number, f"Depot {number}", path)
+        conn = connect(depot.path)
+        depots.init_depot(conn, depot)
+        conn.executemany(
+            "INSERT INTO Bikes (name, type, price_per_hour, available) "
+            "VALUES (?, ?, ?, 1)",
+            ((f"Bike {i}", "City", 10) for i in range(number, n_bikes, n_depots)),
+        )
+        conn.commit()
+        if number == 0:
+            rental_service.sign_up(conn, USER, PASSWORD)
+            rental_service.sign_up(conn, OTHER_USER, PASSWORD)
+        conn.close()
+        depot_list.append(depot)
+    manifest = os.path.join(tmp, "depots.json")
+    depots.write_manifest(depot_list, manifest)
+    return manifest
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_primary(manifest, port):
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(ROOT, "api_server.py"),
+            "--depots",
+            manifest,
+            "--port",
+            str(port),
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("The stand-in primary did not start.")
+
+
+def state(*conns):
+    # {bike id: customer renting it or None} over one or more databases
+    bikes = {}
+    for conn in conns:
+        rented = dict(conn.execute("SELECT bike_id, customer_name FROM Rentals"))
+        for (bike_id,) in conn.execute("SELECT id FROM Bikes ORDER BY id"):
+            bikes[bike_id] = rented.get(bike_id)
+    return bikes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bikes", type=int, default=200)
+    parser.add_argument(
+        "--offline-ops", type=int, default=1000, help="kiosk A's backlog"
+    )
+    parser.add_argument("--depots", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manifest = setup_primary(tmp, args.bikes, args.depots)
+        primary_conns = [connect(depot.path) for depot in depots.read_manifest(manifest)]
+        bike_ids = sorted(state(*primary_conns))
+        last_depot = depots.depot_number(bike_ids[-1])
+        first = bike_ids[0]
+        contested = next(i for i in bike_ids[1:] if depots.depot_number(i) == last_depot)
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        primary = start_primary(manifest, port)
+        try:
+            kiosks = {}
+            for name in ("A", "B"):
+                replica = os.path.join(tmp, f"kiosk-{name}.db")
+                copied = kiosk.init_replica(replica, name, url, USER, PASSWORD)
+                assert copied == args.bikes
+                kiosks[name] = kiosk.Kiosk(replica)
+                kiosks[name].set_credentials(USER, PASSWORD)
+            a, b = kiosks["A"], kiosks["B"]
+
+            # 1. Online
+            a.call("rent", {"bike_id": str(first), "customer_name": "Ann", "hours": "2"})
+            a.sync()
+            b.sync()
+            assert state(b._conn())[first] == "Ann"
+            print("online: kiosk B sees kiosk A's rental after one sync")
+
+            # 2. Partition
+            primary.terminate()
+            primary.wait()
+            a.call("rent", {"bike_id": contested, "customer_name": "Ann", "hours": 1})
+            b.call("rent", {"bike_id": contested, "customer_name": "Bob", "hours": 1})
+            b.call("return", {"bike_id": contested})
+            spare = [i for i in bike_ids if i not in (first, contested)]
+            for i in range(args.offline_ops):
+                bike_id = spare[(i // 2) % len(spare)]
+                if i % 2 == 0:
+                    a.call(
+                        "rent", {"bike_id": bike_id, "customer_name": f"C{i}", "hours": 1}
+                    )
+                else:
+                    a.call("return", {"bike_id": bike_id})
+            try:
+                a.sync()
+                raise AssertionError("synced without a primary")
+            except kiosk.Offline:
+                pass
+            print(
+                f"partition: {a.pending_count()} operations waiting at A, "
+                f"{b.pending_count()} at B"
+            )
+
+            # 3. Back online; A first
+            primary = start_primary(manifest, port)
+            start = time.perf_counter()
+            summary = a.sync()
+            elapsed = time.perf_counter() - start
+            print(
+                f"  A pushed {summary['pushed']} operations in {elapsed * 1e3:.0f}ms "
+                f"({summary['pushed'] / elapsed:.0f} ops/s, "
+                f"{-(-summary['pushed'] // a.batch)} requests), "
+                f"{summary['conflicts']} refused"
+            )
+            summary = b.sync()
+            print(f"  B pushed {summary['pushed']}, {summary['conflicts']} refused:")
+            for conflict in b.conflicts():
+                print(
+                    f"    {conflict['op']} {json.dumps(conflict['params'])}: "
+                    f"{conflict['error']}"
+                )
+            assert summary["conflicts"] == 2
+            a.sync()
+
+            expected = state(*primary_conns)
+            assert expected[contested] == "Ann"
+            for name, replica in kiosks.items():
+                assert state(replica._conn()) == expected, f"kiosk {name} differs"
+            print("  both replicas agree with the primary")
+
+            # 4. A lost answer: the same batch again
+            before = state(*primary_conns)
+            rows = a._conn().execute(
+                "SELECT seq, op, params FROM Outbox ORDER BY seq DESC LIMIT 10"
+            ).fetchall()
+            results = a.client.request(
+                "POST",
+                "/sync",
+                {
+                    "kiosk": a.replica_id,
+                    "operations": [
+                        {"seq": seq, "op": op, "params": json.loads(params)}
+                        for seq, op, params in reversed(rows)
+                    ],
+                },
+            )
+            assert all(result["ok"] for result in results)
+            assert state(*primary_conns) == before
+            print("  a batch sent twice is applied once")
+
+            # 5. The same name on a new replica
+            for replica in kiosks.values():
+                replica.close()
+            replica = os.path.join(tmp, "kiosk-A-again.db")
+            kiosk.init_replica(replica, "A", url, USER, PASSWORD)
+            again = kiosk.Kiosk(replica)
+            again.set_credentials(USER, PASSWORD)
+            rented = state(*primary_conns)
+            free = max(bike_id for bike_id in rented if rented[bike_id] is None)
+            again.call("rent", {"bike_id": free, "customer_name": "Dee", "hours": 1})
+            summary = again.sync()
+            assert summary["conflicts"] == 0
+            rented = state(*primary_conns)
+            assert rented[free] == "Dee", "the new replica's rental was lost"
+            print("  a kiosk set up again under its old name syncs its own outbox")
+
+            # 6. Forged syncs
+            other = kiosk.PrimaryClient(url)
+            other.credentials = (OTHER_USER, PASSWORD)
+            before = state(*primary_conns)
+            for client in (other, again.client):
+                body = {
+                    "kiosk": again.replica_id,
+                    "operations": [
+                        {"seq": 1000, "op": "return", "params": {"bike_id": free}}
+                    ],
+                }
+                try:
+                    client.request("POST", "/sync", body)
+                    raise AssertionError("a forged sync was applied")
+                except RentalError:
+                    pass
+            assert state(*primary_conns) == before
+            again.call("return", {"bike_id": free})
+            assert again.sync()["conflicts"] == 0
+            assert state(*primary_conns)[free] is None, "the kiosk's return was lost"
+            print("  syncs from another account or skipping ahead are refused")
+            other.close()
+            again.close()
+            for conn in primary_conns:
+                conn.close()
+        finally:
+            primary.terminate()
+            primary.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+"""Load test: many simulated customers logging in, renting and returning.
+
+    python benchmarks/load_test.py --db bike-rental.db --rate 50 --duration 30
+    python benchmarks/load_test.py --synthetic 10000 --processes 8 --rate 200
+    python benchmarks/load_test.py --rate 100 --pattern rush --hot-bikes 20
+    python benchmarks/load_test.py --depots depots.json --rate 200
+
+Customers arrive as a Poisson process at --rate sessions per second in total
+(--pattern rush makes the rate climb to three times that in the middle of the
+run and fall off again, like a morning peak). Each session does what a
+counter does for one customer, through the same depots calls as
+loginPage, rent_bike and return_bike_func:
+
+    login    depots.login with one of --accounts load-test accounts
+    rent     depots.rent_bike on a free bike; a bike someone else got first
+             is refused and the customer tries another (--attempts)
+    return   depots.return_bike after an exponentially distributed ride of
+             --ride seconds on average
+
+The sessions are spread over --processes processes. Each runs an asyncio
+loop that starts the sessions on schedule and hands the database calls to
+--threads worker threads with a connection each, so every process behaves
+like a row of counters sharing the file, and the processes compete for the
+SQLite write lock the way separate terminals do.
+
+By default the run works on a copy of --db (migrated to the current schema
+and given the load-test accounts); --in-place writes to the file itself.
+--synthetic N uses a generated fleet of N bikes instead (see synthetic.py).
+--depots MANIFEST runs against every depot in a depots.json (copied the same
+way, accounts in the first depot): each customer picks a depot at random and
+rents one of its bikes, and --hot-bikes counts from the start of each depot's
+id block, so the run shows how much the depots' separate write locks help.
+
+Reports per operation: count, ok/refused/failed, p50/p95/p99/max latency,
+retries after SQLITE_BUSY and the total time spent waiting for the write
+lock (from rental_tx.immediate), plus achieved against offered throughput,
+how far behind schedule sessions started and how long calls waited for a
+free worker thread. Latencies are measured on the worker thread, so they
+are what one counter would see. A run that falls behind, queues up or whose
+p99 climbs is past what the depot can take; --output writes the figures as
+JSON for comparison between runs.
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from auth import hash_password  # noqa: E402
+from db import DB_FILE  # noqa: E402
+import depots  # noqa: E402
+import rental_service  # noqa: E402
+from rental_tx import RentalError, immediate  # noqa: E402
+from synthetic import cached_db  # noqa: E402
+
+OPERATIONS = ("login", "rent", "return")
+ACCOUNT_PREFIX = "load-customer-"
+PASSWORD = "load-test-pass"
+PEAK_FACTOR = 3.0  # rush: rate at the peak relative to --rate
+
+
+def copy_source(source, target):
+    # Read-only online backup: connect() would switch the source to WAL
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    src.backup(dst)
+    src.close()
+    dst.close()
+    return target
+
+
+def copy_depots(manifest, tmp):
+    # Copy every depot file of a manifest into tmp, with a manifest of its own
+    copies = [
+        depots.Depot(
+            depot.number,
+            depot.name,
+            copy_source(depot.path, os.path.join(tmp, f"load-{depot.number}.db")),
+        )
+        for depot in depots.read_manifest(manifest)
+    ]
+    target = os.path.join(tmp, depots.DEPOTS_FILE)
+    depots.write_manifest(copies, target)
+    return target
+
+
+def create_accounts(depot_set, count):
+    # Load-test accounts all share one password hash, so setting up a few
+    # hundred does not cost a few hundred key derivations
+    conn = depot_set.connection()
+    password_hash = hash_password(PASSWORD)
+
+    def work(db):
+        existing = {
+            row[0]
+            for row in db.execute(
+                "SELECT username FROM Users WHERE username LIKE ?",
+                (ACCOUNT_PREFIX + "%",),
+            )
+        }
+        for i in range(count):
+            username = f"{ACCOUNT_PREFIX}{i}"
+            if username not in existing:
+                rental_service.sign_up_hashed_in_tx(db, username, password_hash)
+
+    immediate(conn, work)
+
+
+def bike_ranges(depot_set, hot_bikes):
+    # (first, last) id of the bikes customers rent, for each depot that has
+    # any: its whole block, or its first hot_bikes ids
+    ranges = []
+    for depot in depot_set.depots:
+        first = depot.number * depots.ID_BLOCK + 1
+        last = (
+            depot_set.connection(depot)
+            .execute("SELECT MAX(id) FROM Bikes WHERE id >= ?", (first,))
+            .fetchone()[0]
+        )
+        if last is not None:
+            if hot_bikes:
+                last = min(last, first - 1 + hot_bikes)
+            ranges.append((first, last))
+    return ranges
+
+
+def rate_at(pattern, rate, duration, t):
+    # Arrival rate (sessions per second) t seconds into the run
+    if pattern == "rush":
+        return rate * (1 + (PEAK_FACTOR - 1) * math.sin(math.pi * t / duration) ** 2)
+    return rate
+
+
+def arrivals(rng, pattern, rate, duration):
+    # Start times of a Poisson process with rate_at(t), by thinning one that
+    # runs at the highest rate
+    peak = rate * (PEAK_FACTOR if pattern == "rush" else 1)
+    t = 0.0
+    while True:
+        t += rng.expovariate(peak)
+        if t >= duration:
+            return
+        if rng.random() * peak < rate_at(pattern, rate, duration, t):
+            yield t
+
+
+class Recorder:
+    # What one process saw; merged by the parent
+
+    def __init__(self):
+        self.ops = {
+            name: {
+                "latency": [],
+                "ok": 0,
+                "refused": 0,
+                "failed": 0,
+                "retries": 0,
+                "lock_wait": 0.0,
+            }
+            for name in OPERATIONS
+        }
+        self.errors = {}  # message: count
+        self.lag = []  # seconds each session started behind schedule
+        self.queued = []  # seconds each call waited for a free worker thread
+        self.sessions = 0
+        self.finished_at = 0.0
+
+    def record(self, name, latency, stats, error):
+        op = self.ops[name]
+        op["latency"].append(latency)
+        op["retries"] += stats.get("retries", 0)
+        op["lock_wait"] += stats.get("lock_wait", 0.0)
+        if error is None:
+            op["ok"] += 1
+            return True
+        op["refused" if isinstance(error, RentalError) else "failed"] += 1
+        message = f"{name}: {error}"
+        self.errors[message] = self.errors.get(message, 0) + 1
+        return False
+
+    def as_dict(self):
+        return {
+            "ops": self.ops,
+            "errors": self.errors,
+            "lag": self.lag,
+            "queued": self.queued,
+            "sessions": self.sessions,
+            "finished_at": self.finished_at,
+        }
+
+
+class Customers:
+    # One process worth of simulated customers
+
+    def __init__(self, depot_list, args, ranges, seed):
+        # Each worker thread gets its own connections from the DepotSet
+        self.depot_set = depots.DepotSet(depot_list, threads=1)
+        self.args = args
+        self.ranges = ranges
+        self.rng = random.Random(seed)
+        self.pool = ThreadPoolExecutor(max_workers=args.threads)
+        self.recorder = Recorder()
+
+    def _timed(self, func, *args):
+        # Runs on a worker thread: (start, seconds, immediate() stats, error or
+        # None, result)
+        stats = {}
+        error = result = None
+        started = time.perf_counter()
+        try:
+            result = func(self.depot_set, *args, stats)
+        except (RentalError, sqlite3.Error) as e:
+            error = e
+        return started, time.perf_counter() - started, stats, error, result
+
+    def _login(self, depot_set, username, stats):
+        depots.login(depot_set, username, PASSWORD)
+
+    def _rent(self, depot_set, bikes, start_id, customer_name, hours, stats):
+        # The customer picks a free bike from the depot's list, starting
+        # somewhere
+        first, last = bikes
+        conn = depot_set.route(first)
+        query = (
+            "SELECT id FROM Bikes WHERE available = 1 AND id BETWEEN ? AND ? "
+            "ORDER BY id LIMIT 1"
+        )
+        row = (
+            conn.execute(query, (start_id, last)).fetchone()
+            or conn.execute(query, (first, last)).fetchone()
+        )
+        if row is None:
+            raise RentalError("No bike is free.")
+        depots.rent_bike(depot_set, row[0], customer_name, hours, stats=stats)
+        return row[0]
+
+    def _return(self, depot_set, bike_id, stats):
+        depots.return_bike(depot_set, bike_id, stats=stats)
+
+    async def _call(self, name, func, *args):
+        # (succeeded, result)
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+        started, latency, stats, error, result = await loop.run_in_executor(
+            self.pool, self._timed, func, *args
+        )
+        self.recorder.queued.append(started - submitted)
+        return self.recorder.record(name, latency, stats, error), result
+
+    async def session(self):
+        args = self.args
+        rng = self.rng
+        username = f"{ACCOUNT_PREFIX}{rng.randrange(args.accounts)}"
+        ok, _ = await self._call("login", self._login, username)
+        if not ok:
+            return
+        for _ in range(args.attempts):
+            bikes = rng.choice(self.ranges)
+            start_id = rng.randint(*bikes)
+            hours = rng.randint(1, 8)
+            ok, bike_id = await self._call(
+                "rent", self._rent, bikes, start_id, username, hours
+            )
+            if ok:
+                break
+        else:
+            return
+        await asyncio.sleep(rng.expovariate(1 / args.ride) if args.ride else 0)
+        await self._call("return", self._return, bike_id)
+
+    async def run(self, start_at, rate):
+        pending = []
+        offset = time.time() - start_at
+        base = time.perf_counter() - offset
+        for due in arrivals(self.rng, self.args.pattern, rate, self.args.duration):
+            delay = base + due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.recorder.lag.append(max(0.0, -delay))
+            pending.append(asyncio.ensure_future(self.session()))
+        await asyncio.gather(*pending)
+        self.recorder.sessions = len(pending)
+        self.recorder.finished_at = time.time()
+        self.pool.shutdown()
+
+
+def worker(depot_list, index, args, ranges, start_at, results):
+    customers = Customers(depot_list, args, ranges, seed=args.seed * 1000 + index)
+    rate = args.rate / args.processes
+    asyncio.run(customers.run(start_at, rate))
+    results.put(customers.recorder.as_dict())
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def merge(outcomes):
+    merged = Recorder()
+    for outcome in outcomes:
+        for name, op in outcome["ops"].items():
+            total = merged.ops[name]
+            for key, value in op.items():
+                total[key] += value
+        for message, count in outcome["errors"].items():
+            merged.errors[message] = merged.errors.get(message, 0) + count
+        merged.lag += outcome["lag"]
+        merged.queued += outcome["queued"]
+        merged.sessions += outcome["sessions"]
+        merged.finished_at = max(merged.finished_at, outcome["finished_at"])
+    return merged
+
+
+def summarize(merged, args, elapsed):
+    summary = {
+        "rate": args.rate,
+        "pattern": args.pattern,
+        "duration": args.duration,
+        "processes": args.processes,
+        "threads": args.threads,
+        "sessions": merged.sessions,
+        "elapsed": elapsed,
+        "offered_sessions_per_s": merged.sessions / args.duration,
+        "ops": {},
+        "errors": merged.errors,
+    }
+    lag = sorted(merged.lag) or [0.0]
+    summary["behind_schedule_p99"] = percentile(lag, 0.99)
+    queued = sorted(merged.queued) or [0.0]
+    summary["queued_p99"] = percentile(queued, 0.99)
+    ok_total = 0
+    for name, op in merged.ops.items():
+        latency = sorted(op["latency"])
+        if not latency:
+            continue
+        ok_total += op["ok"]
+        summary["ops"][name] = {
+            "count": len(latency),
+            "ok": op["ok"],
+            "refused": op["refused"],
+            "failed": op["failed"],
+            "p50": percentile(latency, 0.50),
+            "p95": percentile(latency, 0.95),
+            "p99": percentile(latency, 0.99),
+            "max": latency[-1],
+            "retries": op["retries"],
+            "lock_wait": op["lock_wait"],
+        }
+    summary["ok_ops_per_s"] = ok_total / elapsed
+    return summary
+
+
+def report(summary):
+    print(
+        f"{summary['sessions']} sessions in {summary['elapsed']:.1f}s "
+        f"({summary['offered_sessions_per_s']:.1f}/s offered, "
+        f"{summary['pattern']}), {summary['ok_ops_per_s']:.0f} successful ops/s"
+    )
+    print(
+        f"  {'':<8}{'count':>7}{'ok':>7}{'refused':>8}{'failed':>7}"
+        f"{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'retries':>8}{'lock wait':>11}"
+    )
+    for name, op in summary["ops"].items():
+        print(
+            f"  {name:<8}{op['count']:>7}{op['ok']:>7}{op['refused']:>8}"
+            f"{op['failed']:>7}"
+            + "".join(
+                f"{op[key] * 1e3:>7.1f}ms" for key in ("p50", "p95", "p99", "max")
+            )
+            + f"{op['retries']:>8}{op['lock_wait']:>10.2f}s"
+        )
+    print(
+        f"  sessions started up to {summary['behind_schedule_p99'] * 1e3:.0f}ms "
+        "behind schedule and calls waited up to "
+        f"{summary['queued_p99'] * 1e3:.0f}ms for a free counter (p99)"
+    )
+    top = sorted(summary["errors"].items(), key=lambda item: -item[1])[:5]
+    for message, count in top:
+        print(f"  {count:>6}x {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_FILE, help="database to load (copied)")
+    parser.add_argument(
+        "--synthetic", type=int, default=None, help="use a generated fleet of N bikes"
+    )
+    parser.add_argument("--depots", help="depots.json to load (files copied)")
+    parser.add_argument(
+        "--in-place", action="store_true", help="write to --db or --depots itself"
+    )
+    parser.add_argument("--rate", type=float, default=50, help="sessions per second")
+    parser.add_argument("--pattern", choices=("poisson", "rush"), default="poisson")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of arrivals")
+    parser.add_argument("--ride", type=float, default=2.0, help="mean ride seconds")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8, help="counters per process")
+    parser.add_argument("--accounts", type=int, default=200)
+    parser.add_argument("--attempts", type=int, default=3, help="rent tries per customer")
+    parser.add_argument(
+        "--hot-bikes",
+        type=int,
+        default=None,
+        help="only rent the first N bikes of each depot (contention)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the summary as JSON here")
+    args = parser.parse_args()
+    if args.depots and args.synthetic is not None:
+        parser.error("--depots and --synthetic cannot be combined")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.depots:
+            if not os.path.exists(args.depots):
+                parser.error(f"{args.depots} does not exist")
+            manifest = args.depots if args.in_place else copy_depots(args.depots, tmp)
+            depot_set = depots.open_depots(manifest)
+        else:
+            if args.synthetic is not None:
+                source = cached_db(args.synthetic, args.synthetic // 2)
+            else:
+                source = args.db
+                if not os.path.exists(source):
+                    parser.error(f"{source} does not exist")
+            if args.in_place and args.synthetic is None:
+                path = source
+            else:
+                path = copy_source(source, os.path.join(tmp, "load.db"))
+            depot_set = depots.open_file(path)
+        create_accounts(depot_set, args.accounts)
+        ranges = bike_ranges(depot_set, args.hot_bikes)
+        depot_set.close()
+        if not ranges:
+            parser.error("the database has no bikes")
+
+        results = multiprocessing.Queue()
+        start_at = time.time() + 1.0 + 0.1 * args.processes
+        processes = [
+            multiprocessing.Process(
+                target=worker,
+                args=(depot_set.depots, i, args, ranges, start_at, results),
+            )
+            for i in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    merged = merge(outcomes)
+    summary = summarize(merged, args, merged.finished_at - start_at)
+    report(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""Benchmark the rental hot paths on synthetic fleets and write JSON results.
+
+    python benchmarks/run.py --sizes 1k,100k,1m
+    python benchmarks/run.py --sizes 100k --compare benchmarks/results/abc1234.json
+
+For every fleet size this builds (or reuses) a synthetic database with that
+many bikes and half as many open rentals, copies it, and times:
+
+    load_fleet           FleetStore load done after login (load_bikes_from_db)
+    first_page           BikePager first window of the bike list
+    deep_page            BikePager window at the end of the fleet
+    search_page          BikePager first window of an as-you-type FTS search
+    sorted_page          BikePager window of available bikes sorted by price
+    rent                 rental_service.rent_bike, as run by the Rent button
+    return               rental_service.return_bike, as run by the Return button
+    dashboard            analytics.dashboard, as read by the admin dashboard
+    bike_tree_fill       TreeSync filling an empty bike Treeview with a page
+    bike_tree_refresh    TreeSync refresh of a page after one bike changed
+    rental_tree_refresh  TreeSync refresh of the full rental list after a rent
+
+Treeview work runs against a real ttk.Treeview when $DISPLAY is set (e.g.
+under xvfb-run) and against benchmarks/fake_tk.FakeTreeview otherwise.
+Results are written to benchmarks/results/<commit>.json unless --output is
+given. With --compare, medians are compared against an earlier result file
+and the exit status is 1 if any operation got slower than --threshold.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, REPO)
+sys.path.insert(0, HERE)
+
+import analytics  # noqa: E402
+import rental_service  # noqa: E402
+from bike_pager import BikePager, BikeQuery  # noqa: E402
+from db import connect  # noqa: E402
+from depots import Depot, DepotSet  # noqa: E402
+from fake_tk import make_treeview  # noqa: E402
+from synthetic import cached_db, copy_db  # noqa: E402
+from tree_sync import TreeSync  # noqa: E402
+
+RESULTS_DIR = os.path.join(HERE, "results")
+SUFFIXES = {"k": 1_000, "m": 1_000_000}
+
+
+def load_app():
+    # bike-rent.py is not importable by name because of the dash
+    spec = importlib.util.spec_from_file_location(
+        "bike_rent", os.path.join(REPO, "bike-rent.py")
+    )
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    return app
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    if text[-1:] in SUFFIXES:
+        return int(float(text[:-1]) * SUFFIXES[text[-1]])
+    return int(text)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "runs": len(samples),
+        "min_ms": samples[0] * 1e3,
+        "median_ms": statistics.median(samples) * 1e3,
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1e3,
+        "mean_ms": statistics.fmean(samples) * 1e3,
+    }
+
+
+def timed(func, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_size(app, n_bikes, repeat, seed):
+    n_rentals = n_bikes // 2
+    source = cached_db(n_bikes, n_rentals, seed)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = copy_db(source, os.path.join(tmp, "bench.db"))
+        conn = connect(path)
+        # The app reads through a DepotSet; here it holds the one database
+        depot_set = DepotSet([Depot(0, "Main", path)])
+        rng = random.Random(seed)
+
+        load_repeat = max(1, min(repeat, 5 if n_bikes <= 100_000 else 2))
+        results["load_fleet"] = timed(
+            lambda: app.load_bikes_from_db(depot_set), load_repeat
+        )
+        fleet = app.load_bikes_from_db(depot_set)
+
+        pager = BikePager(depot_set)
+        results["first_page"] = timed(pager.first_page, repeat)
+        pager.after = (max(0, n_bikes - pager.page_size),)
+        results["deep_page"] = timed(pager.reload, repeat)
+        words = ["roy", "duc", "harley d", "spo", "yamaha r"]
+        results["search_page"] = timed(
+            lambda: pager.search(BikeQuery(text=rng.choice(words))), repeat
+        )
+        results["sorted_page"] = timed(
+            lambda: pager.search(
+                BikeQuery(available=True, sort="price_per_hour", descending=True)
+            ),
+            repeat,
+        )
+        pager.search(BikeQuery())
+
+        # Rent then return the same bikes so the fleet ends where it started
+        available = fleet.available_ids()
+        bikes = rng.sample(available, min(repeat, len(available)))
+        results["rent"] = []
+        results["return"] = []
+        for bike_id in bikes:
+            start = time.perf_counter()
+            rental_service.rent_bike(conn, bike_id, "Bench Customer", 2)
+            results["rent"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            rental_service.return_bike(conn, bike_id)
+            results["return"].append(time.perf_counter() - start)
+
+        results["dashboard"] = timed(lambda: analytics.dashboard(conn), repeat)
+
+        tree, root = make_treeview()
+        page = pager.first_page()
+
+        def empty_tree():
+            sync = TreeSync(tree)
+            sync.clear()
+            for item in tree.get_children():
+                tree.delete(item)
+            return (sync,)
+
+        results["bike_tree_fill"] = timed(
+            lambda sync: sync.sync(app.bike_row(bike) for bike in page),
+            repeat,
+            empty_tree,
+        )
+
+        bike_sync = TreeSync(tree)
+        bike_sync.sync(app.bike_row(bike) for bike in page)
+
+        def change_one_bike():
+            bike = rng.choice(page)
+            bike["available"] = not bike["available"]
+            return ()
+
+        results["bike_tree_refresh"] = timed(
+            lambda: bike_sync.sync(app.bike_row(bike) for bike in page),
+            repeat,
+            change_one_bike,
+        )
+        bike_sync.clear()
+
+        rental_tree, _ = make_treeview() if root is None else (tree, root)
+        rental_sync = TreeSync(rental_tree)
+        rental_sync.sync(app.rental_row(rental) for rental in fleet.iter_rentals())
+        tree_repeat = max(1, min(repeat, 20 if n_bikes <= 100_000 else 3))
+
+        def rent_one():
+            rental = fleet.get_rental(rng.choice(rental_ids)).as_dict()
+            rental["hours"] += 1
+            fleet.put_rental(rental)
+            return ()
+
+        rental_ids = [rental.bike_id for rental in fleet.iter_rentals()]
+        results["rental_tree_refresh"] = timed(
+            lambda: rental_sync.sync(
+                app.rental_row(rental) for rental in fleet.iter_rentals()
+            ),
+            tree_repeat,
+            rent_one,
+        )
+        if root is not None:
+            root.destroy()
+        conn.close()
+        depot_set.close()
+
+    return {name: summarize(samples) for name, samples in results.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current, baseline, threshold):
+    regressions = []
+    print(f"\n{'size':>9} {'operation':<22}{'before':>12}{'after':>12}{'ratio':>8}")
+    for size, ops in current["sizes"].items():
+        for name, stats in ops.items():
+            before = baseline.get("sizes", {}).get(size, {}).get(name)
+            if before is None:
+                continue
+            ratio = stats["median_ms"] / max(before["median_ms"], 1e-9)
+            flag = "  SLOWER" if ratio > threshold else ""
+            print(
+                f"{size:>9} {name:<22}{before['median_ms']:>10.3f}ms"
+                f"{stats['median_ms']:>10.3f}ms{ratio:>7.2f}x{flag}"
+            )
+            if flag:
+                regressions.append((size, name, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1k,100k", help="e.g. 1k,100k,1m")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None, help="earlier results JSON")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args()
+
+    app = load_app()
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "sizes": {},
+    }
+
+    for text in args.sizes.split(","):
+        n_bikes = parse_size(text)
+        print(f"== {n_bikes} bikes, {n_bikes // 2} rentals")
+        ops = bench_size(app, n_bikes, args.repeat, args.seed)
+        report["sizes"][str(n_bikes)] = ops
+        for name, stats in ops.items():
+            print(
+                f"  {name:<22}median {stats['median_ms']:>9.3f}ms"
+                f"   p95 {stats['p95_ms']:>9.3f}ms   ({stats['runs']} runs)"
+            )
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} operation(s) slower than {args.threshold}x")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
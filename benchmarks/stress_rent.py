@@ -0,0 +1,157 @@
+"""Concurrent rent/return stress test against one database file.
+
+Starts several processes that all rent and return random bikes from the same
+SQLite file as fast as they can, then checks that no bike was ever rented
+twice at the same time. A trigger records every change of Bikes.available in
+commit order; each rent must flip a bike from available to rented, each return
+the other way, and the final Bikes/Rentals state must agree. Every return
+must have left a row in the rental history, and the rental totals kept by
+analytics must match the successful operations.
+
+    python benchmarks/stress_rent.py --processes 8 --ops 500 --bikes 20
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics  # noqa: E402
+from db import connect  # noqa: E402
+from migrations import migrate  # noqa: E402
+import rental_history  # noqa: E402
+from rental_tx import RentalError, rent, return_bike  # noqa: E402
+
+
+def setup_db(path, n_bikes):
+    conn = connect(path)
+    migrate(conn)
+    conn.executemany(
+        "INSERT INTO Bikes (name, type, price_per_hour, available) VALUES (?, ?, ?, 1)",
+        ((f"Bike {i}", "Road", 10) for i in range(n_bikes)),
+    )
+    # Audit trail written inside each transaction, so it is in commit order
+    conn.executescript(
+        """
+        CREATE TABLE Audit (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            bike_id INTEGER,
+            old_available INTEGER,
+            new_available INTEGER
+        );
+        CREATE TRIGGER audit_available AFTER UPDATE OF available ON Bikes
+        BEGIN
+            INSERT INTO Audit (bike_id, old_available, new_available)
+            VALUES (NEW.id, OLD.available, NEW.available);
+        END;
+        """
+    )
+    conn.commit()
+    conn.close()
+
+
+def customer(path, worker_id, n_ops, n_bikes, results):
+    rng = random.Random(worker_id)
+    conn = connect(path)
+    stats = {}
+    counts = {"rent": 0, "return": 0}
+    for _ in range(n_ops):
+        bike_id = rng.randint(1, n_bikes)
+        try:
+            if rng.random() < 0.5:
+                rent(conn, bike_id, f"Customer {worker_id}", 1, stats=stats)
+                counts["rent"] += 1
+            else:
+                return_bike(conn, bike_id, stats=stats)
+                counts["return"] += 1
+        except RentalError:
+            pass
+    conn.close()
+    results.put((counts, stats))
+
+
+def check(path, rents, returns):
+    conn = connect(path)
+    audit = conn.execute(
+        "SELECT bike_id, old_available, new_available FROM Audit ORDER BY seq"
+    ).fetchall()
+    unavailable = {
+        row[0] for row in conn.execute("SELECT id FROM Bikes WHERE available = 0")
+    }
+    rental_rows = [row[0] for row in conn.execute("SELECT bike_id FROM Rentals")]
+    history_rows = sum(
+        conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in rental_history.partition_tables(conn)
+    )
+    totals = analytics.totals(conn)
+    conn.close()
+
+    for bike_id, old, new in audit:
+        if old == new:
+            return f"bike {bike_id} was rented or returned twice in a row"
+    audited_rents = sum(1 for _, _, new in audit if new == 0)
+    if audited_rents != rents or len(audit) - audited_rents != returns:
+        return "successful operations disagree with the audit trail"
+    if len(rental_rows) != len(set(rental_rows)):
+        return "Rentals holds more than one open rental for a bike"
+    if unavailable != set(rental_rows):
+        return "Bikes.available disagrees with Rentals"
+    if history_rows != returns:
+        return "the rental history is missing returns"
+    if totals["rentals"] != rents or totals["active"] != len(rental_rows):
+        return "the rental totals disagree with the successful operations"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=300, help="operations per process")
+    parser.add_argument("--bikes", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stress.db")
+        setup_db(path, args.bikes)
+
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=customer, args=(path, i, args.ops, args.bikes, results)
+            )
+            for i in range(args.processes)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        rents = sum(counts["rent"] for counts, _ in outcomes)
+        returns = sum(counts["return"] for counts, _ in outcomes)
+        retries = sum(stats.get("retries", 0) for _, stats in outcomes)
+        lock_wait = sum(stats.get("lock_wait", 0.0) for _, stats in outcomes)
+        total = args.processes * args.ops
+        print(
+            f"{total} operations from {args.processes} processes in {elapsed:.2f}s "
+            f"({total / elapsed:.0f} ops/s): {rents} rents and {returns} returns "
+            f"succeeded, {retries} busy retries, "
+            f"{lock_wait:.2f}s waiting for the write lock"
+        )
+
+        problem = check(path, rents, returns)
+        if problem:
+            print(f"FAILED: {problem}")
+            sys.exit(1)
+        print("OK: no bike was double-rented")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Synthetic bike-rental.db generator for benchmarks.
+
+    python benchmarks/synthetic.py --bikes 100000 --rentals 50000 out.db
+
+Databases are built with the current schema (all migrations applied) and are
+fully determined by (bikes, rentals, seed), so runs on different commits
+measure the same data. cached_db() keeps generated files under
+benchmarks/.data so large fleets are only built once.
+"""
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics  # noqa: E402
+from db import connect  # noqa: E402
+from migrations import MIGRATIONS, migrate  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data")
+
+TYPES = ["Mountain", "Road", "Cruiser", "Sport", "Classic", "Touring", "Racing"]
+MODELS = [
+    "Royal Enfield",
+    "Ducati Scrambler",
+    "Harley Davidson",
+    "KTM Duke",
+    "Yamaha R15",
+    "Bajaj Pulsar",
+    "Honda Shine",
+    "Discover 125",
+]
+FIRST_NAMES = ["Sagar", "Rochak", "Anup", "Bishrut", "Asha", "Nima", "Priya", "Ravi"]
+
+
+def bike_rows(n_bikes, rented, rng):
+    for bike_id in range(1, n_bikes + 1):
+        yield (
+            bike_id,
+            f"{rng.choice(MODELS)} {bike_id}",
+            rng.choice(TYPES),
+            rng.randint(5, 30),
+            0 if bike_id in rented else 1,
+        )
+
+
+def rental_rows(rented, prices, rng):
+    for bike_id in sorted(rented):
+        hours = rng.randint(1, 24)
+        yield (
+            bike_id,
+            f"{rng.choice(FIRST_NAMES)} {rng.randint(1, 9999)}",
+            hours,
+            float(prices[bike_id] * hours),
+        )
+
+
+def generate_db(path, n_bikes, n_rentals, seed=0):
+    if n_rentals > n_bikes:
+        raise ValueError("Every rental needs its own bike: rentals <= bikes.")
+    if os.path.exists(path):
+        os.remove(path)
+
+    rng = random.Random(seed)
+    rented = set(rng.sample(range(1, n_bikes + 1), n_rentals))
+
+    conn = connect(path, synchronous="OFF")
+    migrate(conn)
+    prices = {}
+
+    def remember_price(rows):
+        for row in rows:
+            prices[row[0]] = row[3]
+            yield row
+
+    conn.executemany(
+        "INSERT INTO Bikes (id, name, type, price_per_hour, available) VALUES (?, ?, ?, ?, ?)",
+        remember_price(bike_rows(n_bikes, rented, rng)),
+    )
+    conn.executemany(
+        "INSERT INTO Rentals (bike_id, customer_name, hours, total_cost) VALUES (?, ?, ?, ?)",
+        rental_rows(rented, prices, rng),
+    )
+    # The rows above bypass rental_tx, so derive the aggregates from them
+    analytics.rebuild(conn)
+    conn.execute(
+        "INSERT OR IGNORE INTO Users (username, password, role) VALUES ('admin', '123', 'admin')"
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO Users (username, password, role) VALUES ('user', '123', 'user')"
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return path
+
+
+def cached_db(n_bikes, n_rentals, seed=0):
+    # Reuse a generated file when the same fleet was built before with the
+    # same schema version. Benchmarks that write should copy it first (see
+    # copy_db).
+    os.makedirs(DATA_DIR, exist_ok=True)
+    name = f"fleet-{n_bikes}-{n_rentals}-{seed}-v{len(MIGRATIONS)}.db"
+    path = os.path.join(DATA_DIR, name)
+    if not os.path.exists(path):
+        generate_db(path + ".tmp", n_bikes, n_rentals, seed)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def copy_db(source, target):
+    # Online backup, so a WAL-mode source is copied consistently
+    src = connect(source)
+    dst = connect(target)
+    src.backup(dst)
+    src.close()
+    dst.close()
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--bikes", type=int, default=1000)
+    parser.add_argument("--rentals", type=int, default=None, help="default: half the bikes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rentals = args.bikes // 2 if args.rentals is None else args.rentals
+    generate_db(args.path, args.bikes, rentals, args.seed)
+    print(f"Wrote {args.path}: {args.bikes} bikes, {rentals} rentals")
+
+
+if __name__ == "__main__":
+    main()
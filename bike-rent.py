@@ -1,107 +1,162 @@
+import time
+
+_started = time.perf_counter()
+
+import argparse
+import sys
+from datetime import date
 from tkinter import *
-from tkinter import messagebox, ttk
-from PIL import Image, ImageTk
-import sqlite3
-
-root = Tk()
-root.title("Bike Rental App")
-root.geometry("500x500")
-
-conn = sqlite3.connect("bike-rental.db")
-cursor = conn.cursor()
-
-cursor.execute(
-    """CREATE TABLE IF NOT EXISTS Users (
-                    username TEXT PRIMARY KEY, 
-                    password TEXT NOT NULL,
-                    role TEXT NOT NULL
-                    )"""
-)
-
-cursor.execute(
-    """CREATE TABLE IF NOT EXISTS Bikes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT,
-                    type TEXT,
-                    price_per_hour INTEGER,
-                    available TEXT)"""
-)
-
-cursor.execute(
-    """CREATE TABLE IF NOT EXISTS Rentals (
-                    bike_id INTEGER,
-                    customer_name TEXT,
-                    hours INTEGER,
-                    total_cost REAL
-                )"""
-)
-
-conn.commit()
+from tkinter import filedialog, messagebox, ttk
+
+import analytics
+import bike_images
+from bike_pager import BikePager, BikeQuery
+import change_feed
+from db_worker import DbWorker
+import depots
+from fleet_store import FleetStore, bike_from_row
+import group_commit
+import instrumentation
+import rental_service
+from rental_tx import RentalError
+import reservations
+from tree_sync import TreeSync
 
 # Global Variables
-bikes = []
-rentals = []
-
-
-def load_bikes_from_db():
-    global bikes, rentals
-    cursor.execute("SELECT id, name, type, price_per_hour, available FROM bikes")
-    for row in cursor.fetchall():
-        bike = {
-            "id": row[0],
-            "name": row[1],
-            "type": row[2],
-            "price_per_hour": row[3],
-            "available": bool(int(row[4])),
-        }
-        bikes.append(bike)
-
-        # If bike is not available, add it to rentals
-        # if not bike["available"]:
-        #     rentals.append(bike)
-
-    cursor.execute("SELECT bike_id, customer_name, hours, total_cost FROM Rentals")
-    for row in cursor.fetchall():
-        rentals.append(
-            {
-                "bike_id": row[0],
-                "customer_name": row[1],
-                "hours": row[2],
-                "total_cost": row[3],
+root = None
+depot_set = None  # every depot's database (see depots)
+depot = None  # the depot this counter belongs to; new bikes go there
+worker = None
+kiosk = None  # kiosk.Kiosk when running on a kiosk replica (--kiosk)
+fleet = FleetStore()  # filled in after the first successful login
+change_marks = None  # depot number -> last change applied to fleet
+windows = {}  # admin/home windows, built on first use and then reused
+thumbnails = None  # bike_images.ThumbnailWorker, started on first use
+photos = bike_images.PhotoCache()  # recently shown bike thumbnails
+
+SEARCH_DELAY_MS = 250  # pause in typing before the bike list is searched
+METRICS_FILE_INTERVAL_MS = 10000  # how often --metrics-file is rewritten
+KIOSK_STATUS_INTERVAL_MS = 2000  # how often a kiosk's sync state is shown
+BIKE_SORT_COLUMNS = {
+    "ID": "id",
+    "Name": "name",
+    "Type": "type",
+    "Price": "price_per_hour",
+    "Status": "available",
+}
+
+
+@instrumentation.timed()
+def load_bikes_from_db(db):
+    # All depots, read in parallel
+    return depots.load_fleet(db)
+
+
+def load_fleet_and_marks(db):
+    # Where the change logs end, then the fleet; changes made in between
+    # are applied again later, which does no harm
+    marks = depots.change_marks(db)
+    return marks, load_bikes_from_db(db)
+
+
+def use_fleet(loaded):
+    # Install a result of load_fleet_and_marks; the first one starts
+    # following the other counters' changes
+    global fleet, change_marks
+    first = change_marks is None
+    change_marks, fleet = loaded
+    if first:
+        root.after(change_feed.POLL_INTERVAL_MS, follow_changes)
+
+
+def follow_changes():
+    # Apply what other counters, the API and imports changed since the last
+    # look, then look again after change_feed.POLL_INTERVAL_MS (see
+    # change_feed). The change log is read on a database reader thread.
+    def again():
+        root.after(change_feed.POLL_INTERVAL_MS, follow_changes)
+
+    def done(result):
+        global change_marks
+        change_marks, changed = result
+        if changed is None:
+            # Further behind than the log goes back, e.g. after a big import
+            worker.submit_read(load_fleet_and_marks, reloaded, lambda error: again())
+            return
+        if changed:
+            reshaped = change_feed.apply_changes(fleet, changed)
+            bikes = {
+                bike_id: bike_from_row(row)
+                for bike_id, (row, _) in changed.items()
+                if row is not None
             }
-        )
+            show_changes(bikes, reshaped)
+        again()
+
+    def reloaded(loaded):
+        use_fleet(loaded)
+        show_changes({}, True)
+        again()
 
+    marks = change_marks
+    worker.submit_read(
+        lambda db: depots.read_changes(db, marks), done, lambda error: again()
+    )
 
-load_bikes_from_db()
 
+@instrumentation.timed()
+def show_changes(bikes, reshaped):
+    # Update the open bike and rental lists for changed bikes ({id: bike}).
+    # Rows are patched in place unless bikes were added or removed, or the
+    # list is filtered or sorted so that a change can move a bike to
+    # another page; then only the page on screen is read again.
+    for window in windows.values():
+        if not window.winfo_exists():
+            continue
+        bike_tree = getattr(window, "bike_tree", None)
+        if bike_tree is not None:
+            if reshaped or not bike_tree.pager.query.is_default():
+                update_bike_list(bike_tree)
+            elif bike_tree.pager.replace(bikes):
+                reprice_bike_page(bike_tree)
+        if hasattr(window, "rental_tree"):
+            update_rental_list(window)
+
+
+class StartupTimer:
+    # Records how long each startup phase took, printed by --timing in the
+    # same layout as python -X importtime
+
+    def __init__(self, started):
+        self.started = started
+        self.last = started
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last, now - self.started))
+        self.last = now
+
+    def report(self, file=sys.stderr):
+        print("startup: self [us] | cumulative | phase", file=file)
+        for phase, self_time, cumulative in self.phases:
+            print(
+                f"startup: {self_time * 1e6:>9.0f} | {cumulative * 1e6:>10.0f} | {phase}",
+                file=file,
+            )
 
-def update_bike_list(bike_tree):
-    for row in bike_tree.get_children():
-        bike_tree.delete(row)
 
-    # Create a style for available and rented bikes
+def setup_tree_style():
+    # Create a style for available and rented bikes (once, at startup)
     style = ttk.Style()
 
     # Apply foreground colors using map (works better than tag_configure)
     style.map("Treeview", foreground=[("selected", "white")])
     style.map("Treeview", background=[("selected", "#0078D7")])  # Blue when selected
 
-    for bike in bikes:
-        status = "Available" if bike["available"] else "Rented"
-        tag = "available" if bike["available"] else "rented"
-
-        bike_tree.insert(
-            "",
-            "end",
-            values=(
-                bike["id"],
-                bike["name"],
-                bike["type"],
-                f"${bike['price_per_hour']}/hour",
-                status,
-            ),
-            tags=(tag,),
-        )
+
+def setup_bike_tree(bike_tree):
+    bike_tree.row_sync = TreeSync(bike_tree)
 
     # Set tag-specific foreground colors
     bike_tree.tag_configure(
@@ -112,6 +167,281 @@ def update_bike_list(bike_tree):
     )  # Red for Rented
 
 
+def bike_row(bike, rate=None):
+    # rate is the bike's hourly rate right now (see pricing), shown when the
+    # pricing rules make it differ from the list price
+    status = "Available" if bike["available"] else "Rented"
+    tag = "available" if bike["available"] else "rented"
+    price = f"${bike['price_per_hour']}/hour"
+    if rate is not None and rate != bike["price_per_hour"]:
+        price += f" (now ${rate:.2f})"
+    values = (
+        bike["id"],
+        bike["name"],
+        bike["type"],
+        price,
+        status,
+    )
+    return bike["id"], values, (tag,)
+
+
+@instrumentation.timed()
+def update_bike_list(bike_tree):
+    # Re-read only the visible page; rows that did not change are left alone
+    pager = bike_tree.pager
+    query, after, number = pager.query, pager.after, pager.page_number
+    load_bike_page(
+        bike_tree, query, lambda db: pager.fetch_window(db, query, after, number)
+    )
+
+
+def load_bike_page(bike_tree, query, fetch, next_window=None):
+    # Read a window of the bike list with fetch(db), and the hourly rates of
+    # its bikes, on a database reader; then show it. A load started later
+    # (a newer search, another page) wins.
+    bike_tree.load_generation += 1
+    generation = bike_tree.load_generation
+
+    def work(db):
+        window = fetch(db)
+        return window, depots.hourly_rates(db, window[2])
+
+    def done(result):
+        if generation != bike_tree.load_generation:
+            return
+        window, rates = result
+        page = bike_tree.pager.show_window(query, window, next_window)
+        show_bike_page(bike_tree, page, rates)
+
+    run_in_background([], work, done, write=False)
+
+
+@instrumentation.timed()
+def show_bike_page(bike_tree, page, rates):
+    if not hasattr(bike_tree, "row_sync"):
+        setup_bike_tree(bike_tree)
+    pager = bike_tree.pager
+    bike_tree.row_sync.sync(bike_row(bike, rate) for bike, rate in zip(page, rates))
+    bike_tree.page_label.config(text=pager.describe())
+    bike_tree.prev_button.config(state=NORMAL if pager.has_prev else DISABLED)
+    bike_tree.next_button.config(state=NORMAL if pager.has_next else DISABLED)
+
+    # Fetch the following page while the user looks at this one
+    if pager.has_next and pager.next_window is None and page:
+        query, after, number = pager.query, pager.next_key(), pager.page_number + 1
+        run_in_background(
+            [],
+            lambda db: pager.fetch_window(db, query, after, number),
+            lambda window: pager.keep_next(query, window),
+            write=False,
+        )
+
+
+def reprice_bike_page(bike_tree):
+    # Show the current page again (patched in place) with its hourly rates
+    # read again on a database reader
+    page = bike_tree.pager.page
+    bikes = list(page)
+
+    def done(rates):
+        if bike_tree.pager.page is page:
+            show_bike_page(bike_tree, page, rates)
+
+    run_in_background([], lambda db: depots.hourly_rates(db, bikes), done, write=False)
+
+
+def next_bike_page(bike_tree):
+    pager = bike_tree.pager
+    if not pager.has_next:
+        return
+    query, window = pager.query, pager.next_window
+    if window is None:
+        after, number = pager.next_key(), pager.page_number + 1
+        load_bike_page(
+            bike_tree, query, lambda db: pager.fetch_window(db, query, after, number)
+        )
+    else:
+        load_bike_page(bike_tree, query, lambda db: window)
+
+
+def prev_bike_page(bike_tree):
+    pager = bike_tree.pager
+    query = pager.query
+    if not pager.page:
+        load_bike_page(
+            bike_tree, query, lambda db: pager.fetch_window(db, query, None, 1)
+        )
+        return
+    key, number = query.key(pager.page[0]), max(1, pager.page_number - 1)
+    # The page being left becomes the prefetched next page
+    leaving = (pager.after, pager.page_number, pager.page, pager.has_next)
+    load_bike_page(
+        bike_tree,
+        query,
+        lambda db: pager.fetch_window_before(db, query, key, number),
+        leaving,
+    )
+
+
+def read_bike_query(bike_tree):
+    # The search box, filters and sort order as a BikeQuery; a price that is
+    # not a whole number is ignored
+    def price(entry):
+        text = entry.get().strip()
+        return int(text) if text.isdigit() else None
+
+    status = bike_tree.status_box.get()
+    bike_type = bike_tree.type_box.get()
+    sort, descending = bike_tree.sort
+    return BikeQuery(
+        text=bike_tree.search_entry.get(),
+        available={"Available": True, "Rented": False}.get(status),
+        bike_type=None if bike_type in ("", "All types") else bike_type,
+        min_price=price(bike_tree.min_price_entry),
+        max_price=price(bike_tree.max_price_entry),
+        sort=sort,
+        descending=descending,
+        free_slot=bike_tree.free_slot,
+    )
+
+
+def schedule_bike_search(bike_tree):
+    # Debounce: only search once typing has paused for SEARCH_DELAY_MS
+    if bike_tree.search_after is not None:
+        bike_tree.after_cancel(bike_tree.search_after)
+    bike_tree.search_after = bike_tree.after(
+        SEARCH_DELAY_MS, lambda: search_bikes(bike_tree)
+    )
+
+
+def search_bikes(bike_tree):
+    bike_tree.search_after = None
+    query = read_bike_query(bike_tree)
+    pager = bike_tree.pager
+    # The query runs on a database reader thread, so typing never waits on it
+    load_bike_page(bike_tree, query, lambda db: pager.fetch_window(db, query, None, 1))
+
+
+def sort_bike_list(bike_tree, column):
+    sort = BIKE_SORT_COLUMNS[column]
+    current, descending = bike_tree.sort
+    bike_tree.sort = (sort, not descending if sort == current else False)
+
+    for heading, heading_sort in BIKE_SORT_COLUMNS.items():
+        arrow = ""
+        if heading_sort == sort:
+            arrow = " ▼" if bike_tree.sort[1] else " ▲"
+        bike_tree.heading(heading, text=heading + arrow)
+    search_bikes(bike_tree)
+
+
+def create_bike_filters(list_frame, bike_tree):
+    filter_frame = Frame(list_frame)
+    filter_frame.grid(row=0, column=0, columnspan=4, pady=5)
+
+    Label(filter_frame, text="Search:").pack(side=LEFT)
+    bike_tree.search_entry = Entry(filter_frame, width=18)
+    bike_tree.search_entry.pack(side=LEFT, padx=5)
+
+    bike_tree.status_box = ttk.Combobox(
+        filter_frame, values=("All", "Available", "Rented"), width=9, state="readonly"
+    )
+    bike_tree.status_box.set("All")
+    bike_tree.status_box.pack(side=LEFT, padx=5)
+
+    # Types come from the fleet loaded at login, refreshed when opened
+    bike_tree.type_box = ttk.Combobox(filter_frame, width=10, state="readonly")
+    bike_tree.type_box.configure(
+        postcommand=lambda: bike_tree.type_box.configure(
+            values=["All types"] + sorted(t for t in fleet.types() if t)
+        )
+    )
+    bike_tree.type_box.set("All types")
+    bike_tree.type_box.pack(side=LEFT, padx=5)
+
+    Button(
+        filter_frame, text="Gallery", command=lambda: show_gallery(bike_tree)
+    ).pack(side=RIGHT, padx=5)
+
+    Label(filter_frame, text="$").pack(side=LEFT)
+    bike_tree.min_price_entry = Entry(filter_frame, width=4)
+    bike_tree.min_price_entry.pack(side=LEFT)
+    Label(filter_frame, text="–").pack(side=LEFT)
+    bike_tree.max_price_entry = Entry(filter_frame, width=4)
+    bike_tree.max_price_entry.pack(side=LEFT)
+
+    bike_tree.search_after = None
+    bike_tree.load_generation = 0
+    bike_tree.free_slot = None  # set from the Reserve a Bike form
+    for entry in (
+        bike_tree.search_entry,
+        bike_tree.min_price_entry,
+        bike_tree.max_price_entry,
+    ):
+        entry.bind("<KeyRelease>", lambda event: schedule_bike_search(bike_tree))
+    for box in (bike_tree.status_box, bike_tree.type_box):
+        box.bind("<<ComboboxSelected>>", lambda event: search_bikes(bike_tree))
+
+
+def create_bike_list(parent, can_edit_images=False):
+    list_frame = Frame(parent)
+    list_frame.pack(pady=10)
+
+    # Bike List Treeview
+    bike_tree = ttk.Treeview(
+        list_frame,
+        columns=("ID", "Name", "Type", "Price", "Status"),
+        show="headings",
+        height=8,
+    )
+    # Clicking a heading sorts by that column (again to reverse)
+    bike_tree.sort = ("id", False)
+    for heading in BIKE_SORT_COLUMNS:
+        bike_tree.heading(
+            heading,
+            text=heading,
+            command=lambda heading=heading: sort_bike_list(bike_tree, heading),
+        )
+    bike_tree.heading("ID", text="ID ▲")
+    bike_tree.column("ID", width=80, anchor="center")  # depot ids run to 8 digits
+    bike_tree.column("Name", width=150, anchor="center")
+    bike_tree.column("Type", width=100, anchor="center")
+    bike_tree.column("Price", width=160, anchor="center")  # "$10/hour (now $12.50)"
+    bike_tree.column("Status", width=100, anchor="center")
+
+    create_bike_filters(list_frame, bike_tree)
+
+    scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=bike_tree.yview)
+    bike_tree.configure(yscrollcommand=scrollbar.set)
+    bike_tree.grid(row=1, column=0, columnspan=3)
+    scrollbar.grid(row=1, column=3, sticky="ns")
+
+    # Only one page of bikes is loaded into the widget at a time
+    bike_tree.pager = BikePager(depot_set)
+
+    bike_tree.can_edit_images = can_edit_images
+    bike_tree.bind("<Double-1>", lambda event: open_bike_details(bike_tree))
+
+    bike_tree.prev_button = Button(
+        list_frame,
+        text="◀ Prev",
+        command=lambda: prev_bike_page(bike_tree),
+    )
+    bike_tree.prev_button.grid(row=2, column=0, pady=5)
+
+    bike_tree.page_label = Label(list_frame, text="")
+    bike_tree.page_label.grid(row=2, column=1, pady=5)
+
+    bike_tree.next_button = Button(
+        list_frame,
+        text="Next ▶",
+        command=lambda: next_bike_page(bike_tree),
+    )
+    bike_tree.next_button.grid(row=2, column=2, pady=5)
+
+    return bike_tree
+
+
 def clear_rent_form(bike_id_entry, customer_name_entry, rental_hours_entry):
     bike_id_entry.delete(0, END)
     customer_name_entry.delete(0, END)
@@ -144,212 +474,506 @@ def show_rentals(root):
             root.rental_tree.column(col, width=100)
 
         root.rental_tree.pack()
+        root.rental_tree.row_sync = TreeSync(root.rental_tree)
 
 
-def update_rental_list(root):
-    for row in root.rental_tree.get_children():
-        root.rental_tree.delete(row)
-
-    for rental in rentals:
-        root.rental_tree.insert(
-            "",
-            "end",
-            values=(
-                rental["bike_id"],
-                rental["customer_name"],
-                rental["hours"],
-                f"${rental['total_cost']}",
-            ),
-        )
+def rental_row(rental):
+    values = (
+        rental["bike_id"],
+        rental["customer_name"],
+        rental["hours"],
+        f"${rental['total_cost']}",
+    )
+    return rental["bike_id"], values, ()
 
 
-def rent_bike(bike_id_entry, customer_name_entry, rental_hours_entry, bike_tree, root):
-    # Remove from rentals list in memory
-    global rentals, bikes
-    bike_id_text = bike_id_entry.get().strip()
-    rental_hours_text = rental_hours_entry.get().strip()
+@instrumentation.timed()
+def update_rental_list(root):
+    root.rental_tree.row_sync.sync(
+        rental_row(rental) for rental in fleet.iter_rentals()
+    )
 
-    if not bike_id_text.isdigit() or not rental_hours_text.isdigit():
-        messagebox.showerror(
-            "Input Error",
-            "Please enter valid numeric values for Bike ID and Rental Hours.",
-        )
-        return
 
-    bike_id = int(bike_id_text)
-    customer_name = customer_name_entry.get().strip()
-    hours = int(rental_hours_text)
+def run_in_background(buttons, work, on_done, write=True):
+    # Run work(db) on the database worker and call on_done(result) back on the
+    # Tk thread. The buttons that started it stay disabled until then.
+    for button in buttons:
+        button.config(state=DISABLED)
 
-    if not customer_name:
-        messagebox.showerror("Input Error", "Customer Name cannot be empty.")
-        return
+    def enable_buttons():
+        for button in buttons:
+            if button.winfo_exists():
+                button.config(state=NORMAL)
 
-    # Check if the bike is available
-    cursor.execute(
-        "SELECT name, price_per_hour, available FROM bikes WHERE id = ?", (bike_id,)
-    )
-    bike = cursor.fetchone()
+    def finish(result):
+        enable_buttons()
+        on_done(result)
 
-    if bike and int(bike[2]) == 1:
-        total_cost = bike[1] * hours
-        rentals.append(
-            {
-                "bike_id": bike_id,
-                "customer_name": customer_name,
-                "hours": hours,
-                "total_cost": total_cost,
-            }
-        )
-        # Insert rental record into rentals table
-        cursor.execute(
-            "INSERT INTO rentals (bike_id, customer_name, hours, total_cost) VALUES (?, ?, ?, ?)",
-            (bike_id, customer_name, hours, total_cost),
+    def fail(error):
+        enable_buttons()
+        if isinstance(error, RentalError):
+            messagebox.showerror(error.title, str(error))
+        else:
+            messagebox.showerror("Error", f"An error occurred: {str(error)}")
+
+    # With metrics on, the job and its callback are timed under the name of
+    # the handler that started them, e.g. rent_bike.work and rent_bike.done
+    if instrumentation.enabled():
+        name = work.__qualname__.split(".")[0]
+        work = instrumentation.timed(f"{name}.work")(work)
+        finish = instrumentation.timed(f"{name}.done")(finish)
+
+    submit = worker.submit_write if write else worker.submit_read
+    submit(work, finish, fail)
+
+
+@instrumentation.timed()
+def rent_bike(
+    bike_id_entry, customer_name_entry, rental_hours_entry, bike_tree, root, rent_button
+):
+    bike_id_text = bike_id_entry.get()
+    customer_name = customer_name_entry.get()
+    rental_hours_text = rental_hours_entry.get()
+
+    def work(db):
+        # Validates, checks availability and rents in one transaction on the
+        # bike's depot
+        rental = depots.rent_bike(db, bike_id_text, customer_name, rental_hours_text)
+        bike_id = rental["bike_id"]
+        return (
+            rental,
+            depots.fetch_bike_row(db, bike_id),
+            depots.fetch_rental_row(db, bike_id),
         )
 
-        # Update bike availability
-        cursor.execute("UPDATE Bikes SET available = 0 WHERE id = ?", (bike_id,))
-
-        conn.commit()  # Commit changes, but DO NOT close the connection
-
+    def done(result):
+        rental, bike_row, rental_row = result
+        bike_id = rental["bike_id"]
         clear_rent_form(bike_id_entry, customer_name_entry, rental_hours_entry)
 
-        # Reload bikes from database and update UI
-        bikes = []
-        rentals = []
-        load_bikes_from_db()  # Fetch updated bike list
+        # Apply the changed rows to the fleet store and update UI
+        fleet.apply_bike_row(bike_id, bike_row)
+        fleet.apply_rental_row(bike_id, rental_row)
         update_bike_list(bike_tree)  # Refresh UI
         show_rentals(root)
         update_rental_list(root)
 
         messagebox.showinfo(
             "Success",
-            f"{customer_name} rented {bike[0]} for {hours} hours.\nTotal Cost: ${total_cost}",
+            f"{rental['customer_name']} rented {rental['bike_name']} for {rental['hours']} hours.\nTotal Cost: ${rental['total_cost']}",
         )
-    else:
-        conn.close()
-        messagebox.showerror("Error", "Bike not available or invalid ID.")
 
+    run_in_background([rent_button], work, done)
 
-def return_bike_func(return_bike_id_entry, bike_tree, root):
-    bike_id_text = return_bike_id_entry.get().strip()
 
-    if not bike_id_text.isdigit():
-        messagebox.showerror("Input Error", "Please enter a valid numeric Bike ID.")
-        return
+@instrumentation.timed()
+def return_bike_func(return_bike_id_entry, bike_tree, root, return_button):
+    bike_id_text = return_bike_id_entry.get()
 
-    bike_id = int(bike_id_text)
+    def work(db):
+        returned = depots.return_bike(db, bike_id_text)
+        return returned, depots.fetch_bike_row(db, returned["bike_id"])
 
-    # Check if the bike exists and is currently rented
-    cursor.execute("SELECT name, available FROM Bikes WHERE id = ?", (bike_id,))
-    bike = cursor.fetchone()
+    def done(result):
+        returned, bike_row = result
+        bike_id = returned["bike_id"]
 
-    if not bike:
-        messagebox.showerror("Error", "Bike ID not found.")
-        return
+        # Apply the changed rows to the fleet store and update UI
+        fleet.apply_bike_row(bike_id, bike_row)
+        fleet.remove_rental(bike_id)
+        update_bike_list(bike_tree)  # Refresh UI
+        update_rental_list(root)
 
-    if int(bike[1]) == 1:
-        messagebox.showerror("Error", "Bike is already available.")
-        return
+        clear_return_form(return_bike_id_entry)
 
-    # Remove the rental record
-    cursor.execute("DELETE FROM Rentals WHERE bike_id = ?", (bike_id,))
+        messagebox.showinfo(
+            "Success", f"Bike '{returned['bike_name']}' returned successfully."
+        )
 
-    # Mark the bike as available
-    cursor.execute("UPDATE Bikes SET available = 1 WHERE id = ?", (bike_id,))
+    run_in_background([return_button], work, done)
 
-    conn.commit()  # Save changes
 
-    # Remove from rentals list in memory
-    global rentals, bikes
+@instrumentation.timed()
+def reserve_bike(entries, bike_tree, reserve_button):
+    bike_id_entry, customer_name_entry, start_entry, end_entry = entries
+    params = {
+        "bike_id": bike_id_entry.get(),
+        "customer_name": customer_name_entry.get(),
+        "starts_at": start_entry.get(),
+        "ends_at": end_entry.get(),
+    }
 
-    # Reload bikes from database and update UI
-    bikes = []
-    rentals = []
-    load_bikes_from_db()  # Fetch updated bike list
-    update_bike_list(bike_tree)  # Refresh UI
-    update_rental_list(root)
+    def done(reservation):
+        bike_id_entry.delete(0, END)
+        customer_name_entry.delete(0, END)
+        if bike_tree.free_slot is not None:
+            update_bike_list(bike_tree)  # the bike is no longer free then
+        messagebox.showinfo(
+            "Success",
+            f"Reservation {reservation['id']}: bike {reservation['bike_id']} for "
+            f"{reservation['customer_name']}\n"
+            f"{reservations.local_time(reservation['starts_at'])} to "
+            f"{reservations.local_time(reservation['ends_at'])}",
+        )
 
-    clear_return_form(return_bike_id_entry)
+    # Checked and booked in one BEGIN IMMEDIATE transaction
+    run_in_background(
+        [reserve_button], lambda db: depots.reserve_bike(db, **params), done
+    )
 
-    messagebox.showinfo("Success", f"Bike '{bike[0]}' returned successfully.")
 
+def show_free_bikes(start_entry, end_entry, bike_tree):
+    # Filter the bike list to bikes free for the whole slot; empty times
+    # clear the filter
+    start, end = start_entry.get().strip(), end_entry.get().strip()
+    if not start and not end:
+        bike_tree.free_slot = None
+    else:
+        try:
+            slot = (rental_service.as_time(start), rental_service.as_time(end))
+        except RentalError as e:
+            messagebox.showerror(e.title, str(e))
+            return
+        if slot[0] >= slot[1]:
+            messagebox.showerror("Input Error", "The slot must end after it starts.")
+            return
+        bike_tree.free_slot = slot
+    search_bikes(bike_tree)
 
-def add_bike(bike_name_entry, bike_type_entry, price_entry, bike_tree):
-    name = bike_name_entry.get().strip()
-    bike_type = bike_type_entry.get().strip()
-    price_text = price_entry.get().strip()
 
-    if not name or not bike_type or not price_text.isdigit():
-        messagebox.showerror("Input Error", "Please enter valid bike details.")
-        return
+def show_bike_reservations(bike_id_entry, button):
+    bike_id_text = bike_id_entry.get()
 
-    price = int(price_text)
+    def done(upcoming):
+        lines = [
+            f"#{r['id']}  {reservations.local_time(r['starts_at'])} – "
+            f"{reservations.local_time(r['ends_at'])}  {r['customer_name']}"
+            for r in upcoming
+        ]
+        messagebox.showinfo(
+            "Reservations", "\n".join(lines) or "No upcoming reservations."
+        )
 
-    # Insert data into the database
-    cursor.execute(
-        "INSERT INTO Bikes (name, type, price_per_hour, available) VALUES (?, ?, ?, 1)",
-        (name, bike_type, price),
+    run_in_background(
+        [button],
+        lambda db: depots.list_reservations(db, bike_id_text),
+        done,
+        write=False,
     )
-    conn.commit()
 
-    messagebox.showinfo("Success", "Bike added successfully!")
 
-    # Clear input fields after adding a bike
-    bike_name_entry.delete(0, END)
-    bike_type_entry.delete(0, END)
-    price_entry.delete(0, END)
+def cancel_reservation(reservation_id_entry, bike_tree, cancel_button):
+    reservation_id_text = reservation_id_entry.get()
 
-    # Reload bikes from database and update UI
-    load_bikes_from_db()  # Fetch updated bike list
-    update_bike_list(bike_tree)  # Refresh UI
+    def done(cancelled):
+        reservation_id_entry.delete(0, END)
+        if bike_tree.free_slot is not None:
+            update_bike_list(bike_tree)
+        messagebox.showinfo("Success", f"Reservation {cancelled['id']} cancelled.")
 
+    run_in_background(
+        [cancel_button],
+        lambda db: depots.cancel_reservation(db, reservation_id_text),
+        done,
+    )
 
-def delete_bike(bike_id_entry, bike_tree):
-    try:
-        bike_id = bike_id_entry.get().strip()
 
-        if not bike_id.isdigit():
-            messagebox.showerror("Error", "Please enter a valid numeric Bike ID.")
-            return
+def add_bike(bike_name_entry, bike_type_entry, price_entry, bike_tree, add_button):
+    name = bike_name_entry.get()
+    bike_type = bike_type_entry.get()
+    price_text = price_entry.get()
 
-        bike_id = int(bike_id)
+    def work(db):
+        return depots.add_bike(db, depot, name, bike_type, price_text)
 
-        # Verify if the bike exists before deleting
-        cursor.execute("SELECT * FROM bikes WHERE id = ?", (bike_id,))
-        bike = cursor.fetchone()
+    def done(bike):
+        fleet.put_bike(bike)
 
-        if bike is None:
-            messagebox.showerror("Error", "Bike ID not found.")
-            return
+        messagebox.showinfo("Success", "Bike added successfully!")
+
+        # Clear input fields after adding a bike
+        bike_name_entry.delete(0, END)
+        bike_type_entry.delete(0, END)
+        price_entry.delete(0, END)
+
+        # Update UI
+        update_bike_list(bike_tree)  # Refresh UI
+
+    run_in_background([add_button], work, done)
 
+
+def delete_bike(bike_id_entry, bike_tree, delete_button):
+    bike_id_text = bike_id_entry.get()
+
+    def check(db):
+        # Verify if the bike exists before deleting
+        return depots.get_bike(db, bike_id_text)
+
+    def confirm_delete(bike):
         # Confirm before deleting
         confirm = messagebox.askyesno(
-            "Confirm Deletion", f"Are you sure you want to delete bike ID {bike_id}?"
+            "Confirm Deletion", f"Are you sure you want to delete bike ID {bike['id']}?"
         )
         if not confirm:
             return
 
-        # Delete bike
-        cursor.execute("DELETE FROM bikes WHERE id = ?", (bike_id,))
-        conn.commit()
+        run_in_background(
+            [delete_button],
+            lambda db: depots.delete_bike(db, bike["id"]),
+            done,
+        )
+
+    def done(deleted):
+        fleet.remove_bike(deleted["bike_id"])
 
         messagebox.showinfo("Success", "Bike deleted successfully.")
 
-        # Reload bikes from database and update UI
-        load_bikes_from_db()  # Fetch updated bike list
+        # Update UI
         update_bike_list(bike_tree)  # Refresh UI
 
         # Clear input field after deleting a bike
         bike_id_entry.delete(0, END)
 
-    except Exception as e:
-        messagebox.showerror("Error", f"An error occurred: {str(e)}")
+    run_in_background([delete_button], check, confirm_delete, write=False)
+
+
+def show_window(name, build):
+    # Reopen a window built earlier instead of building it again
+    window = windows.get(name)
+    if window is not None and window.winfo_exists():
+        if hasattr(window, "bike_tree"):
+            update_bike_list(window.bike_tree)
+        if hasattr(window, "rental_tree"):
+            update_rental_list(window)
+        if hasattr(window, "refresh"):
+            window.refresh()
+        window.deiconify()
+        window.lift()
+        return window
+
+    window = windows[name] = build()
+    # Closing only hides the window so the next login reuses it
+    window.protocol("WM_DELETE_WINDOW", window.withdraw)
+    return window
 
 
 def createAdminPage():
+    return show_window("admin", buildAdminPage)
+
+
+def createHomePage():
+    return show_window("home", buildHomePage)
+
+
+def createDashboard():
+    return show_window("dashboard", buildDashboard)
+
+
+def import_bikes_file(bike_tree, import_button):
+    path = filedialog.askopenfilename(
+        title="Import Bikes",
+        filetypes=[
+            ("CSV files", "*.csv"),
+            ("JSON Lines", "*.jsonl"),
+            ("All files", "*.*"),
+        ],
+    )
+    if not path:
+        return
+
+    def work(db):
+        summary = depots.import_file(db, depot, path)
+        # A bulk import changes too many rows to patch in one by one
+        return summary, load_fleet_and_marks(db)
+
+    def done(result):
+        summary, loaded = result
+        use_fleet(loaded)
+        update_bike_list(bike_tree)
+
+        message = f"Imported {summary['imported']} bikes, rejected {summary['rejected']}."
+        if summary["errors"]:
+            message += "\n\n" + "\n".join(summary["errors"][:10])
+        messagebox.showinfo("Import Finished", message)
+
+    run_in_background([import_button], work, done)
+
+
+def export_table_file(table, export_button):
+    path = filedialog.asksaveasfilename(
+        title=f"Export {table.title()}",
+        defaultextension=".csv",
+        initialfile=f"{table}.csv",
+        filetypes=[("CSV files", "*.csv"), ("JSON Lines", "*.jsonl")],
+    )
+    if not path:
+        return
+
+    def done(count):
+        messagebox.showinfo("Export Finished", f"Exported {count} {table} to {path}.")
+
+    run_in_background(
+        [export_button],
+        lambda db: depots.export_file(db, table, path),
+        done,
+        write=False,
+    )
+
+
+def money(value):
+    return f"${value:,.2f}"
+
+
+def make_table(parent, columns, height=6):
+    table = ttk.Treeview(parent, columns=columns, show="headings", height=height)
+    for col in columns:
+        table.heading(col, text=col)
+        table.column(col, width=100)
+    table.pack(fill="x")
+    table.row_sync = TreeSync(table)
+    return table
+
+
+def type_total_row(row):
+    values = (
+        row["type"],
+        row["rentals"],
+        row["active"],
+        row["hours"],
+        money(row["revenue"]),
+    )
+    return row["type"], values, ()
+
+
+def top_bike_row(row):
+    values = (
+        row["bike_id"],
+        row["name"] or "(deleted)",
+        row["rentals"],
+        row["hours"],
+        money(row["revenue"]),
+    )
+    return row["bike_id"], values, ()
+
+
+def refresh_dashboard(dash, refresh_button):
+    # All figures come from the aggregate tables, so this stays fast
+    # however many rentals there have been
+    def done(report):
+        totals, today = report["totals"], report["today"]
+        dash.summary_label.config(
+            text=f"Revenue: {money(totals['revenue'])}   "
+            f"Rentals: {totals['rentals']}   "
+            f"Booked hours: {totals['hours']}   "
+            f"Active: {totals['active']}\n"
+            f"Today ({today['day']}): {money(today['revenue'])} from "
+            f"{today['rentals']} rentals, {today['hours']} hours"
+        )
+        dash.type_tree.row_sync.sync(map(type_total_row, report["by_type"]))
+        dash.top_tree.row_sync.sync(map(top_bike_row, report["top_bikes"]))
+
+    run_in_background([refresh_button], depots.dashboard, done, write=False)
+
+
+def show_rollup(dash, start_entry, end_entry, period_box, show_button):
+    start = start_entry.get().strip()
+    end = end_entry.get().strip()
+    period = period_box.get() or "day"
+
+    def work(db):
+        try:
+            for day in (start, end):
+                date.fromisoformat(day)
+        except ValueError:
+            raise RentalError("Please enter dates as YYYY-MM-DD.", "Input Error")
+        return depots.rollup(db, start, end, period)
+
+    def done(rows):
+        dash.rollup_tree.row_sync.sync(
+            (key, (key, rentals, hours, money(revenue)), ())
+            for key, revenue, hours, rentals in rows
+        )
+        total = sum(row[1] for row in rows)
+        dash.rollup_label.config(text=f"{len(rows)} {period}s, {money(total)} total")
+
+    run_in_background([show_button], work, done, write=False)
+
+
+def buildDashboard():
+    dash = Toplevel()
+    dash.title("Revenue Dashboard")
+    dash.geometry("600x700")
+
+    summary_frame = LabelFrame(dash, text="Summary", bg="#f0f0f0", padx=10, pady=10)
+    summary_frame.pack(fill="x", padx=20, pady=5)
+    dash.summary_label = Label(summary_frame, text="Loading...", justify=LEFT)
+    dash.summary_label.pack(anchor="w")
+
+    type_frame = LabelFrame(dash, text="By Bike Type", bg="#f0f0f0", padx=10, pady=10)
+    type_frame.pack(fill="x", padx=20, pady=5)
+    dash.type_tree = make_table(
+        type_frame, ("Type", "Rentals", "Active", "Hours", "Revenue"), height=5
+    )
+
+    top_frame = LabelFrame(dash, text="Top Bikes", bg="#f0f0f0", padx=10, pady=10)
+    top_frame.pack(fill="x", padx=20, pady=5)
+    dash.top_tree = make_table(
+        top_frame, ("Bike ID", "Name", "Rentals", "Hours", "Revenue"), height=5
+    )
+
+    range_frame = LabelFrame(dash, text="Date Range", bg="#f0f0f0", padx=10, pady=10)
+    range_frame.pack(fill="x", padx=20, pady=5)
+    today = analytics.utc_today()
+
+    Label(range_frame, text="From:").grid(row=0, column=0, padx=5, pady=5)
+    start_entry = Entry(range_frame, width=12)
+    start_entry.insert(0, today.replace(day=1).isoformat())
+    start_entry.grid(row=0, column=1, padx=5, pady=5)
+
+    Label(range_frame, text="To:").grid(row=0, column=2, padx=5, pady=5)
+    end_entry = Entry(range_frame, width=12)
+    end_entry.insert(0, today.isoformat())
+    end_entry.grid(row=0, column=3, padx=5, pady=5)
+
+    period_box = ttk.Combobox(
+        range_frame, values=analytics.PERIODS, width=7, state="readonly"
+    )
+    period_box.set("day")
+    period_box.grid(row=0, column=4, padx=5, pady=5)
+
+    show_button = Button(
+        range_frame,
+        text="Show",
+        command=lambda: show_rollup(
+            dash, start_entry, end_entry, period_box, show_button
+        ),
+    )
+    show_button.grid(row=0, column=5, padx=5, pady=5)
+
+    rollup_frame = Frame(dash)
+    rollup_frame.pack(fill="x", padx=20, pady=5)
+    dash.rollup_tree = make_table(
+        rollup_frame, ("Period", "Rentals", "Hours", "Revenue"), height=6
+    )
+    dash.rollup_label = Label(dash, text="")
+    dash.rollup_label.pack()
+
+    refresh_button = Button(
+        dash,
+        text="Refresh",
+        command=lambda: refresh_dashboard(dash, refresh_button),
+    )
+    refresh_button.pack(pady=5)
+
+    dash.refresh = lambda: refresh_dashboard(dash, refresh_button)
+    dash.refresh()
+    return dash
+
+
+def buildAdminPage():
     admin_root = Toplevel()
     admin_root.title("Admin Panel")
-    admin_root.geometry("600x650")
+    admin_root.geometry("600x830")
 
     # Title Label
     title_label = Label(
@@ -362,23 +986,7 @@ def createAdminPage():
     title_label.pack(pady=10)
 
     # Bike List Treeview
-    bike_tree = ttk.Treeview(
-        admin_root,
-        columns=("ID", "Name", "Type", "Price", "Status"),
-        show="headings",
-        height=8,
-    )
-    bike_tree.heading("ID", text="ID")
-    bike_tree.heading("Name", text="Name")
-    bike_tree.heading("Type", text="Type")
-    bike_tree.heading("Price", text="Price")
-    bike_tree.heading("Status", text="Status")
-    bike_tree.column("ID", width=50, anchor="center")
-    bike_tree.column("Name", width=150, anchor="center")
-    bike_tree.column("Type", width=100, anchor="center")
-    bike_tree.column("Price", width=100, anchor="center")
-    bike_tree.column("Status", width=100, anchor="center")
-    bike_tree.pack(pady=10)
+    bike_tree = create_bike_list(admin_root, can_edit_images=True)
 
     # Initialize Bike List
     update_bike_list(bike_tree)
@@ -409,7 +1017,7 @@ def createAdminPage():
         bg="#4CAF50",
         fg="white",
         command=lambda: add_bike(
-            bike_name_entryy, bike_type_entry, price_entry, bike_tree
+            bike_name_entryy, bike_type_entry, price_entry, bike_tree, add_bike_button
         ),
     )
     add_bike_button.grid(row=3, column=0, columnspan=2, pady=10)
@@ -424,47 +1032,90 @@ def createAdminPage():
     bike_name_entry = Entry(delete_frame)
     bike_name_entry.grid(row=0, column=1, padx=10, pady=5)
 
-    # Add Bike Button
-    add_bike_button = Button(
+    # Delete Bike Button
+    delete_bike_button = Button(
         delete_frame,
         text="Delete Bike",
         font=("Helvetica", 12, "bold"),
         fg="#5F071D",
         bg="#FBD0DA",
-        command=lambda: delete_bike(bike_name_entry, bike_tree),
+        command=lambda: delete_bike(bike_name_entry, bike_tree, delete_bike_button),
     )
-    add_bike_button.grid(row=3, column=0, columnspan=2, pady=10)
+    delete_bike_button.grid(row=3, column=0, columnspan=2, pady=10)
 
+    # Reports and Bulk Import / Export Section
+    bulk_frame = LabelFrame(
+        admin_root,
+        text="Reports and Bulk Import / Export",
+        bg="#f0f0f0",
+        padx=10,
+        pady=10,
+    )
+    bulk_frame.pack(fill="x", padx=20, pady=5)
 
-def loginPage():
-    username = userEntry.get().strip()
-    password = userPassword.get().strip()
+    import_button = Button(
+        bulk_frame,
+        text="Import Bikes",
+        command=lambda: import_bikes_file(bike_tree, import_button),
+    )
+    import_button.grid(row=0, column=0, padx=10, pady=5)
 
-    if not username or not password:
-        messagebox.showerror("Login Error", "Username and Password cannot be empty!")
-    else:
-        cursor.execute(
-            "SELECT username, role FROM Users WHERE username=? AND password=?",
-            (username, password),
-        )
-        user = cursor.fetchone()
-
-        if user:
-            username, role = user
-            if role == "admin":
-                messagebox.showinfo("Login Success", "Welcome to Admin Dashboard!")
-                createAdminPage()
-            else:
-                messagebox.showinfo("Login Success", "Welcome to Bike Rental!")
-                createHomePage()
+    export_bikes_button = Button(
+        bulk_frame,
+        text="Export Bikes",
+        command=lambda: export_table_file("bikes", export_bikes_button),
+    )
+    export_bikes_button.grid(row=0, column=1, padx=10, pady=5)
+
+    export_rentals_button = Button(
+        bulk_frame,
+        text="Export Rentals",
+        command=lambda: export_table_file("rentals", export_rentals_button),
+    )
+    export_rentals_button.grid(row=0, column=2, padx=10, pady=5)
+
+    dashboard_button = Button(
+        bulk_frame,
+        text="Revenue Dashboard",
+        command=createDashboard,
+    )
+    dashboard_button.grid(row=1, column=0, columnspan=3, pady=5)
+
+    admin_root.bike_tree = bike_tree
+    return admin_root
+
+
+def loginPage():
+    username = userEntry.get()
+    password = userPassword.get()
+
+    def work(db):
+        user = depots.login(db, username, password)
+        # The fleet is only needed once someone is logged in
+        return user, None if fleet.loaded else load_fleet_and_marks(db)
+
+    def done(result):
+        user, loaded = result
+        if loaded is not None and not fleet.loaded:
+            use_fleet(loaded)
+        if kiosk is not None:
+            # Whoever works the kiosk also syncs it with the primary
+            kiosk.set_credentials(username, password)
+
+        if user["role"] == "admin":
+            messagebox.showinfo("Login Success", "Welcome to Admin Dashboard!")
+            createAdminPage()
         else:
-            messagebox.showerror("Login Error", "Invalid username or password!")
+            messagebox.showinfo("Login Success", "Welcome to Bike Rental!")
+            createHomePage()
 
+    run_in_background([loginButton], work, done, write=False)
 
-def createHomePage():
+
+def buildHomePage():
     root = Toplevel()
     root.title("Bike Rental Management System")
-    root.geometry("800x500")
+    root.geometry("900x720")
     root.configure(bg="#f0f0f0")
 
     # Custom Fonts
@@ -483,32 +1134,20 @@ def createHomePage():
     title_label.pack(pady=10)
 
     # Bike List Treeview
-    bike_tree = ttk.Treeview(
-        root,
-        columns=("ID", "Name", "Type", "Price", "Status"),
-        show="headings",
-        height=8,
-    )
-    bike_tree.heading("ID", text="ID")
-    bike_tree.heading("Name", text="Name")
-    bike_tree.heading("Type", text="Type")
-    bike_tree.heading("Price", text="Price")
-    bike_tree.heading("Status", text="Status")
-    bike_tree.column("ID", width=50, anchor="center")
-    bike_tree.column("Name", width=150, anchor="center")
-    bike_tree.column("Type", width=100, anchor="center")
-    bike_tree.column("Price", width=100, anchor="center")
-    bike_tree.column("Status", width=100, anchor="center")
-    bike_tree.pack(pady=10)
+    bike_tree = create_bike_list(root)
 
     # Initialize Bike List
     update_bike_list(bike_tree)
 
     # Rent Bike Section
+    # Renting now and reserving later, side by side
+    forms = Frame(root, bg="#f0f0f0")
+    forms.pack(pady=10)
+
     rent_frame = LabelFrame(
-        root, text="Rent a Bike", font=label_font, bg="#f0f0f0", padx=10, pady=10
+        forms, text="Rent a Bike", font=label_font, bg="#f0f0f0", padx=10, pady=10
     )
-    rent_frame.pack(pady=10)  # Use pack() instead of grid()
+    rent_frame.pack(side=LEFT, padx=10, anchor="n")
 
     Label(rent_frame, text="Bike ID:", font=label_font, bg="#f0f0f0").grid(
         row=0, column=0, padx=5, pady=5
@@ -535,11 +1174,67 @@ def createHomePage():
         bg="#4CAF50",
         fg="white",
         command=lambda: rent_bike(
-            bike_id_entry, customer_name_entry, rental_hours_entry, bike_tree, root
+            bike_id_entry,
+            customer_name_entry,
+            rental_hours_entry,
+            bike_tree,
+            root,
+            rent_button,
         ),
     )
     rent_button.grid(row=3, column=0, columnspan=2, pady=10)
 
+    # Reserve Bike Section
+    reserve_frame = LabelFrame(
+        forms, text="Reserve a Bike", font=label_font, bg="#f0f0f0", padx=10, pady=10
+    )
+    reserve_frame.pack(side=LEFT, padx=10, anchor="n")
+
+    reserve_entries = []
+    for row, text in enumerate(
+        ("Bike ID:", "Customer Name:", "From (YYYY-MM-DD HH:MM):", "To:")
+    ):
+        Label(reserve_frame, text=text, font=label_font, bg="#f0f0f0").grid(
+            row=row, column=0, padx=5, pady=2, sticky="e"
+        )
+        entry = Entry(reserve_frame, font=label_font, width=16)
+        entry.grid(row=row, column=1, columnspan=2, padx=5, pady=2)
+        reserve_entries.append(entry)
+    reserve_id_entry, _, start_entry, end_entry = reserve_entries
+
+    reserve_button = Button(
+        reserve_frame,
+        text="Reserve",
+        font=button_font,
+        bg="#4CAF50",
+        fg="white",
+        command=lambda: reserve_bike(reserve_entries, bike_tree, reserve_button),
+    )
+    reserve_button.grid(row=4, column=0, pady=5)
+    Button(
+        reserve_frame,
+        text="Free Bikes",
+        command=lambda: show_free_bikes(start_entry, end_entry, bike_tree),
+    ).grid(row=4, column=1, pady=5)
+    bookings_button = Button(
+        reserve_frame,
+        text="Bookings",
+        command=lambda: show_bike_reservations(reserve_id_entry, bookings_button),
+    )
+    bookings_button.grid(row=4, column=2, pady=5)
+
+    Label(reserve_frame, text="Reservation #:", font=label_font, bg="#f0f0f0").grid(
+        row=5, column=0, padx=5, pady=2, sticky="e"
+    )
+    cancel_id_entry = Entry(reserve_frame, font=label_font, width=6)
+    cancel_id_entry.grid(row=5, column=1, padx=5, pady=2)
+    cancel_button = Button(
+        reserve_frame,
+        text="Cancel",
+        command=lambda: cancel_reservation(cancel_id_entry, bike_tree, cancel_button),
+    )
+    cancel_button.grid(row=5, column=2, pady=2)
+
     # Return Bike Section
     return_bike = LabelFrame(
         root, text="Return a Bike", font=label_font, bg="#f0f0f0", padx=10, pady=10
@@ -558,37 +1253,179 @@ def createHomePage():
         font=button_font,
         bg="#4CAF50",
         fg="white",
-        command=lambda: return_bike_func(return_bike_id_entry, bike_tree, root),
+        command=lambda: return_bike_func(
+            return_bike_id_entry, bike_tree, root, return_button
+        ),
     )
     return_button.grid(row=1, column=0, columnspan=2, pady=10)
 
     show_rentals(root)
     update_rental_list(root)
 
+    root.bike_tree = bike_tree
+    return root
 
-def viewDetails(bike):
-    detailsPage = Toplevel()
-    detailsPage.title(f"{bike[1]} Details")
-    detailsPage.geometry("400x400")
 
-    bike_img = Image.open(bike[2])
-    bike_img = bike_img.resize((200, 200))
-    bike_img = ImageTk.PhotoImage(bike_img)
+def get_thumbnails():
+    global thumbnails
+    if thumbnails is None:
+        thumbnails = bike_images.ThumbnailWorker()
+        thumbnails.attach(root)
+    return thumbnails
+
+
+def load_photo(image, size, on_ready):
+    # Call on_ready(PhotoImage, or None if it cannot be shown) for a bike
+    # image (path, digest); right away if it was shown recently
+    path, digest = image
+    key = (digest, size)
+    photo = photos.get(key)
+    if photo is not None:
+        on_ready(photo)
+        return
+
+    def loaded(thumbnail):
+        try:
+            photo = photos.put(key, PhotoImage(file=thumbnail))
+        except TclError:
+            photo = None
+        on_ready(photo)
 
-    Label(detailsPage, image=bike_img).pack(pady=10)
-    Label(detailsPage, text=f"Name: {bike[1]}", font=("Arial", 14)).pack()
-    Label(detailsPage, text=f"Price: ${bike[3]}", font=("Arial", 14)).pack()
-    Label(detailsPage, text=f"Status: {bike[4]}", font=("Arial", 14)).pack()
-    detailsPage.mainloop()
+    get_thumbnails().request(path, digest, size, loaded, lambda error: on_ready(None))
 
 
-def bookBike(bike):
-    if bike[4] == "Booked":
-        messagebox.showerror("Booking Error", "This bike is already booked!")
+def show_photo(label, photo):
+    if not label.winfo_exists():
+        return
+    if photo is None:
+        label.config(text="No image")
     else:
-        cursor.execute("UPDATE Bikes SET status='Booked' WHERE id=?", (bike[0],))
-        conn.commit()
-        messagebox.showinfo("Success", "Bike booked successfully!")
+        label.config(image=photo, text="")
+        label.photo = photo  # Tk drops images nothing in Python refers to
+
+
+def change_bike_image(bike_id, image_button, image_label):
+    path = filedialog.askopenfilename(
+        title="Choose Bike Image",
+        filetypes=[
+            ("Images", "*.png *.jpg *.jpeg *.gif *.bmp *.webp"),
+            ("All files", "*.*"),
+        ],
+    )
+    if not path:
+        return
+
+    def done(result):
+        image = (result["image_path"], result["image_sha256"])
+        load_photo(image, bike_images.DETAIL_SIZE, lambda p: show_photo(image_label, p))
+        # Make the gallery thumbnail now too, so the gallery opens at once
+        load_photo(image, bike_images.GRID_SIZE, lambda p: None)
+
+    run_in_background(
+        [image_button], lambda db: depots.set_image(db, bike_id, path), done
+    )
+
+
+def open_bike_details(bike_tree):
+    item = bike_tree.focus()
+    if item:
+        viewDetails(bike_tree.item(item)["values"][0], bike_tree.can_edit_images)
+
+
+def viewDetails(bike_id, can_edit_images=False):
+    detailsPage = Toplevel()
+    detailsPage.title("Bike Details")
+    detailsPage.geometry("400x420")
+
+    # The window opens at once; the bike and its thumbnail fill in when ready
+    image_label = Label(detailsPage, text="Loading...")
+    image_label.pack(pady=10)
+    name_label = Label(detailsPage, text="", font=("Arial", 14))
+    name_label.pack()
+    price_label = Label(detailsPage, text="", font=("Arial", 14))
+    price_label.pack()
+    status_label = Label(detailsPage, text="", font=("Arial", 14))
+    status_label.pack()
+
+    if can_edit_images:
+        image_button = Button(
+            detailsPage,
+            text="Change Image...",
+            command=lambda: change_bike_image(bike_id, image_button, image_label),
+        )
+        image_button.pack(pady=10)
+
+    def work(db):
+        bike = depots.get_bike(db, bike_id)
+        return bike, depots.get_images(db, [bike["id"]]).get(bike["id"])
+
+    def done(result):
+        bike, image = result
+        if not detailsPage.winfo_exists():
+            return
+        status = "Available" if bike["available"] else "Rented"
+        detailsPage.title(f"{bike['name']} Details")
+        name_label.config(text=f"Name: {bike['name']}")
+        price_label.config(text=f"Price: ${bike['price_per_hour']}/hour")
+        status_label.config(text=f"Status: {status}")
+        if image is None:
+            image_label.config(text="No image")
+        else:
+            load_photo(
+                image, bike_images.DETAIL_SIZE, lambda p: show_photo(image_label, p)
+            )
+
+    run_in_background([], work, done, write=False)
+    return detailsPage
+
+
+def show_gallery_photo(cell, photo):
+    # Gallery cells keep the bike name under the picture
+    if photo is not None and cell.winfo_exists():
+        cell.config(image=photo)
+        cell.photo = photo
+
+
+def show_gallery(bike_tree):
+    # Thumbnails of the bikes on the current page of the list
+    page = list(bike_tree.pager.page)
+    gallery = Toplevel()
+    gallery.title("Bike Gallery")
+    gallery.geometry("660x560")
+
+    canvas = Canvas(gallery)
+    scrollbar = Scrollbar(gallery, orient="vertical", command=canvas.yview)
+    canvas.configure(yscrollcommand=scrollbar.set)
+    scrollbar.pack(side=RIGHT, fill="y")
+    canvas.pack(side=LEFT, fill="both", expand=True)
+    grid = Frame(canvas)
+    canvas.create_window((0, 0), window=grid, anchor="nw")
+    grid.bind(
+        "<Configure>", lambda event: canvas.configure(scrollregion=canvas.bbox("all"))
+    )
+
+    cells = {}
+    for index, bike in enumerate(page):
+        cell = Label(grid, text=bike["name"], compound="top", wraplength=100)
+        cell.grid(row=index // 6, column=index % 6, padx=4, pady=4)
+        cell.bind(
+            "<Button-1>",
+            lambda event, bike_id=bike["id"]: viewDetails(
+                bike_id, bike_tree.can_edit_images
+            ),
+        )
+        cells[bike["id"]] = cell
+
+    def done(images):
+        for bike_id, image in images.items():
+            load_photo(
+                image,
+                bike_images.GRID_SIZE,
+                lambda photo, cell=cells[bike_id]: show_gallery_photo(cell, photo),
+            )
+
+    run_in_background([], lambda db: depots.get_images(db, cells), done, write=False)
+    return gallery
 
 
 def signUp():
@@ -611,57 +1448,166 @@ def signUp():
     admin_checkbox.pack(pady=5)
 
     def submitData():
-        username = usernameEntry.get().strip()
-        password = passwordEntry.get().strip()
+        username = usernameEntry.get()
+        password = passwordEntry.get()
         is_admin = admin_var.get()
 
-        if len(username) < 4:
-            messagebox.showerror(
-                "Error", "Username must be at least 4 characters long!"
-            )
-            return
+        def work(db):
+            return depots.sign_up(db, username, password, is_admin)
 
-        cursor.execute("SELECT username FROM Users WHERE username=?", (username,))
-        existing_user = cursor.fetchone()
+        def done(user):
+            messagebox.showinfo("Success", "Account Created Successfully!")
+            signUpPage.destroy()
 
-        if existing_user:
-            messagebox.showerror(
-                "Error", "Username already exists! Choose a different one."
-            )
-            return
+        run_in_background([signUpButton], work, done)
 
-        cursor.execute(
-            "INSERT INTO Users (username, password, role) VALUES (?, ?, ?)",
-            (username, password, "admin" if is_admin else "user"),
-        )
-        conn.commit()
-        messagebox.showinfo("Success", "Account Created Successfully!")
-        signUpPage.destroy()
+    signUpButton = Button(
+        signUpPage, text="Sign Up", bg="green", fg="white", command=submitData
+    )
+    signUpButton.pack(pady=10)
+
+
+def createLoginPage():
+    global userEntry, userPassword, loginButton
+
+    welcome = Label(root, text="Welcome", font=("Arial", 24, "bold"), fg="blue")
+    welcome.pack()
+
+    loginFrame = LabelFrame(
+        root, text="Login", padx=25, pady=25, fg="blue", font=("Arial", 14, "bold")
+    )
+    loginFrame.pack()
+
+    Label(loginFrame, text="Username", font=("Arial", 10, "bold")).pack()
+    userEntry = Entry(loginFrame, width=30, font=("Arial", 10))
+    userEntry.pack()
+
+    Label(loginFrame, text="Password", font=("Arial", 10, "bold")).pack()
+    userPassword = Entry(loginFrame, show="*", width=30, font=("Arial", 10))
+    userPassword.pack()
+
+    loginButton = Button(
+        loginFrame, text="Login", bg="green", fg="white", command=loginPage
+    )
+    loginButton.pack(pady=6)
+    Button(
+        loginFrame, text="Create New Account", fg="blue", command=signUp, borderwidth=0
+    ).pack()
 
-    Button(signUpPage, text="Sign Up", bg="green", fg="white", command=submitData).pack(
-        pady=10
+
+def show_kiosk_status(title):
+    # Kiosks say in the title whether the primary answers and how many
+    # rentals and returns are still waiting for it
+    pending = kiosk.pending_count()
+    state = "online" if kiosk.online else "offline"
+    if kiosk.client.credentials is None:
+        state = "log in to sync"
+    suffix = f" – {pending} waiting to sync" if pending else ""
+    root.title(f"{title} ({state}){suffix}")
+    root.after(KIOSK_STATUS_INTERVAL_MS, lambda: show_kiosk_status(title))
+
+
+def write_metrics_file(path):
+    instrumentation.write_file(path)
+    root.after(METRICS_FILE_INTERVAL_MS, lambda: write_metrics_file(path))
+
+
+def main(argv=None):
+    global root, depot_set, depot, worker, kiosk
+
+    parser = argparse.ArgumentParser(description="Bike Rental App")
+    parser.add_argument("--timing", action="store_true", help="print startup times")
+    parser.add_argument(
+        "--metrics-port", type=int, help="serve /metrics on 127.0.0.1:PORT"
+    )
+    parser.add_argument(
+        "--metrics-file", help="keep metrics in this file (.json, or .prom for text)"
+    )
+    parser.add_argument("--slow-ms", type=float, help="log SQL slower than this")
+    parser.add_argument(
+        "--depot", help="name or number of this counter's depot (from depots.json)"
+    )
+    parser.add_argument(
+        "--group-commit", action="store_true", help="commit writes in groups"
+    )
+    parser.add_argument(
+        "--journal",
+        help="group commit, keeping acknowledged writes in this journal "
+        "(one name per counter)",
     )
+    parser.add_argument(
+        "--kiosk", help="run on this kiosk replica, syncing it in the background"
+    )
+    parser.add_argument("--batch-max", type=int, default=group_commit.BATCH_MAX)
+    parser.add_argument(
+        "--batch-ms", type=float, default=group_commit.BATCH_WINDOW * 1000
+    )
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    timer = StartupTimer(_started)
+    timer.mark("imports")
+
+    # Instrumentation stays off, at no cost, unless asked for
+    if args.metrics_port or args.metrics_file or args.slow_ms is not None:
+        instrumentation.enable(args.slow_ms)
+    if args.metrics_port:
+        instrumentation.serve(args.metrics_port)
+
+    root = Tk()
+    root.title("Bike Rental App")
+    root.geometry("500x500")
+    timer.mark("tk root")
+
+    # Create the tables, or upgrade older depot files in place
+    try:
+        if args.kiosk:
+            if args.group_commit or args.journal or args.depot:
+                raise ValueError("--kiosk cannot be used with depots or group commit.")
+            depot_set = depots.open_kiosk(args.kiosk)
+            kiosk = depot_set.committers[0]
+        else:
+            depot_set = depots.open_depots()
+        depot = depot_set.find(args.depot) if args.depot else depot_set.home
+    except ValueError as e:
+        parser.exit(1, f"{e}\n")
+    if kiosk is not None:
+        kiosk.start()
+        show_kiosk_status(f"Bike Rental App – Kiosk {kiosk.name}")
+    elif len(depot_set.depots) > 1:
+        root.title(f"Bike Rental App – {depot.name}")
+    timer.mark("open and migrate database")
+
+    if args.group_commit or args.journal:
+        # Replays whatever a crash left in the journals
+        depot_set.start_group_commit(args.journal, args.batch_max, args.batch_ms / 1000)
+        timer.mark("group commit")
+
+    setup_tree_style()
+
+    # Database work for the button handlers runs on background connections
+    worker = DbWorker(depots=depot_set)
+    worker.attach(root)
+    timer.mark("database worker")
+
+    createLoginPage()
+    timer.mark("login window")
+
+    if args.timing:
 
+        def first_paint():
+            timer.mark("first paint")
+            timer.report()
 
-welcome = Label(root, text="Welcome", font=("Arial", 24, "bold"), fg="blue")
-welcome.pack()
+        root.after_idle(first_paint)
 
-loginFrame = LabelFrame(
-    root, text="Login", padx=25, pady=25, fg="blue", font=("Arial", 14, "bold")
-)
-loginFrame.pack()
+    if args.metrics_file:
+        write_metrics_file(args.metrics_file)
 
-Label(loginFrame, text="Username", font=("Arial", 10, "bold")).pack()
-userEntry = Entry(loginFrame, width=30, font=("Arial", 10))
-userEntry.pack()
+    root.mainloop()
+    depot_set.shutdown()  # finishes queued group commits and empties the journals
 
-Label(loginFrame, text="Password", font=("Arial", 10, "bold")).pack()
-userPassword = Entry(loginFrame, show="*", width=30, font=("Arial", 10))
-userPassword.pack()
+    if args.metrics_file:
+        instrumentation.write_file(args.metrics_file)
 
-Button(loginFrame, text="Login", bg="green", fg="white", command=loginPage).pack(pady=6)
-Button(
-    loginFrame, text="Create New Account", fg="blue", command=signUp, borderwidth=0
-).pack()
 
-root.mainloop()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import hashlib
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+from rental_tx import RentalError, immediate
+
+# Bike photos and their thumbnails. Bikes.image_path points at the original
+# photo and Bikes.image_sha256 holds the digest of its contents. Thumbnails
+# are cached on disk under that digest, so a photo shared by many bikes (or
+# re-assigned to another bike) is only ever scaled once, and a changed file
+# gets a new digest instead of a stale thumbnail:
+#
+#     thumbnails/ab/ab12...ef-200x200.png
+#
+# Scaling needs Pillow and happens on ThumbnailWorker threads. Tk can load
+# the resulting PNGs itself, so the Tk thread never decodes a full-size
+# photo, and PhotoCache keeps recently shown PhotoImages in memory.
+
+THUMBNAIL_DIR = os.environ.get("BIKE_RENT_THUMBNAILS", "thumbnails")
+DETAIL_SIZE = (200, 200)
+GRID_SIZE = (96, 96)
+PHOTO_CACHE_SIZE = 256
+POLL_INTERVAL_MS = 20
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Bikes.image_path / image_sha256
+
+
+def set_image_in_tx(db, bike_id, path, digest):
+    updated = db.execute(
+        "UPDATE Bikes SET image_path = ?, image_sha256 = ? WHERE id = ?",
+        (path, digest, bike_id),
+    ).rowcount
+    if not updated:
+        raise RentalError("Bike ID not found.")
+    return {"bike_id": bike_id, "image_path": path, "image_sha256": digest}
+
+
+def set_image(conn, bike_id, path):
+    # Hash the file before taking the write lock
+    path = os.path.abspath(path)
+    try:
+        digest = file_digest(path)
+    except OSError as e:
+        raise RentalError(f"Cannot read image: {e}", "Image Error")
+    return immediate(conn, lambda db: set_image_in_tx(db, bike_id, path, digest))
+
+
+def get_images(conn, bike_ids):
+    # {bike id: (image path, digest)} for the bikes that have an image
+    bike_ids = list(bike_ids)
+    if not bike_ids:
+        return {}
+    placeholders = ", ".join("?" * len(bike_ids))
+    return {
+        row[0]: (row[1], row[2])
+        for row in conn.execute(
+            f"""SELECT id, image_path, image_sha256 FROM Bikes
+                WHERE id IN ({placeholders}) AND image_path IS NOT NULL""",
+            bike_ids,
+        )
+    }
+
+
+# On-disk thumbnail cache
+
+
+def thumbnail_path(digest, size, cache_dir=THUMBNAIL_DIR):
+    width, height = size
+    return os.path.join(cache_dir, digest[:2], f"{digest}-{width}x{height}.png")
+
+
+def make_thumbnail(source, digest, size, cache_dir=THUMBNAIL_DIR):
+    # Returns the cached thumbnail's path, scaling the photo if needed
+    target = thumbnail_path(digest, size, cache_dir)
+    if os.path.exists(target):
+        return target
+
+    from PIL import Image  # only the thumbnail threads need Pillow
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with Image.open(source) as image:
+        # JPEG decoders can scale by 1/2 to 1/8 while decoding, which is
+        # much faster than decoding the full photo and shrinking it
+        image.draft("RGB", size)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        image.thumbnail(size)
+        image.save(temp, "PNG")
+    # Readers only ever see a complete file
+    os.replace(temp, target)
+    return target
+
+
+class ThumbnailWorker:
+    # Makes thumbnails on background threads. Like DbWorker, results go on a
+    # completion queue that the Tk loop drains, so callbacks run on the main
+    # thread. Requests for a thumbnail that is already being made share it.
+
+    def __init__(self, cache_dir=THUMBNAIL_DIR, threads=2):
+        self.cache_dir = cache_dir
+        self.completed = queue.SimpleQueue()
+        self._jobs = queue.SimpleQueue()
+        self._pending = {}  # (digest, size) -> callbacks; Tk thread only
+        self._threads = []
+        for i in range(threads):
+            thread = threading.Thread(
+                target=self._run, name=f"thumbnails-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            key, source = job
+            digest, size = key
+            try:
+                path = make_thumbnail(source, digest, size, self.cache_dir)
+            except Exception as e:
+                self.completed.put((key, None, e))
+            else:
+                self.completed.put((key, path, None))
+
+    def request(self, source, digest, size, on_done, on_error=None):
+        # Call from the Tk thread. on_done(thumbnail path) runs from poll(),
+        # or right away when the thumbnail is already on disk.
+        cached = thumbnail_path(digest, size, self.cache_dir)
+        if os.path.exists(cached):
+            on_done(cached)
+            return
+        key = (digest, tuple(size))
+        if key in self._pending:
+            self._pending[key].append((on_done, on_error))
+            return
+        self._pending[key] = [(on_done, on_error)]
+        self._jobs.put((key, source))
+
+    def poll(self):
+        while True:
+            try:
+                key, path, error = self.completed.get_nowait()
+            except queue.Empty:
+                return
+            for on_done, on_error in self._pending.pop(key, ()):
+                if error is None:
+                    on_done(path)
+                elif on_error is not None:
+                    on_error(error)
+
+    def attach(self, tk_root, interval=POLL_INTERVAL_MS):
+        def poll_loop():
+            self.poll()
+            tk_root.after(interval, poll_loop)
+
+        tk_root.after(interval, poll_loop)
+
+    def close(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+class PhotoCache:
+    # Least recently used PhotoImages, keyed by (digest, size). Tk objects,
+    # so only use it from the Tk thread.
+
+    def __init__(self, capacity=PHOTO_CACHE_SIZE):
+        self.capacity = capacity
+        self._photos = OrderedDict()
+
+    def get(self, key):
+        photo = self._photos.get(key)
+        if photo is not None:
+            self._photos.move_to_end(key)
+        return photo
+
+    def put(self, key, photo):
+        self._photos[key] = photo
+        self._photos.move_to_end(key)
+        while len(self._photos) > self.capacity:
+            self._photos.popitem(last=False)
+        return photo
+
+    def __len__(self):
+        return len(self._photos)
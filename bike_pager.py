@@ -0,0 +1,291 @@
+import re
+
+from depots import DepotSet
+from fleet_store import BIKE_COLUMNS, bike_from_row
+import reservations
+
+PAGE_SIZE = 100
+
+# Columns the bike list can be sorted by. Each has an index, and ties are
+# broken by id, so (column, id) is a unique key to paginate on.
+SORT_COLUMNS = ("id", "name", "type", "price_per_hour", "available")
+
+
+def has_search_index(conn):
+    # The BikeSearch FTS5 table is missing if SQLite was built without FTS5
+    if isinstance(conn, DepotSet):
+        return all(conn.fan_out(has_search_index))
+    return (
+        conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'BikeSearch'"
+        ).fetchone()
+        is not None
+    )
+
+
+def sqlite_order(key):
+    # A key that sorts like SQLite's ORDER BY: NULL, then numbers, then text
+    order = []
+    for value in key:
+        if value is None:
+            order.append((0, 0))
+        elif isinstance(value, (int, float)):
+            order.append((1, value))
+        else:
+            order.append((2, value))
+    return tuple(order)
+
+
+def search_words(text):
+    return re.findall(r"\w+", text or "")
+
+
+def match_expression(text):
+    # As-you-type FTS5 query: every word must match the start of a word in
+    # the name or type
+    return " ".join(f'"{word}"*' for word in search_words(text))
+
+
+class BikeQuery:
+    # What the bike list shows: search text, column filters and sort order
+
+    def __init__(
+        self,
+        text="",
+        available=None,
+        bike_type=None,
+        min_price=None,
+        max_price=None,
+        sort="id",
+        descending=False,
+        free_slot=None,
+    ):
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort bikes by {sort!r}")
+        self.text = text
+        self.available = available  # None for all, True or False
+        self.bike_type = bike_type
+        self.min_price = min_price
+        self.max_price = max_price
+        self.sort = sort
+        self.descending = descending
+        self.free_slot = free_slot  # (starts_at, ends_at) the bike must be free
+
+    def filters(self, use_fts=True):
+        # WHERE clauses and parameters for the search and filters
+        clauses, params = [], []
+        if search_words(self.text):
+            if use_fts:
+                clauses.append(
+                    "id IN (SELECT rowid FROM BikeSearch WHERE BikeSearch MATCH ?)"
+                )
+                params.append(match_expression(self.text))
+            else:
+                for word in search_words(self.text):
+                    clauses.append("(name LIKE ? OR type LIKE ?)")
+                    params += [f"%{word}%", f"%{word}%"]
+        if self.available is not None:
+            clauses.append("available = ?")
+            params.append(1 if self.available else 0)
+        if self.bike_type:
+            clauses.append("type = ?")
+            params.append(self.bike_type)
+        if self.min_price is not None:
+            clauses.append("price_per_hour >= ?")
+            params.append(self.min_price)
+        if self.max_price is not None:
+            clauses.append("price_per_hour <= ?")
+            params.append(self.max_price)
+        if self.free_slot is not None:
+            clause, slot_params = reservations.free_clause()
+            clauses.append(clause)
+            params += slot_params(*self.free_slot)
+        return clauses, params
+
+    def key(self, bike):
+        # Position of a bike in this order
+        if self.sort == "id":
+            return (bike["id"],)
+        value = bike[self.sort]
+        if self.sort == "available":
+            value = int(value)
+        return (value, bike["id"])
+
+    def after(self, key, backwards=False):
+        # WHERE clause for the rows after key (before it when backwards)
+        op = ">" if self.descending == backwards else "<"
+        if self.sort == "id":
+            return f"id {op} ?", list(key)
+        return f"({self.sort}, id) {op} (?, ?)", list(key)
+
+    def order_by(self, backwards=False):
+        direction = "DESC" if self.descending != backwards else "ASC"
+        if self.sort == "id":
+            return f"id {direction}"
+        return f"{self.sort} {direction}, id {direction}"
+
+    def is_default(self):
+        return (
+            not search_words(self.text)
+            and self.available is None
+            and not self.bike_type
+            and self.min_price is None
+            and self.max_price is None
+            and self.free_slot is None
+            and self.sort == "id"
+            and not self.descending
+        )
+
+
+class BikePager:
+    # One window of the Bikes table at a time, using keyset pagination on the
+    # sort key so every page costs the same no matter how deep it is. Search,
+    # filters and sorting all happen in SQL (see BikeQuery). Only the current
+    # page and a prefetched next page are kept in memory. conn can also be a
+    # DepotSet, whose depots are then paged together.
+    #
+    # A window is (after, page_number, page, has_next). The fetch_ methods
+    # only read from the db they are given, so the app runs them on the
+    # database worker and hands the window to show_window on the Tk thread.
+
+    def __init__(self, conn, page_size=PAGE_SIZE):
+        self.conn = conn
+        self.page_size = page_size
+        self.query = BikeQuery()
+        self.use_fts = None  # looked up with the first query
+        self.after = None  # current page holds bikes after this key
+        self.page = []
+        self.page_number = 1
+        self.has_next = False
+        self.next_window = None  # prefetched window following self.page
+
+    def _select(self, db, query, after, backwards, limit):
+        if self.use_fts is None:
+            self.use_fts = has_search_index(db)
+        clauses, params = query.filters(self.use_fts)
+        if after is not None:
+            clause, key_params = query.after(after, backwards)
+            clauses.append(clause)
+            params += key_params
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = (
+            f"SELECT {BIKE_COLUMNS} FROM Bikes{where} "
+            f"ORDER BY {query.order_by(backwards)} LIMIT ?"
+        )
+        params.append(limit)
+        if not isinstance(db, DepotSet):
+            return db.execute(sql, params).fetchall()
+        # Every depot returns its first rows in this order, so merging them
+        # gives the first rows of the whole fleet
+        return db.merge(
+            lambda conn: conn.execute(sql, params).fetchall(),
+            key=lambda row: sqlite_order(query.key(bike_from_row(row))),
+            reverse=query.descending != backwards,
+            limit=limit,
+        )
+
+    def fetch_window(self, db, query, after, page_number):
+        # The page after key `after` (None for the first page)
+        rows = self._select(db, query, after, False, self.page_size + 1)
+        # The extra row only tells us whether another page exists
+        page = [bike_from_row(row) for row in rows[: self.page_size]]
+        return after, page_number, page, len(rows) > self.page_size
+
+    def fetch_window_before(self, db, query, key, page_number):
+        # The page that ends just before key; the first page if no bikes are
+        # left before it
+        rows = self._select(db, query, key, True, self.page_size + 1)
+        if not rows:
+            return self.fetch_window(db, query, None, 1)
+        page = [bike_from_row(row) for row in reversed(rows[: self.page_size])]
+        after = None
+        if len(rows) > self.page_size:
+            after = query.key(bike_from_row(rows[-1]))
+        return after, page_number, page, True
+
+    def show_window(self, query, window, next_window=None):
+        # Make window the current one; next_window (e.g. the page being left
+        # for the one before it) is kept as the prefetched next page if it
+        # follows on
+        self.query = query
+        self.after, self.page_number, self.page, self.has_next = window
+        self.next_window = None
+        if next_window is not None:
+            self.keep_next(query, next_window)
+        return self.page
+
+    def next_key(self):
+        # The key the page after the current one starts after
+        return self.query.key(self.page[-1])
+
+    def keep_next(self, query, window):
+        # Keep a prefetched window if it still follows the current page
+        if query is self.query and self.page and window[0] == self.next_key():
+            self.next_window = window
+
+    def replace(self, bikes):
+        # Put newer versions of bikes ({id: bike}) into the current and the
+        # prefetched page in place; True if any were on the current page.
+        # Only right when the change cannot move a bike to another page.
+        pages = [self.page] + ([self.next_window[2]] if self.next_window else [])
+        shown = False
+        for page in pages:
+            for index, bike in enumerate(page):
+                newer = bikes.get(bike["id"])
+                if newer is not None:
+                    page[index] = newer
+                    shown = shown or page is self.page
+        return shown
+
+    # The same on self.conn, on the calling thread
+
+    def reload(self):
+        # Re-read the current window, e.g. after a write
+        window = self.fetch_window(self.conn, self.query, self.after, self.page_number)
+        return self.show_window(self.query, window)
+
+    def first_page(self):
+        return self.show_window(
+            self.query, self.fetch_window(self.conn, self.query, None, 1)
+        )
+
+    def search(self, query):
+        self.query = query
+        return self.first_page()
+
+    def next_page(self):
+        if not self.has_next:
+            return self.page
+        window = self.next_window or self.fetch_window(
+            self.conn, self.query, self.next_key(), self.page_number + 1
+        )
+        return self.show_window(self.query, window)
+
+    def prefetch(self):
+        if self.has_next and self.next_window is None and self.page:
+            self.next_window = self.fetch_window(
+                self.conn, self.query, self.next_key(), self.page_number + 1
+            )
+
+    def prev_page(self):
+        if not self.page:
+            return self.first_page()
+        leaving = (self.after, self.page_number, self.page, self.has_next)
+        window = self.fetch_window_before(
+            self.conn,
+            self.query,
+            self.query.key(self.page[0]),
+            max(1, self.page_number - 1),
+        )
+        return self.show_window(self.query, window, leaving)
+
+    @property
+    def has_prev(self):
+        return self.after is not None
+
+    def describe(self):
+        if not self.page:
+            return "No bikes" if self.query.is_default() else "No matching bikes"
+        if self.query.is_default():
+            return f"Bike IDs {self.page[0]['id']}–{self.page[-1]['id']}"
+        return f"Page {self.page_number}"
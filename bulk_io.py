@@ -0,0 +1,225 @@
+"""Bulk fleet import and streaming export.
+
+    python bulk_io.py import bikes.csv [--db bike-rental.db]
+    python bulk_io.py export bikes bikes.jsonl
+    python bulk_io.py export rentals rentals.csv
+
+Files are CSV (with a header row) or JSON Lines, picked by extension or
+--format. Imports read the file a chunk at a time, validate each chunk and
+insert it with executemany inside one transaction per chunk, so a depot of
+thousands of bikes costs a handful of commits. Rejected rows are reported
+with their line numbers and do not stop the rest of the file. Exports stream
+rows from a cursor in batches and never hold a whole table in memory.
+
+Import columns: name, type, price_per_hour and optionally available
+(1/0/true/false/yes/no, default 1). An id column is ignored; imported bikes
+get new ids.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+from db import DB_FILE, connect
+from migrations import migrate
+import rental_service
+from rental_tx import RentalError, immediate
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+EXPORTS = {
+    "bikes": (
+        ["id", "name", "type", "price_per_hour", "available"],
+        "SELECT id, name, type, price_per_hour, available FROM Bikes ORDER BY id",
+    ),
+    "rentals": (
+        ["bike_id", "customer_name", "hours", "total_cost", "rented_at"],
+        "SELECT bike_id, customer_name, hours, total_cost, rented_at FROM Rentals",
+    ),
+}
+
+TRUE_TEXT = {"1", "true", "yes", "y", "available"}
+FALSE_TEXT = {"0", "false", "no", "n", "rented"}
+
+
+def guess_format(path, fmt=None):
+    if fmt:
+        return fmt
+    extension = os.path.splitext(path)[1].lower()
+    return "jsonl" if extension in (".jsonl", ".json", ".ndjson") else "csv"
+
+
+def read_records(f, fmt):
+    # Yields (line number, dict) one record at a time
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield line_number, record
+
+
+def validate_bike(record):
+    # Returns an INSERT parameter tuple, or raises ValueError with the reason
+    if not isinstance(record, dict):
+        raise ValueError("not a JSON object" if record is None else "not a record")
+    name = str(record.get("name") or "").strip()
+    bike_type = str(record.get("type") or "").strip()
+    price = str(record.get("price_per_hour", "")).strip()
+    available = str(record.get("available", "1")).strip().lower()
+
+    if not name:
+        raise ValueError("name is empty")
+    if not bike_type:
+        raise ValueError("type is empty")
+    try:
+        price = rental_service.as_count(
+            price, f"price_per_hour {price!r} is not a whole number SQLite can store"
+        )
+    except RentalError as e:
+        raise ValueError(str(e)) from None
+    if available in TRUE_TEXT:
+        available = 1
+    elif available in FALSE_TEXT:
+        available = 0
+    else:
+        raise ValueError(f"available {available!r} is not 1/0")
+    return name, bike_type, price, available
+
+
+def chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def insert_bikes(db, rows):
+    # rows: validate_bike tuples, inserted in the caller's transaction
+    db.executemany(
+        "INSERT INTO Bikes (name, type, price_per_hour, available) VALUES (?, ?, ?, ?)",
+        rows,
+    )
+    return len(rows)
+
+
+def import_bikes(conn, records, chunk_size=CHUNK_SIZE, progress=None, insert=None):
+    # records: iterable of (line number, record). Returns a summary dict.
+    # insert(rows) stores a chunk; by default in a transaction of its own on
+    # conn (depots.import_file sends chunks through group commit instead).
+    if insert is None:
+
+        def insert(rows):
+            return immediate(conn, lambda db: insert_bikes(db, rows))
+
+    summary = {"imported": 0, "rejected": 0, "errors": []}
+    for chunk in chunks(records, chunk_size):
+        rows = []
+        for line_number, record in chunk:
+            try:
+                rows.append(validate_bike(record))
+            except ValueError as e:
+                summary["rejected"] += 1
+                if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                    summary["errors"].append(f"line {line_number}: {e}")
+
+        if rows:
+            insert(rows)
+            summary["imported"] += len(rows)
+        if progress:
+            progress(summary)
+    return summary
+
+
+def import_file(
+    conn, path, fmt=None, chunk_size=CHUNK_SIZE, progress=None, insert=None
+):
+    fmt = guess_format(path, fmt)
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return import_bikes(conn, read_records(f, fmt), chunk_size, progress, insert)
+
+
+def export_rows(conn, table, batch_size=CHUNK_SIZE):
+    # Yields rows of Bikes or Rentals a batch at a time from an open cursor
+    cursor = conn.execute(EXPORTS[table][1])
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def write_rows(rows, table, path, fmt=None):
+    # Stream rows of an EXPORTS table to a CSV or JSON Lines file
+    fmt = guess_format(path, fmt)
+    columns = EXPORTS[table][0]
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(dict(zip(columns, row))) + "\n")
+                count += 1
+    return count
+
+
+def export_file(conn, table, path, fmt=None, batch_size=CHUNK_SIZE):
+    return write_rows(export_rows(conn, table, batch_size), table, path, fmt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk bike import and export")
+    parser.add_argument("--db", default=DB_FILE)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="import bikes from a file")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=["csv", "jsonl"])
+    import_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    export_parser = commands.add_parser("export", help="export bikes or rentals")
+    export_parser.add_argument("table", choices=sorted(EXPORTS))
+    export_parser.add_argument("path")
+    export_parser.add_argument("--format", choices=["csv", "jsonl"])
+
+    args = parser.parse_args()
+    conn = connect(args.db)
+    migrate(conn)
+
+    if args.command == "import":
+        summary = import_file(conn, args.path, args.format, args.chunk_size)
+        print(f"Imported {summary['imported']} bikes, rejected {summary['rejected']}.")
+        for error in summary["errors"]:
+            print(f"  {error}", file=sys.stderr)
+        if summary["rejected"] > len(summary["errors"]):
+            print(
+                f"  ... and {summary['rejected'] - len(summary['errors'])} more",
+                file=sys.stderr,
+            )
+    else:
+        count = export_file(conn, args.table, args.path, args.format)
+        print(f"Exported {count} {args.table} to {args.path}.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
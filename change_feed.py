@@ -0,0 +1,73 @@
+from fleet_store import BIKE_COLUMNS, RENTAL_COLUMNS
+
+# Change feed for open counters. Every insert, update and delete of a bike,
+# a rental or a reservation appends the bike's id to the Changes table
+# (triggers, so the GUI, the API, group commit, imports and anything else
+# that writes are all covered). Changes.seq only ever grows: a counter
+# remembers the last seq it applied and now and then asks for the ones
+# after it, which is one primary key range read, empty most of the time.
+# For each changed bike it gets the bike's current row and open rental
+# (None if there is none any more) and patches its fleet store and the
+# rows on screen; nothing else is read again.
+#
+# Changes is kept short by the triggers themselves: every 1000th entry
+# removes those more than 10000 behind it. A counter that falls further
+# behind than that (say during a bulk import) is told so and reloads the
+# fleet instead.
+
+POLL_INTERVAL_MS = 500  # how often open counters look for changes
+CHANGE_BATCH = 1000  # changes read at most per look
+ROWS_PER_QUERY = 500  # bike ids per IN (...) list
+
+
+def latest_seq(conn):
+    # The last change so far; take it before loading what it applies to
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM Changes").fetchone()[0]
+
+
+def fetch_rows(conn, bike_ids):
+    # {bike id: (bike row or None, rental row or None)}
+    changed = dict.fromkeys(bike_ids, (None, None))
+    bike_ids = list(changed)
+    for start in range(0, len(bike_ids), ROWS_PER_QUERY):
+        chunk = bike_ids[start : start + ROWS_PER_QUERY]
+        placeholders = ", ".join("?" * len(chunk))
+        for row in conn.execute(
+            f"SELECT {BIKE_COLUMNS} FROM Bikes WHERE id IN ({placeholders})", chunk
+        ):
+            changed[row[0]] = (row, None)
+        for row in conn.execute(
+            f"SELECT {RENTAL_COLUMNS} FROM Rentals WHERE bike_id IN ({placeholders})",
+            chunk,
+        ):
+            changed[row[0]] = (changed[row[0]][0], row)
+    return changed
+
+
+def read_changes(conn, after, limit=CHANGE_BATCH):
+    # The changes after seq `after`: (last seq read, {bike id: (bike row,
+    # rental row)}). The dict is None when the log no longer goes back that
+    # far; the seq is then the current end of the log.
+    rows = conn.execute(
+        "SELECT seq, bike_id FROM Changes WHERE seq > ? ORDER BY seq LIMIT ?",
+        (after, limit),
+    ).fetchall()
+    if not rows:
+        return after, {}
+    # AUTOINCREMENT numbers commits without gaps (a rolled back change gives
+    # its number back), so a gap means the entries were pruned
+    if rows[0][0] > after + 1:
+        return latest_seq(conn), None
+    return rows[-1][0], fetch_rows(conn, sorted({bike_id for _, bike_id in rows}))
+
+
+def apply_changes(fleet, changed):
+    # Patch a FleetStore with rows from read_changes. Returns True if bikes
+    # were added or removed, which can move other bikes between pages.
+    reshaped = False
+    for bike_id, (bike_row, rental_row) in changed.items():
+        existed = fleet.get_bike(bike_id) is not None
+        fleet.apply_bike_row(bike_id, bike_row)
+        fleet.apply_rental_row(bike_id, rental_row)
+        reshaped = reshaped or existed != (bike_row is not None)
+    return reshaped
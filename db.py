@@ -0,0 +1,68 @@
+import os
+import sqlite3
+
+import instrumentation
+
+DB_FILE = "bike-rental.db"
+
+# Prepared statements kept per connection (sqlite3 evicts least recently used)
+STATEMENT_CACHE_SIZE = 256
+
+# Connection tuning profiles. "fast" is the default for the counter app:
+# WAL lets readers keep going while a rental is being written and
+# synchronous=NORMAL only fsyncs at checkpoints instead of every commit.
+PROFILES = {
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # negative means KiB, so 64 MiB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    # Closest to plain sqlite3.connect(): rollback journal, fsync every commit
+    "safe": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -2 * 1024,
+        "temp_store": "DEFAULT",
+        "busy_timeout": 5000,
+    },
+}
+DEFAULT_PROFILE = os.environ.get("BIKE_RENT_DB_PROFILE", "fast")
+
+
+def connect(path=DB_FILE, profile=None, **overrides):
+    # Open a connection and apply a tuning profile; keyword arguments override
+    # single settings, e.g. connect(mmap_size=0)
+    profile = profile or DEFAULT_PROFILE
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown database profile: {profile!r}")
+    settings = dict(PROFILES[profile], **overrides)
+
+    conn = sqlite3.connect(
+        path,
+        timeout=settings["busy_timeout"] / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        **instrumentation.connect_options(),
+    )
+    instrumentation.attach(conn)
+    apply_profile(conn, settings)
+    return conn
+
+
+def apply_profile(conn, settings):
+    if path_is_memory(conn):
+        settings = dict(settings, journal_mode="MEMORY", mmap_size=0)
+    conn.execute(f"PRAGMA journal_mode = {settings['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+    conn.execute(f"PRAGMA mmap_size = {int(settings['mmap_size'])}")
+    conn.execute(f"PRAGMA cache_size = {int(settings['cache_size'])}")
+    conn.execute(f"PRAGMA temp_store = {settings['temp_store']}")
+    conn.execute(f"PRAGMA busy_timeout = {int(settings['busy_timeout'])}")
+
+
+def path_is_memory(conn):
+    # An in-memory or temporary database reports an empty file name
+    return not conn.execute("PRAGMA database_list").fetchone()[2]
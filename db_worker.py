@@ -0,0 +1,83 @@
+import queue
+import threading
+
+from db import DB_FILE, connect
+
+POLL_INTERVAL_MS = 20
+
+
+class DbWorker:
+    # Runs database work off the Tk main thread. Writes go to a single writer
+    # thread (SQLite only allows one writer anyway), reads are spread over a
+    # few reader threads. Every thread owns its own connection.
+    #
+    # Jobs are plain functions taking a connection. Their result (or the
+    # exception they raised) is put on a completion queue that the Tk loop
+    # drains with root.after, so callbacks always run on the main thread.
+    # Given a depots.DepotSet, jobs get that instead and pick their depot.
+
+    def __init__(self, path=DB_FILE, readers=2, profile=None, depots=None):
+        self.path = path
+        self.profile = profile
+        self.depots = depots
+        self.completed = queue.SimpleQueue()
+        self._write_jobs = queue.SimpleQueue()
+        self._read_jobs = queue.SimpleQueue()
+        self._threads = [self._start(self._write_jobs, "db-writer")]
+        for i in range(readers):
+            self._threads.append(self._start(self._read_jobs, f"db-reader-{i}"))
+
+    def _start(self, jobs, name):
+        thread = threading.Thread(target=self._run, args=(jobs,), name=name, daemon=True)
+        thread.start()
+        return thread
+
+    def _run(self, jobs):
+        if self.depots is not None:
+            conn = self.depots
+        else:
+            conn = connect(self.path, self.profile)
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            work, on_done, on_error = job
+            try:
+                result = work(conn)
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                self.completed.put((on_error, e))
+            else:
+                self.completed.put((on_done, result))
+        conn.close()
+
+    def submit_write(self, work, on_done=None, on_error=None):
+        self._write_jobs.put((work, on_done, on_error))
+
+    def submit_read(self, work, on_done=None, on_error=None):
+        self._read_jobs.put((work, on_done, on_error))
+
+    def poll(self):
+        # Run the callbacks of every finished job; call from the Tk thread
+        while True:
+            try:
+                callback, value = self.completed.get_nowait()
+            except queue.Empty:
+                return
+            if callback is not None:
+                callback(value)
+
+    def attach(self, tk_root, interval=POLL_INTERVAL_MS):
+        def poll_loop():
+            self.poll()
+            tk_root.after(interval, poll_loop)
+
+        tk_root.after(interval, poll_loop)
+
+    def close(self):
+        self._write_jobs.put(None)
+        for _ in self._threads[1:]:
+            self._read_jobs.put(None)
+        for thread in self._threads:
+            thread.join()
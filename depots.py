@@ -0,0 +1,704 @@
+"""Multi-depot storage: one SQLite file per depot.
+
+    python depots.py list
+    python depots.py add "North Station" [--path depot-north.db]
+
+A single bike-rental.db has one write lock that every counter in every
+depot queues on. With depots, each depot keeps its bikes, rentals,
+reservations and revenue in its own file, so rentals at different depots
+never wait for each other. depots.json lists the files:
+
+    {"depots": [{"number": 0, "name": "Main", "path": "bike-rental.db"},
+                {"number": 1, "name": "North Station", "path": "depot-north.db"}]}
+
+Without depots.json there is one depot, bike-rental.db, exactly as before.
+
+Each depot hands out bike and reservation ids from its own block of
+ID_BLOCK ids (depot 0 from 1, depot 1 from 10000001, ...), so an id alone
+says which file it lives in and rent, return, delete and cancel go straight
+to that depot. New bikes go to the depot the counter belongs to. Users are
+kept in the first depot only; api_server.py --depots (and the kiosks
+syncing through it) routes requests the same way. Fleet views and reports
+ask every depot at once on a thread pool and merge the answers; because
+the id blocks are in depot order, results sorted by id can simply be put
+one after the other.
+"""
+
+import argparse
+import heapq
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import chain, islice
+
+import analytics
+import bike_images
+import bulk_io
+import change_feed
+from db import DB_FILE, connect
+from fleet_store import BIKE_COLUMNS, RENTAL_COLUMNS, FleetStore
+from group_commit import BATCH_MAX, BATCH_WINDOW, GroupCommitter
+from kiosk import Kiosk, changes_since as replica_changes
+from migrations import migrate
+import pricing
+import rental_service
+from rental_tx import RentalError, immediate
+
+DEPOTS_FILE = "depots.json"
+ID_BLOCK = 10_000_000  # bike and reservation ids per depot
+
+
+class Depot:
+    def __init__(self, number, name, path):
+        self.number = number
+        self.name = name
+        self.path = path
+
+    def as_dict(self):
+        return {"number": self.number, "name": self.name, "path": self.path}
+
+
+def depot_number(record_id):
+    # The depot whose id block holds a bike or reservation id
+    return (record_id - 1) // ID_BLOCK
+
+
+# depots.json
+
+
+def read_manifest(path=DEPOTS_FILE):
+    # The depots in number order; paths are relative to the manifest
+    if not os.path.exists(path):
+        return [Depot(0, "Main", DB_FILE)]
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)["depots"]
+    base = os.path.dirname(path)
+    depots = [
+        Depot(int(entry["number"]), entry["name"], os.path.join(base, entry["path"]))
+        for entry in entries
+    ]
+    numbers = [depot.number for depot in depots]
+    if not depots or len(set(numbers)) != len(numbers) or min(numbers) < 0:
+        raise ValueError(f"{path} must list depots with distinct numbers.")
+    return sorted(depots, key=lambda depot: depot.number)
+
+
+def write_manifest(depots, path=DEPOTS_FILE):
+    base = os.path.dirname(path)
+    entries = [
+        dict(depot.as_dict(), path=os.path.relpath(depot.path, base or "."))
+        for depot in depots
+    ]
+    temp = f"{path}.tmp"
+    with open(temp, "w", encoding="utf-8") as f:
+        json.dump({"depots": entries}, f, indent=2)
+    os.replace(temp, path)
+
+
+def file_depot(conn):
+    # The depot number recorded in a file by init_depot, or None for a file
+    # no depot has claimed (a single bike-rental.db)
+    row = conn.execute("SELECT number FROM DepotInfo").fetchone()
+    return None if row is None else row[0]
+
+
+def init_depot(conn, depot):
+    # Bring a depot's file up to date and, the first time, record which
+    # depot it is and start its id sequences at the depot's block
+    migrate(conn)
+    first, last = depot.number * ID_BLOCK + 1, (depot.number + 1) * ID_BLOCK
+
+    def work(db):
+        number = file_depot(db)
+        if number is not None:
+            if number != depot.number:
+                raise ValueError(
+                    f"{depot.path} holds depot {number}, not depot {depot.number}."
+                )
+            return
+        for table in ("Bikes", "Reservations"):
+            low, high = db.execute(f"SELECT MIN(id), MAX(id) FROM {table}").fetchone()
+            if low is not None and (low < first or high > last):
+                raise ValueError(
+                    f"{depot.path} has {table} ids outside depot {depot.number}'s "
+                    f"block ({first}-{last})."
+                )
+            if not db.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?",
+                (first - 1, table),
+            ).rowcount:
+                db.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)",
+                    (table, first - 1),
+                )
+        db.execute(
+            "INSERT INTO DepotInfo (id, number, name) VALUES (1, ?, ?)",
+            (depot.number, depot.name),
+        )
+
+    immediate(conn, work)
+
+
+def add_depot(name, path=None, manifest=DEPOTS_FILE):
+    # Create a depot file and list it in the manifest; returns the Depot
+    depots = read_manifest(manifest)
+    if any(depot.name == name for depot in depots):
+        raise ValueError(f"There is already a depot called {name!r}.")
+    slug = re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or "depot"
+    number = depots[-1].number + 1
+    depot = Depot(number, name, path or f"depot-{number}-{slug}.db")
+    conn = connect(depot.path)
+    try:
+        init_depot(conn, depot)
+    finally:
+        conn.close()
+    write_manifest(depots + [depot], manifest)
+    return depot
+
+
+# Connections
+
+
+class DepotSet:
+    # The open depots. Connections are per thread (like DbWorker and the
+    # API's readers), so one DepotSet can be shared by the Tk thread, the
+    # database worker and the fan-out pool. The pool gets a thread per depot
+    # up to one per CPU; with one depot or one CPU the depots are simply
+    # asked in turn, which on a single core is faster than switching threads.
+    # With group commit on, writes go through a GroupCommitter per depot;
+    # at a kiosk, through the Kiosk.
+
+    def __init__(self, depots, profile=None, threads=None):
+        self.depots = sorted(depots, key=lambda depot: depot.number)
+        self.home = self.depots[0]  # where the users are kept
+        self.profile = profile
+        self.threads = min(len(self.depots), threads or os.cpu_count() or 1)
+        self._by_number = {depot.number: depot for depot in self.depots}
+        self._local = threading.local()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.committers = {}  # depot number -> GroupCommitter (or Kiosk)
+
+    def find(self, name):
+        # A depot by name or number
+        for depot in self.depots:
+            if name in (depot.name, str(depot.number)):
+                return depot
+        raise ValueError(f"No depot called {name!r}.")
+
+    def connection(self, depot=None):
+        # This thread's connection to a depot (the home depot by default)
+        depot = depot or self.home
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get(depot.number)
+        if conn is None:
+            conn = conns[depot.number] = connect(depot.path, self.profile)
+        return conn
+
+    def depot_of(self, record_id):
+        # The depot holding a bike or reservation id, or None
+        try:
+            record_id = int(str(record_id).strip())
+        except ValueError:
+            return None
+        return self._by_number.get(depot_number(record_id))
+
+    def owner(self, record_id):
+        # The depot of an id. Ids that are not valid go to the home depot,
+        # whose own checks then give the usual error message.
+        return self.depot_of(record_id) or self.home
+
+    def route(self, record_id):
+        # Connection to the depot of an id
+        return self.connection(self.owner(record_id))
+
+    def start_group_commit(
+        self, journal=None, max_batch=BATCH_MAX, max_delay=BATCH_WINDOW, extra=None
+    ):
+        # Commit the writes of each depot in groups, with a journal called
+        # journal next to each depot file (see group_commit). extra: more
+        # operations for every depot (api_server's kiosk syncs).
+        for depot in self.depots:
+            operations = dict(
+                rental_service.WRITE_OPERATIONS,
+                **rental_service.INTERNAL_OPERATIONS,
+                **(extra or {}),
+                add_bike=partial(add_bike_in_tx, depot=depot),
+                import_bikes=bulk_io.insert_bikes,
+            )
+            self.committers[depot.number] = GroupCommitter(
+                depot.path, journal, self.profile, max_batch, max_delay, operations
+            )
+
+    def fan_out(self, func):
+        # [func(conn) for every depot], run on all depots at once; results
+        # in depot order
+        if self.threads <= 1:
+            return [func(self.connection(depot)) for depot in self.depots]
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix="depot")
+        futures = [
+            self._pool.submit(lambda depot=depot: func(self.connection(depot)))
+            for depot in self.depots
+        ]
+        return [future.result() for future in futures]
+
+    def merge(self, func, key, reverse=False, limit=None):
+        # func(conn) returns rows sorted by key on each depot; the first
+        # `limit` rows of all depots together, in the same order
+        merged = heapq.merge(*self.fan_out(func), key=key, reverse=reverse)
+        return list(islice(merged, limit))
+
+    # DbWorker treats a DepotSet like a connection; these act on the
+    # calling thread's connections
+
+    @property
+    def in_transaction(self):
+        conns = getattr(self._local, "conns", {})
+        return any(conn.in_transaction for conn in conns.values())
+
+    def rollback(self):
+        for conn in getattr(self._local, "conns", {}).values():
+            if conn.in_transaction:
+                conn.rollback()
+
+    def close(self):
+        for conn in getattr(self._local, "conns", {}).values():
+            conn.close()
+        self._local.conns = {}
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+        for committer in self.committers.values():
+            committer.close()
+        self.committers = {}
+
+
+def open_depots(manifest=DEPOTS_FILE, profile=None):
+    # Read the manifest, bring every depot file up to date and return a
+    # DepotSet
+    depot_set = DepotSet(read_manifest(manifest), profile)
+    for depot in depot_set.depots:
+        init_depot(depot_set.connection(depot), depot)
+    return depot_set
+
+
+def open_file(path, profile=None):
+    # A DepotSet over one database file as the only (home) depot, for
+    # api_server --db
+    depot = Depot(0, "Main", path)
+    depot_set = DepotSet([depot], profile)
+    init_depot(depot_set.connection(depot), depot)
+    return depot_set
+
+
+def open_kiosk(replica, profile=None):
+    # A DepotSet over a kiosk replica (see kiosk) as its only depot. Its
+    # writes go to the kiosk, which queues them for the primary.
+    kiosk = Kiosk(replica, profile)
+    depot_set = DepotSet([Depot(0, kiosk.name, replica)], profile)
+    depot_set.committers[0] = kiosk
+    return depot_set
+
+
+# Routed operations: the rental_service calls, sent to the depot that
+# owns the bike or reservation
+
+
+def operation_depot(depot_set, name, params):
+    # The depot a rental_service write operation runs in: the one holding its
+    # bike or reservation, else the home depot (sign-ups, and new bikes
+    # unless the caller picks a depot)
+    key = params.get("reservation_id" if name == "cancel_reservation" else "bike_id")
+    return depot_set.home if key is None else depot_set.owner(key)
+
+
+def write(depot_set, depot, name, params, direct):
+    # A write operation on a depot: the named operation through the depot's
+    # GroupCommitter when group commit is on, else direct(conn)
+    committer = depot_set.committers.get(depot.number)
+    if committer is not None:
+        return committer.call(name, params)
+    return direct(depot_set.connection(depot))
+
+
+def login(depot_set, username, password):
+    return rental_service.login(depot_set.connection(), username, password)
+
+
+def sign_up(depot_set, username, password, is_admin=False):
+    return write(
+        depot_set,
+        depot_set.home,
+        "sign_up",
+        {"username": username, "password": password, "is_admin": is_admin},
+        lambda conn: rental_service.sign_up(conn, username, password, is_admin),
+    )
+
+
+def rent_bike(depot_set, bike_id, customer_name, hours, stats=None):
+    return write(
+        depot_set,
+        depot_set.owner(bike_id),
+        "rent",
+        {"bike_id": bike_id, "customer_name": customer_name, "hours": hours},
+        lambda conn: rental_service.rent_bike(
+            conn, bike_id, customer_name, hours, stats
+        ),
+    )
+
+
+def return_bike(depot_set, bike_id, stats=None):
+    return write(
+        depot_set,
+        depot_set.owner(bike_id),
+        "return",
+        {"bike_id": bike_id},
+        lambda conn: rental_service.return_bike(conn, bike_id, stats),
+    )
+
+
+def add_bike_in_tx(db, depot, name, bike_type, price_per_hour):
+    bike = rental_service.add_bike_in_tx(db, name, bike_type, price_per_hour)
+    if depot_number(bike["id"]) != depot.number:
+        raise RentalError(f"Depot {depot.name} has no bike IDs left.")
+    return bike
+
+
+def add_bike(depot_set, depot, name, bike_type, price_per_hour):
+    return write(
+        depot_set,
+        depot,
+        "add_bike",
+        {"name": name, "bike_type": bike_type, "price_per_hour": price_per_hour},
+        lambda conn: immediate(
+            conn, lambda db: add_bike_in_tx(db, depot, name, bike_type, price_per_hour)
+        ),
+    )
+
+
+def delete_bike(depot_set, bike_id):
+    return write(
+        depot_set,
+        depot_set.owner(bike_id),
+        "delete_bike",
+        {"bike_id": bike_id},
+        lambda conn: rental_service.delete_bike(conn, bike_id),
+    )
+
+
+def get_bike(depot_set, bike_id):
+    return rental_service.get_bike(depot_set.route(bike_id), bike_id)
+
+
+def reserve_bike(depot_set, bike_id, customer_name, starts_at, ends_at, stats=None):
+    return write(
+        depot_set,
+        depot_set.owner(bike_id),
+        "reserve",
+        {
+            "bike_id": bike_id,
+            "customer_name": customer_name,
+            "starts_at": starts_at,
+            "ends_at": ends_at,
+        },
+        lambda conn: rental_service.reserve_bike(
+            conn, bike_id, customer_name, starts_at, ends_at, stats
+        ),
+    )
+
+
+def cancel_reservation(depot_set, reservation_id):
+    return write(
+        depot_set,
+        depot_set.owner(reservation_id),
+        "cancel_reservation",
+        {"reservation_id": reservation_id},
+        lambda conn: rental_service.cancel_reservation(conn, reservation_id),
+    )
+
+
+def list_reservations(depot_set, bike_id):
+    return rental_service.list_reservations(depot_set.route(bike_id), bike_id)
+
+
+def set_image(depot_set, bike_id, path):
+    return bike_images.set_image(depot_set.route(bike_id), bike_id, path)
+
+
+def fetch_bike_row(depot_set, bike_id):
+    return depot_set.route(bike_id).execute(
+        f"SELECT {BIKE_COLUMNS} FROM Bikes WHERE id = ?", (bike_id,)
+    ).fetchone()
+
+
+def fetch_rental_row(depot_set, bike_id):
+    return depot_set.route(bike_id).execute(
+        f"SELECT {RENTAL_COLUMNS} FROM Rentals WHERE bike_id = ?", (bike_id,)
+    ).fetchone()
+
+
+# Views over every depot
+
+
+def load_fleet(depot_set):
+    # Each depot reads its rows in parallel; their id blocks are in depot
+    # order, so the rows go into the store one depot after another
+    def read(conn):
+        return (
+            conn.execute(f"SELECT {BIKE_COLUMNS} FROM Bikes ORDER BY id").fetchall(),
+            conn.execute(
+                f"SELECT {RENTAL_COLUMNS} FROM Rentals ORDER BY bike_id"
+            ).fetchall(),
+        )
+
+    parts = depot_set.fan_out(read)
+    fleet = FleetStore()
+    fleet.load_rows(
+        chain.from_iterable(bikes for bikes, _ in parts),
+        chain.from_iterable(rentals for _, rentals in parts),
+    )
+    return fleet
+
+
+def change_marks(depot_set):
+    # {depot number: end of its change log}; taken before the fleet is
+    # loaded, so nothing that happens during the load is missed
+    return dict(
+        zip(
+            (depot.number for depot in depot_set.depots),
+            depot_set.fan_out(change_feed.latest_seq),
+        )
+    )
+
+
+def read_changes(depot_set, marks):
+    # change_feed.read_changes on every depot in turn (each is one primary
+    # key range read): (new marks, {bike id: (bike row, rental row)}). The
+    # rows are None if any depot's log no longer reaches back to its mark.
+    marks, changed = dict(marks), {}
+    for depot in depot_set.depots:
+        seq, rows = change_feed.read_changes(
+            depot_set.connection(depot), marks.get(depot.number, 0)
+        )
+        marks[depot.number] = seq
+        if rows is None:
+            changed = None
+        elif changed is not None:
+            changed.update(rows)
+    return marks, changed
+
+
+def list_bikes(depot_set, after_id=0, limit=100):
+    # rental_service.list_bikes over every depot. The id blocks are in depot
+    # order, so the depots are asked in turn until the page is full.
+    limit = min(rental_service.as_count(limit, "limit must be a number."), 1000)
+    bikes = []
+    for depot in depot_set.depots:
+        if len(bikes) == limit:
+            break
+        bikes += rental_service.list_bikes(
+            depot_set.connection(depot), after_id, limit - len(bikes)
+        )
+    return bikes
+
+
+def list_free_bikes(depot_set, starts_at, ends_at, bike_type=None, after_id=0, limit=100):
+    # rental_service.list_free_bikes over every depot, like list_bikes
+    limit = min(rental_service.as_count(limit, "limit must be a number."), 1000)
+    bikes = []
+    for depot in depot_set.depots:
+        if len(bikes) == limit:
+            break
+        bikes += rental_service.list_free_bikes(
+            depot_set.connection(depot),
+            starts_at,
+            ends_at,
+            bike_type,
+            after_id,
+            limit - len(bikes),
+        )
+    return bikes
+
+
+def list_rentals(depot_set):
+    return list(chain.from_iterable(depot_set.fan_out(rental_service.list_rentals)))
+
+
+def change_cursor(seqs):
+    # Where a kiosk stands in every depot's change log: the seqs joined with
+    # commas, or the seq alone with one depot (as kiosks have always kept it)
+    return seqs[0] if len(seqs) == 1 else ",".join(str(seq) for seq in seqs)
+
+
+def latest_changes(depot_set):
+    return change_cursor(depot_set.fan_out(change_feed.latest_seq))
+
+
+def changes_since(depot_set, after):
+    # kiosk.changes_since over every depot, for GET /changes. A cursor made
+    # for another set of depots gets "changes" None, so the kiosk copies
+    # every bike again.
+    seqs = str(after).split(",")
+    if len(seqs) != len(depot_set.depots):
+        return {"seq": latest_changes(depot_set), "changes": None}
+    answers = [
+        replica_changes(depot_set.connection(depot), seq)
+        for depot, seq in zip(depot_set.depots, seqs)
+    ]
+    seq = change_cursor([answer["seq"] for answer in answers])
+    if any(answer["changes"] is None for answer in answers):
+        return {"seq": seq, "changes": None}
+    return {
+        "seq": seq,
+        "changes": list(chain.from_iterable(answer["changes"] for answer in answers)),
+    }
+
+
+def get_images(depot_set, bike_ids):
+    # bike_images.get_images for bikes of any depot. The bikes on a page of
+    # the list are from one or two depots, so those are asked in turn.
+    groups = {}
+    for bike_id in bike_ids:
+        depot = depot_set.depot_of(bike_id)
+        if depot is not None:
+            groups.setdefault(depot.number, (depot, []))[1].append(bike_id)
+    images = {}
+    for depot, ids in groups.values():
+        images.update(bike_images.get_images(depot_set.connection(depot), ids))
+    return images
+
+
+def hourly_rates(depot_set, bikes, at=None):
+    # pricing.hourly_rates for bikes of any depot; each depot prices its own
+    # bikes with its own rules
+    groups = {}
+    for position, bike in enumerate(bikes):
+        depot = depot_set.depot_of(bike["id"]) or depot_set.home
+        groups.setdefault(depot.number, (depot, []))[1].append(position)
+    rates = [None] * len(bikes)
+    for depot, positions in groups.values():
+        depot_rates = pricing.hourly_rates(
+            depot_set.connection(depot), [bikes[i] for i in positions], at
+        )
+        for position, rate in zip(positions, depot_rates):
+            rates[position] = rate
+    return rates
+
+
+def import_file(depot_set, depot, path, fmt=None):
+    # bulk_io.import_file into a depot. With group commit each chunk is one
+    # import_bikes operation of the depot's committer, so it is journaled
+    # like any other write; a kiosk refuses it.
+    committer = depot_set.committers.get(depot.number)
+    if committer is None:
+        return bulk_io.import_file(depot_set.connection(depot), path, fmt)
+    return bulk_io.import_file(
+        None,
+        path,
+        fmt,
+        insert=lambda rows: committer.call("import_bikes", {"rows": rows}),
+    )
+
+
+def export_file(depot_set, table, path, fmt=None):
+    # One file with the rows of every depot, streamed depot by depot
+    rows = chain.from_iterable(
+        bulk_io.export_rows(depot_set.connection(depot), table)
+        for depot in depot_set.depots
+    )
+    return bulk_io.write_rows(rows, table, path, fmt)
+
+
+def add_up(rows, fields, key=None):
+    # Sum the fields of rows (dicts); with key, separately per key value
+    totals = {}
+    for row in rows:
+        total = totals.get(row[key] if key else None)
+        if total is None:
+            totals[row[key] if key else None] = dict(row)
+        else:
+            for field in fields:
+                total[field] += row[field]
+    return list(totals.values())
+
+
+def dashboard(depot_set, today=None):
+    # analytics.dashboard for all depots together
+    reports = depot_set.fan_out(lambda conn: analytics.dashboard(conn, today))
+    if len(reports) == 1:
+        return reports[0]
+    fields = ("revenue", "hours", "rentals")
+    by_type = add_up(
+        chain.from_iterable(report["by_type"] for report in reports),
+        fields + ("active",),
+        key="type",
+    )
+    top_bikes = chain.from_iterable(report["top_bikes"] for report in reports)
+    return {
+        "totals": add_up([r["totals"] for r in reports], fields + ("active",))[0],
+        "today": add_up([r["today"] for r in reports], fields)[0],
+        "by_type": sorted(by_type, key=lambda row: row["revenue"], reverse=True),
+        "top_bikes": heapq.nlargest(10, top_bikes, key=lambda row: row["revenue"]),
+    }
+
+
+def rollup(depot_set, start, end, period="day"):
+    # analytics.rollup for all depots together
+    buckets = {}
+    for rows in depot_set.fan_out(
+        lambda conn: analytics.rollup(conn, start, end, period)
+    ):
+        for key, revenue, hours, rentals in rows:
+            bucket = buckets.setdefault(key, [0.0, 0, 0])
+            bucket[0] += revenue
+            bucket[1] += hours
+            bucket[2] += rentals
+    return [(key, *bucket) for key, bucket in sorted(buckets.items())]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Depots")
+    parser.add_argument("--manifest", default=DEPOTS_FILE)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="list the depots and their bikes")
+
+    add_parser = commands.add_parser("add", help="create a depot")
+    add_parser.add_argument("name")
+    add_parser.add_argument("--path", help="database file for the depot")
+
+    args = parser.parse_args()
+    if args.command == "add":
+        try:
+            depot = add_depot(args.name, args.path, args.manifest)
+        except ValueError as e:
+            parser.exit(1, f"{e}\n")
+        first = depot.number * ID_BLOCK + 1
+        print(f"Added depot {depot.number} {depot.name!r} in {depot.path}.")
+        print(f"Its bike IDs start at {first}.")
+        return
+
+    depot_set = open_depots(args.manifest)
+    counts = depot_set.fan_out(
+        lambda conn: conn.execute(
+            "SELECT (SELECT COUNT(*) FROM Bikes), (SELECT COUNT(*) FROM Rentals)"
+        ).fetchone()
+    )
+    for depot, (bikes, rentals) in zip(depot_set.depots, counts):
+        print(
+            f"{depot.number:>3}  {depot.name:<20} {bikes:>8} bikes "
+            f"{rentals:>7} rented  {depot.path}"
+        )
+    depot_set.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,611 @@
+from array import array
+from bisect import bisect_left
+from itertools import compress
+from math import isnan
+
+BIKE_COLUMNS = "id, name, type, price_per_hour, available"
+RENTAL_COLUMNS = "bike_id, customer_name, hours, total_cost"
+
+
+def bike_from_row(row):
+    return {
+        "id": row[0],
+        "name": row[1],
+        "type": row[2],
+        "price_per_hour": row[3],
+        "available": bool(int(row[4])),
+    }
+
+
+def rental_from_row(row):
+    return {
+        "bike_id": row[0],
+        "customer_name": row[1],
+        "hours": row[2],
+        "total_cost": row[3],
+    }
+
+
+def fetch_bike_row(conn, bike_id):
+    return conn.execute(
+        f"SELECT {BIKE_COLUMNS} FROM Bikes WHERE id = ?", (bike_id,)
+    ).fetchone()
+
+
+def fetch_rental_row(conn, bike_id):
+    return conn.execute(
+        f"SELECT {RENTAL_COLUMNS} FROM Rentals WHERE bike_id = ?", (bike_id,)
+    ).fetchone()
+
+
+class Bike:
+    # A bike read out of a FleetStore. Supports bike["name"] like the dicts
+    # from bike_from_row, so either can be passed to the same code.
+    __slots__ = ("id", "name", "type", "price_per_hour", "available")
+
+    def __init__(self, bike_id, name, bike_type, price_per_hour, available):
+        self.id = bike_id
+        self.name = name
+        self.type = bike_type
+        self.price_per_hour = price_per_hour
+        self.available = available
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+class Rental:
+    __slots__ = ("bike_id", "customer_name", "hours", "total_cost")
+
+    def __init__(self, bike_id, customer_name, hours, total_cost):
+        self.bike_id = bike_id
+        self.customer_name = customer_name
+        self.hours = hours
+        self.total_cost = total_cost
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+NO_NAME = 0xFFFFFFFF  # name length of a NULL name
+
+
+def to_double(value):
+    return float("nan") if value is None else float(value)
+
+
+def from_double(value, integral):
+    # Inverse of to_double; integral columns come back as ints
+    if isnan(value):
+        return None
+    return int(value) if integral and value.is_integer() else value
+
+
+class TextColumn:
+    # Strings stored back to back in one UTF-8 bytearray, with a start and
+    # length per row. Rewritten or deleted strings leave their bytes behind
+    # until compact() is called.
+
+    def __init__(self):
+        self.data = bytearray()
+        self.starts = array("I")
+        self.lengths = array("I")
+        self.dead = 0  # bytes no longer referenced
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _store(self, text):
+        if text is None:
+            return 0, NO_NAME
+        encoded = text.encode()
+        start = len(self.data)
+        self.data += encoded
+        return start, len(encoded)
+
+    def _forget(self, row):
+        length = self.lengths[row]
+        self.dead += 0 if length == NO_NAME else length
+
+    def get(self, row):
+        length = self.lengths[row]
+        if length == NO_NAME:
+            return None
+        start = self.starts[row]
+        return self.data[start : start + length].decode()
+
+    def append(self, text):
+        start, length = self._store(text)
+        self.starts.append(start)
+        self.lengths.append(length)
+
+    def insert(self, row, text):
+        start, length = self._store(text)
+        self.starts.insert(row, start)
+        self.lengths.insert(row, length)
+
+    def set(self, row, text):
+        self._forget(row)
+        self.starts[row], self.lengths[row] = self._store(text)
+        self._maybe_compact()
+
+    def delete(self, row):
+        self._forget(row)
+        del self.starts[row]
+        del self.lengths[row]
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self.dead > 4096 and self.dead > len(self.data) // 2:
+            texts = [self.get(row) for row in range(len(self))]
+            self.__init__()
+            for text in texts:
+                self.append(text)
+
+
+class Interner:
+    # Each distinct string (a bike type) is stored once and referred to by a
+    # small integer code
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def get_bit(bits, position):
+    return bits[position >> 3] >> (position & 7) & 1
+
+
+def set_bit(bits, position, value):
+    if value:
+        bits[position >> 3] |= 1 << (position & 7)
+    else:
+        bits[position >> 3] &= ~(1 << (position & 7)) & 0xFF
+
+
+def insert_bit(bits, position, value, size):
+    # bits with value inserted at position and the bits after it moved up
+    # one; size is the number of bits afterwards. Done on one big int, so it
+    # costs a few C-level passes over the bitmap rather than a loop.
+    number = int.from_bytes(bits, "little")
+    low = number & ((1 << position) - 1)
+    number = low | (number >> position << (position + 1)) | (bool(value) << position)
+    return bytearray(number.to_bytes((size + 7) // 8, "little"))
+
+
+# Folds that gather eight flag bytes into one byte, see pack_bits
+PACK_STEPS = ((7, b"\x03\x00"), (14, b"\x0f\x00\x00\x00"), (28, b"\xff" + bytes(7)))
+
+# Bitmap byte -> its eight bits as one byte each
+UNPACKED = [bytes(byte >> bit & 1 for bit in range(8)) for byte in range(256)]
+
+
+def pack_bits(flags):
+    # One byte per flag (0 or 1) -> bitmap, least significant bit first.
+    # The flags are read as one big int and folded together (2, then 4,
+    # then 8 flags per byte), so this never loops over positions in Python.
+    flags = bytes(flags)
+    size = (len(flags) + 7) // 8
+    number = int.from_bytes(flags + bytes(size * 8 - len(flags)), "little")
+    for shift, pattern in PACK_STEPS:
+        mask = int.from_bytes(pattern * (size * 8 // len(pattern)), "little")
+        number = (number | number >> shift) & mask
+    return bytearray(number.to_bytes(size * 8, "little")[::8])
+
+
+def unpack_bits(bits):
+    # Bitmap -> one byte (0 or 1) per position, for itertools.compress
+    return b"".join(map(UNPACKED.__getitem__, bits))
+
+
+class FleetStore:
+    # In-memory copy of the Bikes and Rentals tables, stored by column in
+    # typed arrays rather than as a dict per row, so a million bikes take
+    # tens of megabytes instead of hundreds:
+    #
+    #     ids             array of bike ids, ascending; a bike's index in it
+    #                     is its position in every other column
+    #     names           TextColumn (one UTF-8 blob)
+    #     type codes      interned bike types, 2 bytes per bike
+    #     prices          array of doubles (NaN for NULL)
+    #     live/available  bitmaps, one bit per position
+    #     type bitmaps    one per type, set for the live bikes of that type
+    #
+    # Deleted bikes only clear their live bit. A new bike is appended when it
+    # has the highest id and otherwise inserted at its position (depots hand
+    # out ids in blocks, so adds at any depot but the last land in the
+    # middle). Open rentals are parallel columns sorted by bike id.
+    # Counts and bitmaps per type are kept up to date with every write, so
+    # the counting methods never scan and the id queries (available_ids,
+    # ids_of_type) only AND bitmaps and compress the id column in C.
+    # get_bike, iter_bikes and iter_rentals build Bike and Rental records on
+    # demand. Writes only touch the rows that changed.
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._ids = array("q")
+        self._names = TextColumn()
+        self._type_codes = array("H")
+        self._prices = array("d")
+        self._live = bytearray()
+        self._available = bytearray()
+        self._types = Interner()
+        self._type_count = array("q")
+        self._type_available = array("q")
+        self._type_bits = []
+        self._count = 0
+        self._available_count = 0
+        self._clear_rentals()
+        self.loaded = False
+
+    def _clear_rentals(self):
+        self._rental_ids = array("q")
+        self._rental_customers = TextColumn()
+        self._rental_hours = array("d")
+        self._rental_costs = array("d")
+
+    def load(self, conn):
+        self.load_rows(
+            conn.execute(f"SELECT {BIKE_COLUMNS} FROM Bikes ORDER BY id"),
+            conn.execute(f"SELECT {RENTAL_COLUMNS} FROM Rentals ORDER BY bike_id"),
+        )
+
+    def load_rows(self, bike_rows, rental_rows):
+        # Bike rows in id order and rental rows in bike id order, from one
+        # database or from several one after the other (see depots)
+        self.clear()
+        # Bulk path: append straight to the columns and set the bits once
+        ids, prices, type_codes = self._ids, self._prices, self._type_codes
+        names, codes = self._names, self._types.codes
+        available = bytearray()
+        for row in bike_rows:
+            ids.append(row[0])
+            names.append(row[1])
+            code = codes.get(row[2])
+            if code is None:
+                code = self._type_code(row[2])
+            type_codes.append(code)
+            prices.append(to_double(row[3]))
+            is_available = 1 if int(row[4]) else 0
+            available.append(is_available)
+            self._type_count[code] += 1
+            self._type_available[code] += is_available
+        self._live = pack_bits(bytes([1]) * len(ids))
+        self._available = pack_bits(available)
+        self._type_bits = [
+            pack_bits(bytes(map(code.__eq__, type_codes)))
+            for code in range(len(self._types.values))
+        ]
+        self._count = len(ids)
+        self._available_count = sum(self._type_available)
+
+        rental_ids = self._rental_ids
+        customers = self._rental_customers
+        hours, costs = self._rental_hours, self._rental_costs
+        for bike_id, customer_name, rental_hours, total_cost in rental_rows:
+            if rental_ids and rental_ids[-1] == bike_id:
+                # A legacy duplicate; like the old dict, the last one wins
+                last = len(rental_ids) - 1
+                self._set_rental(last, customer_name, rental_hours, total_cost)
+                continue
+            rental_ids.append(bike_id)
+            customers.append(customer_name)
+            hours.append(to_double(rental_hours))
+            costs.append(to_double(total_cost))
+        self.loaded = True
+
+    # Positions and bits
+
+    def _position(self, bike_id):
+        # Position of a live bike, or None
+        position = bisect_left(self._ids, bike_id)
+        if (
+            position < len(self._ids)
+            and self._ids[position] == bike_id
+            and get_bit(self._live, position)
+        ):
+            return position
+        return None
+
+    def _type_code(self, bike_type):
+        code = self._types.code(bike_type)
+        if code == len(self._type_count):
+            self._type_count.append(0)
+            self._type_available.append(0)
+            self._type_bits.append(bytearray(len(self._live)))
+        return code
+
+    def _count_bike(self, position, sign):
+        code = self._type_codes[position]
+        self._count += sign
+        self._type_count[code] += sign
+        set_bit(self._type_bits[code], position, sign > 0)
+        if get_bit(self._available, position):
+            self._available_count += sign
+            self._type_available[code] += sign
+
+    def _append_bike(self, bike_id, name, bike_type, price, available):
+        position = len(self._ids)
+        if position % 8 == 0:
+            self._live.append(0)
+            self._available.append(0)
+            for bits in self._type_bits:
+                bits.append(0)
+        self._ids.append(bike_id)
+        self._names.append(name)
+        self._type_codes.append(self._type_code(bike_type))
+        self._prices.append(to_double(price))
+        set_bit(self._live, position, True)
+        set_bit(self._available, position, available)
+        self._count_bike(position, +1)
+
+    def _insert_bike(self, position, bike_id, name, bike_type, price, available):
+        # Shift the bikes from position on up by one: memmoves for the arrays
+        # and a big-int shift per bitmap, not a rebuild of every column
+        size = len(self._ids) + 1
+        self._ids.insert(position, bike_id)
+        self._names.insert(position, name)
+        self._type_codes.insert(position, self._type_code(bike_type))
+        self._prices.insert(position, to_double(price))
+        self._live = insert_bit(self._live, position, True, size)
+        self._available = insert_bit(self._available, position, available, size)
+        self._type_bits = [
+            insert_bit(bits, position, False, size) for bits in self._type_bits
+        ]
+        self._count_bike(position, +1)
+
+    def _set_bike(self, position, bike):
+        if bike["name"] != self._names.get(position):
+            self._names.set(position, bike["name"])
+        self._type_codes[position] = self._type_code(bike["type"])
+        self._prices[position] = to_double(bike["price_per_hour"])
+        set_bit(self._available, position, bike["available"])
+
+    def _compact(self):
+        # Rebuild the bike columns in id order without deleted bikes
+        bikes = sorted(self.iter_bikes(), key=lambda bike: bike.id)
+        rentals = (
+            self._rental_ids,
+            self._rental_customers,
+            self._rental_hours,
+            self._rental_costs,
+        )
+        self.clear()
+        (
+            self._rental_ids,
+            self._rental_customers,
+            self._rental_hours,
+            self._rental_costs,
+        ) = rentals
+        for bike in bikes:
+            self._append_bike(
+                bike.id, bike.name, bike.type, bike.price_per_hour, bike.available
+            )
+        self.loaded = True
+
+    # Bikes
+
+    def _bike_at(self, position):
+        return Bike(
+            self._ids[position],
+            self._names.get(position),
+            self._types.values[self._type_codes[position]],
+            from_double(self._prices[position], integral=True),
+            bool(get_bit(self._available, position)),
+        )
+
+    def get_bike(self, bike_id):
+        position = self._position(bike_id)
+        return None if position is None else self._bike_at(position)
+
+    def iter_bikes(self):
+        for position in range(len(self._ids)):
+            if get_bit(self._live, position):
+                yield self._bike_at(position)
+
+    def put_bike(self, bike):
+        # bike is a dict from bike_from_row or a Bike
+        bike_id = bike["id"]
+        position = self._position(bike_id)
+        if position is not None:
+            self._count_bike(position, -1)
+            self._set_bike(position, bike)
+            self._count_bike(position, +1)
+            return
+
+        position = bisect_left(self._ids, bike_id)
+        if position < len(self._ids) and self._ids[position] == bike_id:
+            # A deleted bike's slot: bring it back
+            set_bit(self._live, position, True)
+            self._set_bike(position, bike)
+            self._count_bike(position, +1)
+            return
+        fields = (
+            bike_id,
+            bike["name"],
+            bike["type"],
+            bike["price_per_hour"],
+            bike["available"],
+        )
+        if position == len(self._ids):
+            self._append_bike(*fields)
+        else:
+            self._insert_bike(position, *fields)
+
+    def remove_bike(self, bike_id):
+        self.remove_rental(bike_id)
+        position = self._position(bike_id)
+        if position is None:
+            return None
+        bike = self._bike_at(position)
+        self._count_bike(position, -1)
+        set_bit(self._live, position, False)
+        self._names.set(position, None)
+        if len(self._ids) > 64 and self._count < len(self._ids) // 2:
+            self._compact()
+        return bike
+
+    def refresh_bike(self, conn, bike_id):
+        # Re-read a single bike by primary key and apply it to the store
+        return self.apply_bike_row(bike_id, fetch_bike_row(conn, bike_id))
+
+    def apply_bike_row(self, bike_id, row):
+        # row is None when the bike no longer exists
+        if row is None:
+            self.remove_bike(bike_id)
+            return None
+        bike = bike_from_row(row)
+        self.put_bike(bike)
+        return bike
+
+    # Rentals
+
+    def _rental_position(self, bike_id):
+        position = bisect_left(self._rental_ids, bike_id)
+        if position < len(self._rental_ids) and self._rental_ids[position] == bike_id:
+            return position
+        return None
+
+    def _set_rental(self, position, customer_name, hours, total_cost):
+        self._rental_customers.set(position, customer_name)
+        self._rental_hours[position] = to_double(hours)
+        self._rental_costs[position] = to_double(total_cost)
+
+    def _rental_at(self, position):
+        return Rental(
+            self._rental_ids[position],
+            self._rental_customers.get(position),
+            from_double(self._rental_hours[position], integral=True),
+            from_double(self._rental_costs[position], integral=False),
+        )
+
+    def get_rental(self, bike_id):
+        position = self._rental_position(bike_id)
+        return None if position is None else self._rental_at(position)
+
+    def iter_rentals(self):
+        # Open rentals in bike id order. The rental list redraws from this,
+        # so _rental_at is inlined here.
+        customers = self._rental_customers
+        data, starts, lengths = customers.data, customers.starts, customers.lengths
+        hours, costs = self._rental_hours, self._rental_costs
+        for position, bike_id in enumerate(self._rental_ids):
+            length = lengths[position]
+            start = starts[position]
+            rental_hours = hours[position]
+            total_cost = costs[position]
+            yield Rental(
+                bike_id,
+                None if length == NO_NAME else data[start : start + length].decode(),
+                int(rental_hours) if rental_hours.is_integer() else from_double(
+                    rental_hours, integral=True
+                ),
+                total_cost if total_cost == total_cost else None,  # NaN is NULL
+            )
+
+    def rental_count(self):
+        return len(self._rental_ids)
+
+    def put_rental(self, rental):
+        bike_id = rental["bike_id"]
+        position = self._rental_position(bike_id)
+        if position is not None:
+            self._set_rental(
+                position, rental["customer_name"], rental["hours"], rental["total_cost"]
+            )
+            return
+        # A bike has at most one open rental; inserting keeps the id order
+        position = bisect_left(self._rental_ids, bike_id)
+        self._rental_ids.insert(position, bike_id)
+        self._rental_customers.insert(position, rental["customer_name"])
+        self._rental_hours.insert(position, to_double(rental["hours"]))
+        self._rental_costs.insert(position, to_double(rental["total_cost"]))
+
+    def remove_rental(self, bike_id):
+        position = self._rental_position(bike_id)
+        if position is None:
+            return None
+        rental = self._rental_at(position)
+        del self._rental_ids[position]
+        self._rental_customers.delete(position)
+        del self._rental_hours[position]
+        del self._rental_costs[position]
+        return rental
+
+    def refresh_rental(self, conn, bike_id):
+        return self.apply_rental_row(bike_id, fetch_rental_row(conn, bike_id))
+
+    def apply_rental_row(self, bike_id, row):
+        if row is None:
+            self.remove_rental(bike_id)
+            return None
+        rental = rental_from_row(row)
+        self.put_rental(rental)
+        return rental
+
+    # Indexed lookups and counts
+
+    def is_available(self, bike_id):
+        position = self._position(bike_id)
+        return position is not None and bool(get_bit(self._available, position))
+
+    def count(self):
+        return self._count
+
+    def available_count(self, bike_type=None):
+        if bike_type is None:
+            return self._available_count
+        code = self._types.codes.get(bike_type)
+        return 0 if code is None else self._type_available[code]
+
+    def type_count(self, bike_type):
+        code = self._types.codes.get(bike_type)
+        return 0 if code is None else self._type_count[code]
+
+    def types(self):
+        # Bike types with at least one bike
+        return [
+            bike_type
+            for code, bike_type in enumerate(self._types.values)
+            if self._type_count[code]
+        ]
+
+    def available_ids(self):
+        return self._ids_where(None, available_only=True)
+
+    def ids_of_type(self, bike_type, available_only=False):
+        code = self._types.codes.get(bike_type)
+        return [] if code is None else self._ids_where(code, available_only)
+
+    def _ids_where(self, code, available_only):
+        bits = self._live if code is None else self._type_bits[code]
+        if available_only:
+            both = int.from_bytes(bits, "little") & int.from_bytes(
+                self._available, "little"
+            )
+            bits = both.to_bytes(len(bits), "little")
+        return list(compress(self._ids, unpack_bits(bits)))
+
+    def price_columns(self):
+        # (ids, type codes, type names, prices) as the store holds them, for
+        # pricing every bike at once (see pricing.fleet_rates). type_codes
+        # index type names; a NULL price is NaN. Deleted bikes are compacted
+        # away first, so every position is a live bike. Do not modify.
+        if self._count < len(self._ids):
+            self._compact()
+        return self._ids, self._type_codes, self._types.values, self._prices
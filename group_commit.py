@@ -0,0 +1,312 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from auth import hash_password
+from db import connect
+import instrumentation
+from migrations import migrate
+import rental_service
+from rental_tx import immediate
+
+# Group commit for busy counters. Write operations (the named operations of
+# rental_service.WRITE_OPERATIONS) are queued from any number of threads; a
+# single writer thread takes what is queued, waiting up to max_delay after
+# the first operation for up to max_batch of them, and runs them in one
+# transaction with a savepoint each. A burst of rentals then costs one
+# commit instead of one per click or request.
+#
+# With a journal, the operations that went through are also appended to a
+# local file (one JSON line each, one fsync per group) before anyone is told
+# they succeeded. The database can then commit without waiting for the
+# disk (synchronous=NORMAL): if a crash loses its last commits, the journal
+# still has them and they are replayed the next time the journal is opened.
+# JournalState records, in the same transaction as the operations, the last
+# journal entry the database holds, so nothing is applied twice. A replayed
+# operation runs again as of the replay (a rental starts then). Once the
+# journal grows past journal_limit the database is checkpointed to disk and
+# the journal starts over.
+#
+# max_delay trades latency for throughput: 0 only groups operations that
+# queued up while the previous group was committing. A journal belongs to
+# one process at a time; give each process its own journal name.
+
+BATCH_MAX = 64  # operations committed together at most
+BATCH_WINDOW = 0.002  # seconds to wait for more operations once one arrives
+JOURNAL_LIMIT = 4 * 1024 * 1024  # bytes
+
+log = logging.getLogger("bike_rent.group_commit")
+
+
+def journal_path(db_path, name):
+    return f"{db_path}.{name}.writes"
+
+
+def applied_seq(conn, name):
+    row = conn.execute(
+        "SELECT applied FROM JournalState WHERE journal = ?", (name,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def set_applied(db, name, seq):
+    db.execute(
+        """INSERT INTO JournalState (journal, applied) VALUES (?, ?)
+           ON CONFLICT (journal) DO UPDATE SET applied = excluded.applied""",
+        (name, seq),
+    )
+
+
+def prepare(name, params):
+    # A sign-up with a password becomes sign_up_hashed with the password's
+    # hash, so the slow KDF runs before the operation is queued, never on the
+    # writer thread, and the journal never holds the password
+    if name == "sign_up" and isinstance(params, dict):
+        password = rental_service.as_text(params.get("password"))
+        if password:
+            params = {key: value for key, value in params.items() if key != "password"}
+            return "sign_up_hashed", dict(params, password_hash=hash_password(password))
+    return name, params
+
+
+def replay_record(record):
+    # (op, params) of a journal line. Journals written before sign_up_hashed
+    # existed have sign-ups with a password_hash parameter instead.
+    name, params = record["op"], record["params"]
+    if name == "sign_up" and "password_hash" in params:
+        params = {key: value for key, value in params.items() if key != "password"}
+        return "sign_up_hashed", params
+    return name, params
+
+
+class Journal:
+    # Append-only file of operations, one JSON object per line:
+    # {"seq": 12, "op": "rent", "params": {...}}. A line cut short by a crash
+    # is dropped when the file is read.
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a+b")
+
+    def read(self):
+        self._file.seek(0)
+        records, good = [], 0
+        for line in self._file:
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("torn line")
+                records.append(json.loads(line))
+            except ValueError:
+                break
+            good += len(line)
+        if good < self.size():
+            self._file.truncate(good)
+            self._sync()
+        return records
+
+    def append(self, lines):
+        self._file.write(b"".join(lines))
+        self._sync()
+
+    def size(self):
+        return os.fstat(self._file.fileno()).st_size
+
+    def clear(self):
+        self._file.truncate(0)
+        self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class GroupCommitter:
+    # Commits operations for one database file; see the comment at the top.
+    # journal is a name (see journal_path) or None for group commit without
+    # a journal. operations defaults to rental_service.WRITE_OPERATIONS and
+    # INTERNAL_OPERATIONS.
+
+    def __init__(
+        self,
+        path,
+        journal=None,
+        profile=None,
+        max_batch=BATCH_MAX,
+        max_delay=BATCH_WINDOW,
+        operations=None,
+        journal_limit=JOURNAL_LIMIT,
+    ):
+        self.path = path
+        self.name = journal
+        self.profile = profile
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.operations = operations or dict(
+            rental_service.WRITE_OPERATIONS, **rental_service.INTERNAL_OPERATIONS
+        )
+        self.journal_limit = journal_limit
+        self.journal = None
+        self.replayed = 0  # operations replayed from the journal on startup
+        self.refused = []  # (record, RentalError) the replay could not apply
+        self.stats = {"groups": 0, "operations": 0}
+        self._seq = 0
+        self._next_checkpoint = journal_limit
+        self._queue = queue.SimpleQueue()
+        ready = Future()
+        self._thread = threading.Thread(
+            target=self._run, args=(ready,), name="group-commit", daemon=True
+        )
+        self._thread.start()
+        ready.result()  # raises if the database or journal could not be opened
+
+    def submit(self, name, params):
+        # Queue an operation; returns a Future of its result (a refusal is
+        # set as its RentalError). A sign-up is hashed here (see prepare), on
+        # the caller's thread; an event loop should run prepare on a thread
+        # pool first, as api_server does.
+        name, params = prepare(name, params)
+        encoded = None
+        if self.name is not None:
+            # Fails here, for this caller only, if params are not JSON
+            encoded = json.dumps(params, separators=(",", ":"))
+        future = Future()
+        self._queue.put((name, params, encoded, future))
+        return future
+
+    def call(self, name, params):
+        return self.submit(name, params).result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    # Writer thread
+
+    def _run(self, ready):
+        try:
+            self.conn = connect(self.path, self.profile)
+            migrate(self.conn)
+            if self.name is not None:
+                self.journal = Journal(journal_path(self.path, self.name))
+                self._replay()
+        except BaseException as e:
+            ready.set_exception(e)
+            return
+        ready.set_result(None)
+
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        item = self._queue.get(timeout=timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+        if self.journal is not None:
+            self._checkpoint()
+            self.journal.close()
+        self.conn.close()
+
+    def _commit(self, batch):
+        def work(db):
+            results = [
+                rental_service.run_operation(db, name, params, self.operations)
+                for name, params, _, _ in batch
+            ]
+            lines = []
+            if self.journal is not None:
+                for (name, _, encoded, _), (ok, _) in zip(batch, results):
+                    if ok:
+                        seq = self._seq + len(lines) + 1
+                        lines.append(
+                            f'{{"seq":{seq},"op":{json.dumps(name)},'
+                            f'"params":{encoded}}}\n'.encode()
+                        )
+                if lines:
+                    set_applied(db, self.name, self._seq + len(lines))
+            return results, lines
+
+        try:
+            with instrumentation.span("group commit"):
+                results, lines = immediate(self.conn, work)
+                # The numbers are taken even if the journal write fails
+                self._seq += len(lines)
+                if lines:
+                    self.journal.append(lines)
+        except Exception as e:
+            for *_, future in batch:
+                future.set_exception(e)
+            return
+
+        self.stats["groups"] += 1
+        self.stats["operations"] += len(batch)
+        for (*_, future), (ok, result) in zip(batch, results):
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+        if self.journal is not None and self.journal.size() > self._next_checkpoint:
+            self._checkpoint()
+
+    def _replay(self):
+        records = self.journal.read()
+        applied = applied_seq(self.conn, self.name)
+        self._seq = max([applied] + [record["seq"] for record in records[-1:]])
+        pending = [record for record in records if record["seq"] > applied]
+        if pending:
+
+            def work(db):
+                outcomes = [
+                    rental_service.run_operation(
+                        db, *replay_record(record), self.operations
+                    )
+                    for record in pending
+                ]
+                set_applied(db, self.name, pending[-1]["seq"])
+                return outcomes
+
+            outcomes = immediate(self.conn, work)
+            self.replayed = len(pending)
+            self.refused = [
+                (record, result)
+                for record, (ok, result) in zip(pending, outcomes)
+                if not ok
+            ]
+            log.warning(
+                "Replayed %d operations from %s", len(pending), self.journal.path
+            )
+            for record, error in self.refused:
+                log.warning("Could not replay %s: %s", record, error)
+        self._checkpoint()
+
+    def _checkpoint(self):
+        # Once the database file holds every commit, the journal can start
+        # over. Readers in other processes can keep the checkpoint from
+        # finishing; then it is tried again after journal_limit more bytes.
+        busy = self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]
+        if busy:
+            self._next_checkpoint = self.journal.size() + self.journal_limit
+        else:
+            self.journal.clear()
+            self._next_checkpoint = self.journal_limit
@@ -0,0 +1,399 @@
+import functools
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Timing spans, counters and latency histograms for the hot paths: the
+# desktop handlers, the Treeview refreshes, the API routes and every SQL
+# statement. Off unless enable() is called (or BIKE_RENT_METRICS=1 is set),
+# and then:
+#
+#     span(name) / timed(name)   time a block or function
+#     db.connect                 opens TracedConnections, which
+#                                time each statement, and counts what SQLite
+#                                runs through the sqlite3 trace callback
+#     slow statements            logged to the "bike_rent.slow_sql" logger
+#     snapshot() / prometheus()  the numbers as JSON or Prometheus text, from
+#                                write_file() or serve()
+#
+# When disabled, span() hands back one shared do-nothing context manager,
+# timed functions cost one flag check, and connections are plain
+# sqlite3.Connection objects with no callback at all.
+
+# Histogram bucket upper bounds in seconds: 0.1ms, 0.25ms, 0.5ms ... 5s
+BUCKETS = tuple(round(m * 10.0**e, 6) for e in range(-4, 1) for m in (1, 2.5, 5))
+SLOW_MS = float(os.environ.get("BIKE_RENT_SLOW_MS", "50"))
+MAX_NAMES = 500  # distinct spans or SQL labels kept; the rest count as "other"
+
+slow_log = logging.getLogger("bike_rent.slow_sql")
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], self.counts)),
+        }
+
+
+class Shard:
+    # One thread's numbers. Only that thread writes to it, so recording
+    # takes no lock; snapshot() adds the shards of all threads up.
+
+    def __init__(self):
+        self.spans = {}
+        self.statements = {}
+        self.statement_kinds = {}
+        self.counters = {}
+
+
+def histogram_for(table, name):
+    # Names come from code and SQL, but API routes come from clients, so the
+    # number kept is capped
+    histogram = table.get(name)
+    if histogram is None:
+        if len(table) >= MAX_NAMES:
+            name = "other"
+            histogram = table.get(name)
+        if histogram is None:
+            histogram = table[name] = Histogram()
+    return histogram
+
+
+def merge_histograms(tables):
+    merged = {}
+    for table in tables:
+        for name, histogram in list(table.items()):
+            merged.setdefault(name, Histogram()).merge(histogram)
+    return {name: merged[name].as_dict() for name in sorted(merged)}
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.slow_seconds = SLOW_MS / 1000
+        self.started = time.time()
+        self._lock = threading.Lock()  # guards the list of shards
+        self._shards = []
+        self._local = threading.local()
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = Shard()
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def reset(self):
+        with self._lock:
+            self._shards = []
+            self._local = threading.local()
+            self.started = time.time()
+
+    def observe_span(self, name, seconds):
+        histogram_for(self.shard().spans, name).observe(seconds)
+
+    def observe_statement(self, label, seconds):
+        histogram_for(self.shard().statements, label).observe(seconds)
+        if seconds >= self.slow_seconds:
+            slow_log.warning("slow SQL (%.1fms): %s", seconds * 1e3, label)
+
+    def count_statement(self, kind):
+        kinds = self.shard().statement_kinds
+        kinds[kind] = kinds.get(kind, 0) + 1
+
+    def count(self, name, amount=1):
+        counters = self.shard().counters
+        counters[name] = counters.get(name, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            shards = list(self._shards)
+        counters = {}
+        for shard in shards:
+            for name, value in list(shard.counters.items()):
+                counters[name] = counters.get(name, 0) + value
+            for kind, value in list(shard.statement_kinds.items()):
+                name = f"sqlite_statements:{kind}"
+                counters[name] = counters.get(name, 0) + value
+        return {
+            "started": self.started,
+            "uptime": time.time() - self.started,
+            "counters": dict(sorted(counters.items())),
+            "spans": merge_histograms(shard.spans for shard in shards),
+            "sql": merge_histograms(shard.statements for shard in shards),
+        }
+
+
+metrics = Metrics()
+
+
+def enabled():
+    return metrics.enabled
+
+
+def enable(slow_ms=None):
+    if slow_ms is not None:
+        metrics.slow_seconds = slow_ms / 1000
+    if not slow_log.handlers and not logging.getLogger().handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow_log.addHandler(handler)
+    metrics.enabled = True
+
+
+def disable():
+    metrics.enabled = False
+
+
+# Spans
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        metrics.observe_span(self.name, time.perf_counter() - self.start)
+        if exc[0] is not None:
+            metrics.count(f"{self.name}:errors")
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+def span(name):
+    return _Span(name) if metrics.enabled else NO_SPAN
+
+
+def timed(name=None):
+    # Decorator: time every call of the function as the span `name`
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            with _Span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+# SQL
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_label(sql):
+    # One label per statement shape: whitespace collapsed and IN lists of
+    # any length folded together, so labels do not grow with the data
+    label = " ".join(sql.split())
+    label = re.sub(r"\?(\s*,\s*\?)+", "?, ...", label)
+    return label if len(label) <= 120 else label[:117] + "..."
+
+
+def trace_statement(sql):
+    # sqlite3 trace callback: runs as SQLite starts each statement, including
+    # the BEGIN/COMMIT the sqlite3 module issues itself and trigger programs.
+    # Only the statement kind is kept; the text carries parameter values.
+    words = sql.split(None, 1)
+    metrics.count_statement(words[0] if words else "?")
+
+
+class TracedConnection(sqlite3.Connection):
+    # db.connect uses this class when metrics are enabled. Statements are
+    # timed until execute returns, which includes the first step of a query.
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe_statement(statement_label(sql), time.perf_counter() - start)
+
+    def executemany(self, sql, parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            metrics.observe_statement(statement_label(sql), time.perf_counter() - start)
+
+    def executescript(self, script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            metrics.observe_statement("script", time.perf_counter() - start)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            metrics.observe_statement("COMMIT", time.perf_counter() - start)
+
+    def rollback(self):
+        start = time.perf_counter()
+        try:
+            return super().rollback()
+        finally:
+            metrics.observe_statement("ROLLBACK", time.perf_counter() - start)
+
+
+def connect_options():
+    # Extra sqlite3.connect arguments for db.connect
+    return {"factory": TracedConnection} if metrics.enabled else {}
+
+
+def attach(conn):
+    if metrics.enabled:
+        conn.set_trace_callback(trace_statement)
+
+
+# Export
+
+
+def prometheus_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def prometheus(snapshot=None):
+    # Prometheus text exposition format
+    snapshot = snapshot or metrics.snapshot()
+    lines = [
+        "# TYPE bike_rent_uptime_seconds gauge",
+        f"bike_rent_uptime_seconds {snapshot['uptime']:.3f}",
+    ]
+    if snapshot["counters"]:
+        lines.append("# TYPE bike_rent_events_total counter")
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append(f'bike_rent_events_total{{event="{escape_label(name)}"}} {value}')
+
+    for metric, label, histograms in (
+        ("bike_rent_span_seconds", "span", snapshot["spans"]),
+        ("bike_rent_sql_seconds", "statement", snapshot["sql"]),
+    ):
+        lines.append(f"# TYPE {metric} histogram")
+        for name, histogram in histograms.items():
+            tag = f'{label}="{escape_label(name)}"'
+            cumulative = 0
+            for bound, count in histogram["buckets"].items():
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{tag},le="{bound}"}} {cumulative}')
+            lines.append(f"{metric}_sum{{{tag}}} {histogram['sum']:.6f}")
+            lines.append(f"{metric}_count{{{tag}}} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_file(path):
+    # JSON, or Prometheus text when the file name ends in .prom or .txt (for
+    # node_exporter's textfile collector). Replaced atomically.
+    if path.endswith((".prom", ".txt")):
+        text = prometheus()
+    else:
+        text = json.dumps(metrics.snapshot(), indent=2)
+    temp = f"{path}.tmp"
+    with open(temp, "w") as f:
+        f.write(text)
+    os.replace(temp, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    # GET /metrics (Prometheus text) and GET /metrics.json
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/metrics.json":
+            body, content_type = json.dumps(metrics.snapshot()), "application/json"
+        elif self.path.split("?")[0] == "/metrics":
+            body, content_type = prometheus(), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    # Serve the metrics on a daemon thread; returns the server
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(
+        target=server.serve_forever, name="metrics-http", daemon=True
+    ).start()
+    return server
+
+
+if os.environ.get("BIKE_RENT_METRICS") == "1":
+    enable()
@@ -0,0 +1,670 @@
+"""Offline-capable kiosks: a local replica of the primary store, and an outbox
+of the rentals and returns made there.
+
+    python kiosk.py init --replica kiosk-north.db --name north-1 \\
+        --primary http://depot-server:8080 --user clerk --password secret
+    python kiosk.py sync --replica kiosk-north.db --user clerk --password secret
+    python kiosk.py status --replica kiosk-north.db
+
+    python bike-rent.py --kiosk kiosk-north.db
+
+A kiosk keeps its own SQLite copy of the bikes and open rentals of the
+primary store (the database behind api_server.py). Rent and return run on
+the replica, so they still work when the network is down, and in the same
+transaction they append the operation to the replica's Outbox. While the
+primary can be reached, a background thread syncs every SYNC_INTERVAL
+seconds, and sooner after each rental:
+
+    push  pending outbox operations go to POST /sync, OUTBOX_BATCH at a
+          time. The primary applies a batch in one transaction and records
+          the last outbox seq it applied for the replica (in JournalState, as
+          group_commit does for its journals), so a batch sent again after
+          a lost answer is not applied twice. Replicas are told apart by a
+          random id made at init, so one set up again under an old name
+          (a new disk, say) has its outbox applied from the start. An id
+          belongs to the account that first synced it.
+    pull  GET /changes returns the primary's change log (see change_feed)
+          after the last entry the replica has seen, with the current rows
+          of the changed bikes. They overwrite the replica's copy, except
+          for bikes that still have operations in the outbox. A kiosk that
+          was away for longer than the log reaches back copies every bike
+          again.
+
+The primary settles conflicts, first come, first served. Operations are
+applied in the order they reach it, each as of that moment. A rental starts
+and is priced when it arrives; the cost shown at the kiosk is an estimate.
+Some operations are refused and stay in the outbox as conflicts, with the
+reason:
+
+    - A rental of a bike that was rented elsewhere in the meantime, e.g. at
+      another kiosk on the other side of a network partition.
+    - A return of a bike whose open rental on the primary is not the one the
+      kiosk knew. This covers returning a rental that was itself refused.
+
+A return of a bike the primary already took back counts as done. The
+primary also notes every refused bike in its change log, so the next pull
+corrects the replica. `status` lists the conflicts for staff to sort out
+with the customers.
+
+Logins at a kiosk are checked against the replica's users; init adds the
+account it was run with. Whoever logs in at the kiosk is also the account
+used to sync.
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import secrets
+import threading
+import time
+from urllib.parse import urlsplit
+
+import change_feed
+from db import connect
+from fleet_store import bike_from_row, rental_from_row
+from group_commit import applied_seq, set_applied
+from migrations import migrate
+import rental_service
+from rental_tx import RentalError, immediate
+
+SYNC_INTERVAL = 2.0  # seconds between syncs while the primary answers
+MAX_BACKOFF = 60.0  # longest wait between attempts while it does not
+OUTBOX_BATCH = 200  # operations per POST /sync
+PAGE_SIZE = 1000  # bikes per GET /bikes when copying the whole fleet
+TIMEOUT = 5.0  # seconds before a request to the primary counts as lost
+KIOSK_OPERATIONS = ("rent", "return")
+
+log = logging.getLogger("bike_rent.kiosk")
+
+
+class Offline(Exception):
+    # The primary could not be reached or did not answer in time
+    pass
+
+
+# On the primary (api_server)
+
+
+def journal_name(replica_id):
+    # JournalState key of a replica's outbox
+    return f"kiosk:{replica_id}"
+
+
+def new_replica_id(name):
+    return f"{name}:{secrets.token_hex(8)}"
+
+
+def touch(db, bike_id):
+    # Add a change log entry for a bike the operation did not write, so the
+    # kiosk's next pull brings the primary's rows for it
+    if isinstance(bike_id, int):
+        db.execute("INSERT INTO Changes (bike_id) VALUES (?)", (bike_id,))
+
+
+def apply_kiosk_operation(db, op, params):
+    # One outbox operation; returns (ok, reason it was refused)
+    bike_id = params.get("bike_id")
+    if op == "rent":
+        ok, result = rental_service.run_operation(
+            db,
+            "rent",
+            {key: params.get(key) for key in ("bike_id", "customer_name", "hours")},
+        )
+    elif op == "return":
+        rental = db.execute(
+            "SELECT customer_name FROM Rentals WHERE bike_id = ?", (bike_id,)
+        ).fetchone()
+        if rental is None:
+            # Already returned here (or the bike is gone); nothing to undo
+            touch(db, bike_id)
+            return True, None
+        if rental[0] != params.get("customer_name"):
+            touch(db, bike_id)
+            return False, f"Bike {bike_id} is rented to {rental[0]} on the primary."
+        ok, result = rental_service.run_operation(db, "return", {"bike_id": bike_id})
+    else:
+        return False, f"Kiosks cannot run {op!r} operations."
+    if ok:
+        return True, None
+    touch(db, bike_id)
+    return False, str(result)
+
+
+def check_account(db, kiosk, username, is_admin):
+    # A replica syncs as the account that first synced it (or an admin), so
+    # no other account can send operations under its id. Journal lines
+    # written before accounts were checked have no username.
+    if username is None:
+        return
+    row = db.execute(
+        "SELECT username FROM KioskAccounts WHERE replica_id = ?", (kiosk,)
+    ).fetchone()
+    if row is None:
+        db.execute(
+            "INSERT INTO KioskAccounts (replica_id, username) VALUES (?, ?)",
+            (kiosk, username),
+        )
+    elif row[0] != username and not is_admin:
+        raise RentalError(
+            f"Kiosk {kiosk} syncs as another account.", "Permission Error"
+        )
+
+
+def outbox_entry(operation):
+    # (seq, op, params) of an operation sent to POST /sync
+    try:
+        seq, op, params = operation["seq"], operation["op"], operation["params"]
+    except (KeyError, TypeError):
+        raise RentalError("Each operation needs seq, op and params.", "Input Error")
+    if not isinstance(seq, int) or not isinstance(params, dict):
+        raise RentalError("Each operation needs seq, op and params.", "Input Error")
+    return seq, op, params
+
+
+def apply_outbox(db, kiosk, operations, username=None, is_admin=False, elsewhere=()):
+    # The sync_outbox write operation: apply the outbox operations ({"seq",
+    # "op", "params"}, in seq order) of the replica with id `kiosk`, sent by
+    # the account `username`. Returns {"seq", "ok", "error"} for each.
+    # Operations at or below the last seq applied for the replica were
+    # applied before and are only acknowledged; the others must carry on
+    # from it without a gap, as the replica's outbox does. With depots this
+    # runs in the home depot and checks the whole batch, but leaves the
+    # operations whose seqs are in `elsewhere` to their own depot (see
+    # apply_depot_outbox); they get no result here.
+    kiosk = rental_service.as_text(kiosk)
+    if not kiosk or not isinstance(operations, list):
+        raise RentalError("Expected a kiosk id and its operations.", "Input Error")
+    check_account(db, kiosk, username, is_admin)
+    applied = applied_seq(db, journal_name(kiosk))
+    elsewhere = set(elsewhere)
+    results = []
+    for operation in operations:
+        seq, op, params = outbox_entry(operation)
+        if seq <= applied:
+            if seq not in elsewhere:
+                touch(db, params.get("bike_id"))
+                results.append({"seq": seq, "ok": True, "error": None})
+            continue
+        if seq != applied + 1:
+            raise RentalError(
+                f"Outbox entry {seq} of kiosk {kiosk} skips ahead of {applied}.",
+                "Input Error",
+            )
+        if seq not in elsewhere:
+            ok, error = apply_kiosk_operation(db, op, params)
+            results.append({"seq": seq, "ok": ok, "error": error})
+        applied = seq
+    set_applied(db, journal_name(kiosk), applied)
+    return results
+
+
+def apply_depot_outbox(db, kiosk, operations):
+    # The sync_depot_outbox write operation: the operations of a sync batch
+    # on bikes of a depot other than the home one, once the home depot's
+    # sync_outbox has checked the batch. Each depot keeps the last seq it
+    # applied, so a batch sent again is applied once in every depot.
+    kiosk = rental_service.as_text(kiosk)
+    applied = applied_seq(db, journal_name(kiosk))
+    results = []
+    for operation in operations:
+        seq, op, params = outbox_entry(operation)
+        if seq <= applied:
+            touch(db, params.get("bike_id"))
+            results.append({"seq": seq, "ok": True, "error": None})
+            continue
+        ok, error = apply_kiosk_operation(db, op, params)
+        results.append({"seq": seq, "ok": ok, "error": error})
+        applied = seq
+    set_applied(db, journal_name(kiosk), applied)
+    return results
+
+
+def changes_since(conn, after):
+    # GET /changes?after=N: the change log after N with the current rows of
+    # the changed bikes; "changes" is None if the log no longer goes back
+    # that far
+    after = rental_service.as_count(after, "after must be a change number.")
+    seq, changed = change_feed.read_changes(conn, after)
+    if changed is None:
+        return {"seq": seq, "changes": None}
+    return {
+        "seq": seq,
+        "changes": [
+            {
+                "bike_id": bike_id,
+                "bike": bike_row and bike_from_row(bike_row),
+                "rental": rental_row and rental_from_row(rental_row),
+            }
+            for bike_id, (bike_row, rental_row) in changed.items()
+        ],
+    }
+
+
+# On the kiosk
+
+
+class PrimaryClient:
+    # JSON requests to api_server over one keep-alive connection. Network
+    # trouble raises Offline; answers other than 200 raise RentalError.
+
+    def __init__(self, url, timeout=TIMEOUT):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.credentials = None  # (username, password)
+        self.token = None
+        self._conn = None
+
+    def login(self):
+        if self.credentials is None:
+            raise RentalError("Log in at the kiosk to sync with the primary.")
+        username, password = self.credentials
+        user = self.request(
+            "POST", "/login", {"username": username, "password": password}
+        )
+        self.token = user["token"]
+        return user
+
+    def request(self, method, path, body=None):
+        if self.token is None and path != "/login":
+            self.login()
+        status, payload = self._send(method, path, body)
+        if status == 401 and path != "/login":
+            # The primary restarted and forgot the session
+            self.login()
+            status, payload = self._send(method, path, body)
+        if status != 200:
+            error = payload.get("error") if isinstance(payload, dict) else None
+            raise RentalError(error or f"The primary answered {status}.", "Sync Error")
+        return payload
+
+    def _send(self, method, path, body):
+        headers = {"Content-Type": "application/json"}
+        if self.token is not None:
+            headers["Authorization"] = f"Bearer {self.token}"
+        # A kept-alive connection the primary has since closed (say it was
+        # restarted) fails on first use. Every request is safe to repeat
+        # (outbox entries carry their seq), so that gets one more try on a
+        # new connection.
+        while True:
+            reused = self._conn is not None
+            try:
+                if self._conn is None:
+                    self._conn = http.client.HTTPConnection(
+                        self.host, self.port, timeout=self.timeout
+                    )
+                self._conn.request(
+                    method, path, None if body is None else json.dumps(body), headers
+                )
+                response = self._conn.getresponse()
+                return response.status, json.loads(response.read() or b"null")
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                self.close()
+                if not reused:
+                    raise Offline(f"{self.host}:{self.port}: {e}") from e
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def put_bike(db, bike_id, bike, rental):
+    # Make the replica's rows for a bike those of the primary (None: it has
+    # no such bike, or no open rental for it)
+    db.execute("DELETE FROM Rentals WHERE bike_id = ?", (bike_id,))
+    if bike is None:
+        db.execute("DELETE FROM Bikes WHERE id = ?", (bike_id,))
+        return
+    db.execute(
+        """INSERT INTO Bikes (id, name, type, price_per_hour, available)
+           VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT (id) DO UPDATE SET
+               name = excluded.name, type = excluded.type,
+               price_per_hour = excluded.price_per_hour,
+               available = excluded.available""",
+        (
+            bike_id,
+            bike["name"],
+            bike["type"],
+            bike["price_per_hour"],
+            int(bike["available"]),
+        ),
+    )
+    if rental is not None:
+        db.execute(
+            """INSERT INTO Rentals (bike_id, customer_name, hours, total_cost)
+               VALUES (?, ?, ?, ?)""",
+            (bike_id, rental["customer_name"], rental["hours"], rental["total_cost"]),
+        )
+
+
+def waiting_bikes(db):
+    # Ids of the bikes with operations still in the outbox
+    return {
+        json.loads(params)["bike_id"]
+        for (params,) in db.execute("SELECT params FROM Outbox WHERE status = 'pending'")
+    }
+
+
+class Kiosk:
+    # A kiosk replica and its sync thread; see the top of the module.
+    # call(name, params) is the write interface of
+    # group_commit.GroupCommitter, so a depots.DepotSet can hand the kiosk its
+    # writes (see depots.open_kiosk). Connections are per thread.
+
+    def __init__(self, replica, profile=None, interval=SYNC_INTERVAL, batch=OUTBOX_BATCH):
+        self.replica = replica
+        self.profile = profile
+        self.interval = interval
+        self.batch = batch
+        self._local = threading.local()
+        conn = self._conn()
+        migrate(conn)
+        info = conn.execute(
+            "SELECT name, replica_id, primary_url FROM KioskInfo"
+        ).fetchone()
+        if info is None:
+            raise ValueError(f"{replica} is not a kiosk replica (see kiosk.py init).")
+        self.name, self.replica_id, self.primary_url = info
+        self.client = PrimaryClient(self.primary_url)
+        self.online = False  # as of the last sync
+        self.last_sync = None  # time.time() of the last complete sync
+        self._sync_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.replica, self.profile)
+        return conn
+
+    def set_credentials(self, username, password):
+        # The account to sync with; syncing starts once this is known
+        self.client.credentials = (username, password)
+        self.client.token = None
+        self._wake.set()
+
+    # Operations at the kiosk
+
+    def call(self, name, params):
+        # Rent or return on the replica and queue the operation for the
+        # primary, in one transaction
+        if name not in KIOSK_OPERATIONS:
+            raise RentalError("Only rentals and returns can be made at a kiosk.")
+
+        def work(db):
+            if name == "rent":
+                result = rental_service.rent_bike_in_tx(db, **params)
+                queued = {
+                    key: result[key] for key in ("bike_id", "customer_name", "hours")
+                }
+            else:
+                bike_id = rental_service.as_count(
+                    params.get("bike_id"), "Please enter a valid numeric Bike ID."
+                )
+                # The primary checks it is returning the rental made here
+                rental = db.execute(
+                    "SELECT customer_name FROM Rentals WHERE bike_id = ?", (bike_id,)
+                ).fetchone()
+                result = rental_service.return_bike_in_tx(db, bike_id)
+                queued = {"bike_id": bike_id, "customer_name": rental and rental[0]}
+            db.execute(
+                "INSERT INTO Outbox (op, params) VALUES (?, ?)",
+                (name, json.dumps(queued)),
+            )
+            return result
+
+        result = immediate(self._conn(), work)
+        self._wake.set()
+        return result
+
+    def pending_count(self):
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM Outbox WHERE status = 'pending'"
+        ).fetchone()[0]
+
+    def conflicts(self):
+        return [
+            {"seq": seq, "op": op, "params": json.loads(params), "at": at, "error": error}
+            for seq, op, params, at, error in self._conn().execute(
+                """SELECT seq, op, params, created_at, error FROM Outbox
+                   WHERE status = 'conflict' ORDER BY seq"""
+            )
+        ]
+
+    # Syncing
+
+    def sync(self):
+        # One round: push the outbox, then pull the primary's changes.
+        # Returns {"pushed", "conflicts", "pulled"}; raises Offline if the
+        # primary could not be reached.
+        with self._sync_lock:
+            try:
+                pushed, conflicts = self._push()
+                pulled = self._pull()
+            except Offline:
+                self.online = False
+                raise
+            self.online = True
+            self.last_sync = time.time()
+            return {"pushed": pushed, "conflicts": conflicts, "pulled": pulled}
+
+    def _push(self):
+        conn = self._conn()
+        pushed = conflicts = 0
+        while True:
+            rows = conn.execute(
+                """SELECT seq, op, params FROM Outbox WHERE status = 'pending'
+                   ORDER BY seq LIMIT ?""",
+                (self.batch,),
+            ).fetchall()
+            if not rows:
+                return pushed, conflicts
+            results = self.client.request(
+                "POST",
+                "/sync",
+                {
+                    "kiosk": self.replica_id,
+                    "operations": [
+                        {"seq": seq, "op": op, "params": json.loads(params)}
+                        for seq, op, params in rows
+                    ],
+                },
+            )
+            immediate(
+                conn,
+                lambda db: db.executemany(
+                    "UPDATE Outbox SET status = ?, error = ? WHERE seq = ?",
+                    (
+                        ("synced" if r["ok"] else "conflict", r["error"], r["seq"])
+                        for r in results
+                    ),
+                ),
+            )
+            for result in results:
+                if not result["ok"]:
+                    conflicts += 1
+                    log.warning(
+                        "Outbox entry %s refused: %s", result["seq"], result["error"]
+                    )
+            pushed += len(results)
+
+    def _pull(self):
+        conn = self._conn()
+        seq = conn.execute("SELECT primary_seq FROM KioskInfo").fetchone()[0]
+        pulled = 0
+        while True:
+            answer = self.client.request("GET", f"/changes?after={seq}")
+            if answer["changes"] is None:
+                return pulled + self.copy_all()
+            if answer["seq"] == seq:
+                return pulled
+
+            def work(db, answer=answer):
+                waiting = waiting_bikes(db)
+                for change in answer["changes"]:
+                    if change["bike_id"] not in waiting:
+                        put_bike(db, change["bike_id"], change["bike"], change["rental"])
+                db.execute("UPDATE KioskInfo SET primary_seq = ?", (answer["seq"],))
+
+            immediate(conn, work)
+            pulled += len(answer["changes"])
+            seq = answer["seq"]
+
+    def copy_all(self):
+        # Replace the replica's bikes and rentals with the primary's, except
+        # for bikes still in the outbox. Returns the number of bikes copied.
+        seq = self.client.request("GET", "/changes")["seq"]
+        bikes, after = [], 0
+        while True:
+            page = self.client.request("GET", f"/bikes?after={after}&limit={PAGE_SIZE}")
+            bikes += page
+            if len(page) < PAGE_SIZE:
+                break
+            after = page[-1]["id"]
+        rentals = {
+            rental["bike_id"]: rental
+            for rental in self.client.request("GET", "/rentals")
+        }
+
+        def work(db):
+            waiting = waiting_bikes(db)
+            kept = {bike["id"] for bike in bikes}
+            for (bike_id,) in db.execute("SELECT id FROM Bikes").fetchall():
+                if bike_id not in kept and bike_id not in waiting:
+                    put_bike(db, bike_id, None, None)
+            for bike in bikes:
+                if bike["id"] not in waiting:
+                    put_bike(db, bike["id"], bike, rentals.get(bike["id"]))
+            db.execute("UPDATE KioskInfo SET primary_seq = ?", (seq,))
+
+        immediate(self._conn(), work)
+        return len(bikes)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="kiosk-sync", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        delay = self.interval
+        while not self._stop.is_set():
+            if self.client.credentials is not None:
+                try:
+                    self.sync()
+                    delay = self.interval
+                except Offline as e:
+                    log.info("Primary not reachable: %s", e)
+                    delay = min(delay * 2, MAX_BACKOFF)
+                except RentalError as e:
+                    log.warning("Sync refused: %s", e)
+                    delay = min(delay * 2, MAX_BACKOFF)
+                except Exception:
+                    log.exception("Sync failed")
+                    delay = min(delay * 2, MAX_BACKOFF)
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.client.close()
+
+
+def init_replica(replica, name, primary_url, username, password, profile=None):
+    # Create a kiosk replica of the primary at primary_url and copy its
+    # bikes; the account is checked with the primary and added locally
+    client = PrimaryClient(primary_url)
+    client.credentials = (username, password)
+    user = client.login()
+    client.close()
+
+    conn = connect(replica, profile)
+    try:
+        migrate(conn)
+
+        def work(db):
+            if db.execute("SELECT 1 FROM KioskInfo").fetchone() is not None:
+                raise ValueError(f"{replica} is already a kiosk replica.")
+            db.execute(
+                """INSERT INTO KioskInfo (id, name, replica_id, primary_url)
+                   VALUES (1, ?, ?, ?)""",
+                (name, new_replica_id(name), primary_url),
+            )
+            if db.execute(
+                "SELECT 1 FROM Users WHERE username = ?", (user["username"],)
+            ).fetchone() is None:
+                rental_service.sign_up_in_tx(
+                    db, username, password, is_admin=user["role"] == "admin"
+                )
+
+        immediate(conn, work)
+    finally:
+        conn.close()
+
+    kiosk = Kiosk(replica, profile)
+    kiosk.set_credentials(username, password)
+    try:
+        return kiosk.copy_all()
+    finally:
+        kiosk.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiosk replicas")
+    parser.add_argument("--replica", required=True, help="the kiosk's database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    init_parser = commands.add_parser("init", help="create a replica of the primary")
+    init_parser.add_argument("--name", required=True, help="name of the kiosk")
+    init_parser.add_argument("--primary", required=True, help="URL of api_server.py")
+    sync_parser = commands.add_parser("sync", help="sync once with the primary")
+    for command in (init_parser, sync_parser):
+        command.add_argument("--user", required=True)
+        command.add_argument("--password", required=True)
+    commands.add_parser("status", help="show the outbox and its conflicts")
+
+    args = parser.parse_args()
+    try:
+        if args.command == "init":
+            copied = init_replica(
+                args.replica, args.name, args.primary, args.user, args.password
+            )
+            print(f"Copied {copied} bikes from {args.primary} into {args.replica}.")
+            return
+        kiosk = Kiosk(args.replica)
+    except (ValueError, RentalError, Offline) as e:
+        parser.exit(1, f"{e}\n")
+
+    if args.command == "sync":
+        kiosk.set_credentials(args.user, args.password)
+        try:
+            summary = kiosk.sync()
+        except (RentalError, Offline) as e:
+            parser.exit(1, f"{e}\n")
+        finally:
+            kiosk.close()
+        print(
+            f"Pushed {summary['pushed']} operations ({summary['conflicts']} refused), "
+            f"pulled {summary['pulled']} bikes."
+        )
+        return
+
+    print(f"Kiosk {kiosk.name} ({kiosk.replica_id}), primary {kiosk.primary_url}")
+    print(f"{kiosk.pending_count()} operations waiting to be synced")
+    for conflict in kiosk.conflicts():
+        print(
+            f"  #{conflict['seq']} {conflict['at']} {conflict['op']} "
+            f"{json.dumps(conflict['params'])}: {conflict['error']}"
+        )
+    kiosk.close()
+
+
+if __name__ == "__main__":
+    main()
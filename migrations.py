@@ -0,0 +1,381 @@
+import sqlite3
+
+import analytics
+
+# Schema migrations for bike-rental.db. The schema version lives in
+# PRAGMA user_version; every function below upgrades the database by one
+# version and runs inside its own transaction, so an interrupted upgrade
+# leaves the file at the last completed version.
+
+
+def create_base_tables(conn):
+    # The tables as the app has always created them (databases from before
+    # migrations existed are at version 0 but already have these)
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS Users (
+                    username TEXT PRIMARY KEY,
+                    password TEXT NOT NULL,
+                    role TEXT NOT NULL
+                    )"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS Bikes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT,
+                    type TEXT,
+                    price_per_hour INTEGER,
+                    available TEXT)"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS Rentals (
+                    bike_id INTEGER,
+                    customer_name TEXT,
+                    hours INTEGER,
+                    total_cost REAL
+                )"""
+    )
+
+
+def make_available_integer(conn):
+    # SQLite cannot change a column type in place, so rebuild Bikes
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'Bikes'").fetchone()
+    conn.execute(
+        """CREATE TABLE Bikes_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT,
+                    type TEXT,
+                    price_per_hour INTEGER,
+                    available INTEGER NOT NULL DEFAULT 1
+                        CHECK (available IN (0, 1)))"""
+    )
+    conn.execute(
+        """INSERT INTO Bikes_new (id, name, type, price_per_hour, available)
+           SELECT id, name, type, price_per_hour,
+                  COALESCE(CAST(available AS INTEGER), 1) != 0
+           FROM Bikes"""
+    )
+    conn.execute("DROP TABLE Bikes")
+    conn.execute("ALTER TABLE Bikes_new RENAME TO Bikes")
+    if seq is not None:
+        # Keep AUTOINCREMENT from handing out ids of bikes deleted earlier
+        conn.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'Bikes'", seq
+        )
+
+
+def add_rental_timestamps(conn):
+    # Rentals that existed before this migration keep a NULL start time
+    conn.execute(
+        """CREATE TABLE Rentals_new (
+                    bike_id INTEGER,
+                    customer_name TEXT,
+                    hours INTEGER,
+                    total_cost REAL,
+                    rented_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )"""
+    )
+    conn.execute(
+        """INSERT INTO Rentals_new (bike_id, customer_name, hours, total_cost, rented_at)
+           SELECT bike_id, customer_name, hours, total_cost, NULL FROM Rentals"""
+    )
+    conn.execute("DROP TABLE Rentals")
+    conn.execute("ALTER TABLE Rentals_new RENAME TO Rentals")
+
+
+def add_lookup_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rentals_bike_id ON Rentals (bike_id)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_bikes_available_type ON Bikes (available, type)"
+    )
+
+
+def add_analytics_aggregates(conn):
+    analytics.create_tables(conn)
+    analytics.rebuild(conn)
+
+
+def add_rental_history(conn):
+    # Monthly partitions are created on demand by rental_history; this is the
+    # catalog of them. archive_path is set once a month is moved to a file.
+    conn.execute(
+        """CREATE TABLE HistoryPartitions (
+                    month TEXT PRIMARY KEY,
+                    archive_path TEXT
+                )"""
+    )
+
+
+def add_bike_search(conn):
+    # One index per sortable column of the bike list (an index on a column
+    # also orders by rowid, which is the id tie-break the pager uses)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bikes_name ON Bikes (name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bikes_type ON Bikes (type)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bikes_price ON Bikes (price_per_hour)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bikes_available ON Bikes (available)")
+
+    # Full-text index over name and type, kept in step with Bikes by
+    # triggers. Without FTS5 the bike list falls back to LIKE searches.
+    try:
+        conn.execute(
+            """CREATE VIRTUAL TABLE BikeSearch USING fts5(
+                        name, type,
+                        content='Bikes', content_rowid='id', prefix='2 3'
+                    )"""
+        )
+    except sqlite3.OperationalError as e:
+        if "fts5" not in str(e):
+            raise
+        return
+    conn.execute(
+        """CREATE TRIGGER bikes_search_insert AFTER INSERT ON Bikes BEGIN
+               INSERT INTO BikeSearch (rowid, name, type)
+               VALUES (new.id, new.name, new.type);
+           END"""
+    )
+    conn.execute(
+        """CREATE TRIGGER bikes_search_delete AFTER DELETE ON Bikes BEGIN
+               INSERT INTO BikeSearch (BikeSearch, rowid, name, type)
+               VALUES ('delete', old.id, old.name, old.type);
+           END"""
+    )
+    # Renting and returning only touch available, so they skip the index
+    conn.execute(
+        """CREATE TRIGGER bikes_search_update AFTER UPDATE OF name, type ON Bikes BEGIN
+               INSERT INTO BikeSearch (BikeSearch, rowid, name, type)
+               VALUES ('delete', old.id, old.name, old.type);
+               INSERT INTO BikeSearch (rowid, name, type)
+               VALUES (new.id, new.name, new.type);
+           END"""
+    )
+    conn.execute("INSERT INTO BikeSearch (BikeSearch) VALUES ('rebuild')")
+
+
+def add_bike_images(conn):
+    # Path of the bike's photo and the SHA-256 of its contents (see
+    # bike_images); NULL when the bike has no photo
+    conn.execute("ALTER TABLE Bikes ADD COLUMN image_path TEXT")
+    conn.execute("ALTER TABLE Bikes ADD COLUMN image_sha256 TEXT")
+
+
+def add_reservations(conn):
+    # Future bookings (see reservations). Times are UTC text like
+    # Rentals.rented_at; the (bike_id, starts_at) index answers every
+    # conflict check with a single probe.
+    conn.execute(
+        """CREATE TABLE Reservations (
+                    id INTEGER PRIMARY KEY,
+                    bike_id INTEGER NOT NULL,
+                    customer_name TEXT NOT NULL,
+                    starts_at TEXT NOT NULL,
+                    ends_at TEXT NOT NULL,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    CHECK (starts_at < ends_at)
+                )"""
+    )
+    conn.execute(
+        "CREATE INDEX idx_reservations_bike_start ON Reservations (bike_id, starts_at)"
+    )
+
+
+def add_depot_info(conn):
+    # Which depot this file holds (see depots); written when the file is
+    # first opened as a depot. Reservations switch to AUTOINCREMENT so their
+    # ids, like bike ids, can start at the depot's id block and are never
+    # reused after a cancellation.
+    conn.execute(
+        """CREATE TABLE DepotInfo (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    number INTEGER NOT NULL,
+                    name TEXT NOT NULL
+                )"""
+    )
+    conn.execute(
+        """CREATE TABLE Reservations_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    bike_id INTEGER NOT NULL,
+                    customer_name TEXT NOT NULL,
+                    starts_at TEXT NOT NULL,
+                    ends_at TEXT NOT NULL,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    CHECK (starts_at < ends_at)
+                )"""
+    )
+    conn.execute("INSERT INTO Reservations_new SELECT * FROM Reservations")
+    conn.execute("DROP TABLE Reservations")
+    conn.execute("ALTER TABLE Reservations_new RENAME TO Reservations")
+    conn.execute(
+        "CREATE INDEX idx_reservations_bike_start ON Reservations (bike_id, starts_at)"
+    )
+
+
+def add_pricing_rules(conn):
+    # Multipliers applied to price_per_hour when a bike is rented (see
+    # pricing). PricingState.version is replaced by a random number on every
+    # change to the rules, so any process can tell from one row whether the
+    # rules it compiled are still current.
+    conn.execute(
+        """CREATE TABLE PricingRules (
+                    id INTEGER PRIMARY KEY,
+                    kind TEXT NOT NULL
+                        CHECK (kind IN ('hours', 'weekend', 'type', 'duration', 'demand')),
+                    bike_type TEXT,
+                    low REAL,
+                    high REAL,
+                    multiplier REAL NOT NULL CHECK (multiplier > 0)
+                )"""
+    )
+    conn.execute(
+        """CREATE TABLE PricingState (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    version INTEGER NOT NULL
+                )"""
+    )
+    conn.execute("INSERT INTO PricingState (id, version) VALUES (1, random())")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(
+            f"""CREATE TRIGGER pricing_rules_{event.lower()} AFTER {event} ON PricingRules
+                BEGIN
+                    UPDATE PricingState SET version = random() WHERE id = 1;
+                END"""
+        )
+
+
+def add_journal_state(conn):
+    # The last operation of each write journal that is in the database (see
+    # group_commit). It is updated in the transaction that applies the
+    # operations, so after a crash it tells which ones must be replayed.
+    conn.execute(
+        """CREATE TABLE JournalState (
+                    journal TEXT PRIMARY KEY,
+                    applied INTEGER NOT NULL
+                )"""
+    )
+
+
+def add_change_log(conn):
+    # One entry per change to a bike, its rental or its reservations, for
+    # open counters to catch up from (see change_feed). Every 1000th entry
+    # drops the entries more than 10000 behind it.
+    conn.execute(
+        """CREATE TABLE Changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    bike_id INTEGER NOT NULL
+                )"""
+    )
+    conn.execute(
+        """CREATE TRIGGER changes_prune AFTER INSERT ON Changes
+           WHEN new.seq % 1000 = 0 BEGIN
+               DELETE FROM Changes WHERE seq <= new.seq - 10000;
+           END"""
+    )
+    for table, bike_id in (("Bikes", "id"), ("Rentals", "bike_id")):
+        for event, row in (("INSERT", "new"), ("UPDATE", "new"), ("DELETE", "old")):
+            conn.execute(
+                f"""CREATE TRIGGER {table.lower()}_changes_{event.lower()}
+                    AFTER {event} ON {table} BEGIN
+                        INSERT INTO Changes (bike_id) VALUES ({row}.{bike_id});
+                    END"""
+            )
+    # A reservation changes which bikes are free for a slot
+    for event, row in (("INSERT", "new"), ("DELETE", "old")):
+        conn.execute(
+            f"""CREATE TRIGGER reservations_changes_{event.lower()}
+                AFTER {event} ON Reservations BEGIN
+                    INSERT INTO Changes (bike_id) VALUES ({row}.bike_id);
+                END"""
+        )
+
+
+def add_kiosk_outbox(conn):
+    # For kiosk replicas (see kiosk): rentals and returns made at the kiosk,
+    # in order, until the primary store has taken them, and where the
+    # replica stands. Other databases leave both empty.
+    conn.execute(
+        """CREATE TABLE Outbox (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    op TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    status TEXT NOT NULL DEFAULT 'pending'
+                        CHECK (status IN ('pending', 'synced', 'conflict')),
+                    error TEXT
+                )"""
+    )
+    conn.execute(
+        "CREATE INDEX idx_outbox_pending ON Outbox (seq) WHERE status = 'pending'"
+    )
+    conn.execute(
+        """CREATE TABLE KioskInfo (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    name TEXT NOT NULL,
+                    primary_url TEXT NOT NULL,
+                    primary_seq INTEGER NOT NULL DEFAULT 0
+                )"""
+    )
+
+
+def add_kiosk_replica_id(conn):
+    # Replicas sync under an id made when they are set up, not their name, so
+    # a kiosk set up again under its old name starts a fresh outbox record
+    # on the primary. Existing replicas keep the name they synced under.
+    conn.execute("ALTER TABLE KioskInfo ADD COLUMN replica_id TEXT")
+    conn.execute("UPDATE KioskInfo SET replica_id = name")
+
+
+def add_kiosk_accounts(conn):
+    # On the primary: the account each replica syncs as (see kiosk). The
+    # first account to sync a replica id keeps it; only that account or an
+    # admin may sync under it afterwards.
+    conn.execute(
+        """CREATE TABLE KioskAccounts (
+                    replica_id TEXT PRIMARY KEY,
+                    username TEXT NOT NULL
+                )"""
+    )
+
+
+MIGRATIONS = [
+    create_base_tables,  # version 1
+    make_available_integer,  # version 2
+    add_rental_timestamps,  # version 3
+    add_lookup_indexes,  # version 4
+    add_analytics_aggregates,  # version 5
+    add_rental_history,  # version 6
+    add_bike_search,  # version 7
+    add_bike_images,  # version 8
+    add_reservations,  # version 9
+    add_depot_info,  # version 10
+    add_pricing_rules,  # version 11
+    add_journal_state,  # version 12
+    add_change_log,  # version 13
+    add_kiosk_outbox,  # version 14
+    add_kiosk_replica_id,  # version 15
+    add_kiosk_accounts,  # version 16
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, target=None):
+    target = len(MIGRATIONS) if target is None else target
+    version = schema_version(conn)
+    if version > len(MIGRATIONS):
+        raise sqlite3.DatabaseError(
+            f"Database schema version {version} is newer than this app supports."
+        )
+
+    while version < target:
+        migration = MIGRATIONS[version]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version += 1
+
+    return version
@@ -0,0 +1,364 @@
+"""Dynamic pricing: rules that turn a bike's hourly price into what a rental
+costs.
+
+    python pricing.py list
+    python pricing.py add hours 1.25 --from 7 --to 10
+    python pricing.py add weekend 1.2 --type Road
+    python pricing.py add type 0.9 --type City
+    python pricing.py add duration 0.8 --from 4
+    python pricing.py add demand 1.5 --from 0.75
+    python pricing.py delete 3
+    python pricing.py quote Road 10 3 [--at "2024-06-01 09:00"]
+
+Every rule multiplies the price; a rule with --type only applies to bikes of
+that type. The kinds are:
+
+    hours     rental hours that start from --from to --to o'clock, local
+              time (22 to 6 runs past midnight)
+    weekend   rental hours on a Saturday or Sunday
+    type      the whole rental
+    duration  the whole rental, when it is booked for --from hours or more
+    demand    the whole rental, when --from (0 to 1) or more of the bikes of
+              its type are rented out
+
+Hours and weekend rules price each hour of a rental on its own, and every
+one that matches applies. Of the duration rules, and of the demand rules,
+only the one with the highest --from that is reached applies.
+
+Rules are kept in PricingRules in each depot's database and compiled into
+tables per bike type: the multiplier of each of the 168 hours of the week,
+kept as running sums so any stretch of hours costs two lookups, plus the
+sorted duration and demand tiers. Quotes are memoized by (type, hour of the
+week, hours). Every change to the rules gives PricingState a new version
+and the compiled rules are found by that version, so a change made by any
+process applies to the next rental without a restart.
+"""
+
+import argparse
+import time
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+from operator import mul
+
+import analytics
+from db import DB_FILE, connect
+from migrations import migrate
+import rental_tx
+
+RULE_KINDS = ("hours", "weekend", "type", "duration", "demand")
+RULE_COLUMNS = "id, kind, bike_type, low, high, multiplier"
+HOURS_PER_WEEK = 7 * 24
+WEEKEND = 5 * 24  # Saturday 00:00 as an hour of the week
+QUOTE_CACHE_SIZE = 10_000
+COMPILED_CACHE_SIZE = 32
+DEMAND_TTL = 60  # seconds a type's share of rented bikes is reused
+
+# Compiled rules by PricingState.version
+_compiled = {}
+
+
+def rule_from_row(row):
+    return dict(zip(("id", "kind", "bike_type", "low", "high", "multiplier"), row))
+
+
+def hour_of_week(moment):
+    # 0 is Monday from midnight to 1 o'clock
+    return moment.weekday() * 24 + moment.hour
+
+
+def in_hours(hour, low, high):
+    # Whether an hour of the day starts in [low, high), past midnight when
+    # low > high
+    if low <= high:
+        return low <= hour < high
+    return hour >= low or hour < high
+
+
+def tier(thresholds, multipliers, value):
+    # Multiplier of the highest threshold reached by value
+    position = bisect_right(thresholds, value)
+    return multipliers[position - 1] if position else 1.0
+
+
+def utilization(db, bike_type):
+    # Share of the bikes of a type that are rented out; both counts are
+    # answered from indexes
+    bikes = db.execute(
+        "SELECT COUNT(*) FROM Bikes WHERE type = ?", (bike_type,)
+    ).fetchone()[0]
+    if not bikes:
+        return 0.0
+    rented = db.execute(
+        "SELECT COUNT(*) FROM Bikes WHERE available = 0 AND type = ?", (bike_type,)
+    ).fetchone()[0]
+    return rented / bikes
+
+
+class TypeTables:
+    # The rules that apply to one bike type, compiled
+
+    def __init__(self, rules):
+        week = [1.0] * HOURS_PER_WEEK
+        self.multiplier = 1.0
+        tiers = {"duration": [], "demand": []}
+        for rule in rules:
+            kind, multiplier = rule["kind"], rule["multiplier"]
+            if kind == "hours":
+                for hour in range(HOURS_PER_WEEK):
+                    if in_hours(hour % 24, rule["low"], rule["high"]):
+                        week[hour] *= multiplier
+            elif kind == "weekend":
+                for hour in range(WEEKEND, HOURS_PER_WEEK):
+                    week[hour] *= multiplier
+            elif kind == "type":
+                self.multiplier *= multiplier
+            else:
+                tiers[kind].append((rule["low"], rule["bike_type"] is not None, multiplier))
+        # On equal thresholds the rule for the type sorts last, so it wins
+        for kind, rows in tiers.items():
+            rows.sort()
+            setattr(self, kind, ([row[0] for row in rows], [row[2] for row in rows]))
+
+        # sums[i] adds up the first i hours of two weeks in a row, so the
+        # hours from any start up to a week later are one subtraction
+        self.sums = array("d", [0.0])
+        for value in week + week:
+            self.sums.append(self.sums[-1] + value)
+        self.week_total = self.sums[HOURS_PER_WEEK]
+
+    def hour_sum(self, start, hours):
+        # Sum of the multipliers of hours consecutive hours from start (an
+        # hour of the week)
+        weeks, rest = divmod(hours, HOURS_PER_WEEK)
+        return weeks * self.week_total + self.sums[start + rest] - self.sums[start]
+
+
+class PricingRules:
+    # Every rule of one database, compiled. Shared by all connections that
+    # see the same PricingState.version.
+
+    def __init__(self, version, rules):
+        self.version = version
+        self.rules = rules
+        general = [rule for rule in rules if rule["bike_type"] is None]
+        self._default = TypeTables(general)
+        self._tables = {
+            bike_type: TypeTables(
+                general + [rule for rule in rules if rule["bike_type"] == bike_type]
+            )
+            for bike_type in {rule["bike_type"] for rule in rules} - {None}
+        }
+        self._factors = {}
+        self._utilization = {}
+
+    def tables(self, bike_type):
+        return self._tables.get(bike_type, self._default)
+
+    def factor(self, bike_type, start, hours):
+        # What renting for hours from start (an hour of the week) costs, in
+        # multiples of price_per_hour and before demand
+        key = (bike_type, start, hours)
+        factor = self._factors.get(key)
+        if factor is None:
+            tables = self.tables(bike_type)
+            factor = (
+                tables.hour_sum(start, hours)
+                * tables.multiplier
+                * tier(*tables.duration, hours)
+            )
+            if len(self._factors) >= QUOTE_CACHE_SIZE:
+                self._factors.clear()
+            self._factors[key] = factor
+        return factor
+
+    def demand(self, db, bike_type):
+        tables = self.tables(bike_type)
+        if not tables.demand[0]:
+            return 1.0
+        now = time.monotonic()
+        cached = self._utilization.get(bike_type)
+        if cached is None or cached[0] < now:
+            cached = self._utilization[bike_type] = (
+                now + DEMAND_TTL,
+                utilization(db, bike_type),
+            )
+        return tier(*tables.demand, cached[1])
+
+    def rates(self, db, type_codes, type_names, prices, at=None):
+        # Hourly rate (a one-hour rental starting this hour) of bikes given
+        # as columns, where type_codes index type_names. Every bike of a
+        # type shares one factor, so this is a single multiplication per
+        # bike, done by NumPy when it is installed.
+        start = hour_of_week(at or datetime.now())
+        factors = [
+            self.factor(bike_type, start, 1) * self.demand(db, bike_type)
+            for bike_type in type_names
+        ]
+        np = analytics.load_numpy()
+        if np:
+            return np.asarray(prices, dtype=np.float64) * np.asarray(factors)[
+                np.asarray(type_codes, dtype=np.intp)
+            ]
+        return array("d", map(mul, prices, map(factors.__getitem__, type_codes)))
+
+
+def compiled(conn):
+    # The rules of conn's database, compiled once per version
+    version = conn.execute("SELECT version FROM PricingState WHERE id = 1").fetchone()[0]
+    rules = _compiled.get(version)
+    if rules is None:
+        rules = PricingRules(version, list_rules(conn))
+        if len(_compiled) >= COMPILED_CACHE_SIZE:
+            _compiled.clear()
+        _compiled[version] = rules
+    return rules
+
+
+def quote(db, bike_type, price_per_hour, hours, start=None):
+    # What renting a bike for hours from start (local time, default now)
+    # costs. Whole amounts come back as int, like price_per_hour * hours.
+    rules = compiled(db)
+    factor = rules.factor(bike_type, hour_of_week(start or datetime.now()), hours)
+    cost = round(price_per_hour * factor * rules.demand(db, bike_type), 2)
+    return int(cost) if cost.is_integer() else cost
+
+
+def hourly_rates(conn, bikes, at=None):
+    # Current hourly rate of each of bikes (dicts or Bikes), e.g. a page of
+    # the bike list; None where the price is NULL
+    codes = {}
+    type_codes = [codes.setdefault(bike["type"], len(codes)) for bike in bikes]
+    prices = [
+        float("nan") if bike["price_per_hour"] is None else bike["price_per_hour"]
+        for bike in bikes
+    ]
+    rates = compiled(conn).rates(conn, type_codes, list(codes), prices, at)
+    return [None if rate != rate else rate for rate in rates.tolist()]
+
+
+def fleet_rates(conn, fleet, at=None):
+    # Current hourly rate of every bike of a FleetStore. Returns (ids,
+    # rates), two columns in bike id order.
+    ids, type_codes, type_names, prices = fleet.price_columns()
+    return ids, compiled(conn).rates(conn, type_codes, type_names, prices, at)
+
+
+# Editing rules
+
+
+def list_rules(conn):
+    return [
+        rule_from_row(row)
+        for row in conn.execute(
+            f"SELECT {RULE_COLUMNS} FROM PricingRules ORDER BY kind, bike_type, low, id"
+        )
+    ]
+
+
+def check_rule(kind, multiplier, low, high):
+    if kind not in RULE_KINDS:
+        raise ValueError(f"Unknown kind of pricing rule: {kind!r}")
+    if not multiplier > 0:
+        raise ValueError("The multiplier must be more than 0.")
+    if kind == "hours" and (
+        low is None or high is None or not 0 <= low <= 24 or not 0 <= high <= 24
+    ):
+        raise ValueError("An hours rule needs --from and --to between 0 and 24.")
+    if kind == "hours" and low == high:
+        raise ValueError("An hours rule needs --from and --to to differ.")
+    if kind == "duration" and (low is None or low < 0):
+        raise ValueError("A duration rule needs --from, in hours.")
+    if kind == "demand" and (low is None or not 0 <= low <= 1):
+        raise ValueError("A demand rule needs --from between 0 and 1.")
+
+
+def add_rule(conn, kind, multiplier, low=None, high=None, bike_type=None):
+    check_rule(kind, multiplier, low, high)
+    return rental_tx.immediate(
+        conn,
+        lambda db: db.execute(
+            """INSERT INTO PricingRules (kind, bike_type, low, high, multiplier)
+               VALUES (?, ?, ?, ?, ?)""",
+            (kind, bike_type or None, low, high, multiplier),
+        ).lastrowid,
+    )
+
+
+def delete_rule(conn, rule_id):
+    deleted = rental_tx.immediate(
+        conn,
+        lambda db: db.execute(
+            "DELETE FROM PricingRules WHERE id = ?", (rule_id,)
+        ).rowcount,
+    )
+    if not deleted:
+        raise ValueError(f"No pricing rule {rule_id}.")
+
+
+def describe(rule):
+    kind, low, high = rule["kind"], rule["low"], rule["high"]
+    if kind == "hours":
+        when = f"hours from {low:g} to {high:g} o'clock"
+    elif kind == "weekend":
+        when = "weekend hours"
+    elif kind == "type":
+        when = "every rental"
+    elif kind == "duration":
+        when = f"rentals of {low:g} hours or more"
+    else:
+        when = f"when {low:.0%} or more are rented"
+    bikes = f"{rule['bike_type']} bikes" if rule["bike_type"] else "all bikes"
+    return f"x{rule['multiplier']:g} for {when}, {bikes}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pricing rules")
+    parser.add_argument("--db", default=DB_FILE)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="list the pricing rules")
+
+    add_parser = commands.add_parser("add", help="add a pricing rule")
+    add_parser.add_argument("kind", choices=RULE_KINDS)
+    add_parser.add_argument("multiplier", type=float)
+    add_parser.add_argument("--from", dest="low", type=float)
+    add_parser.add_argument("--to", dest="high", type=float)
+    add_parser.add_argument("--type", dest="bike_type")
+
+    delete_parser = commands.add_parser("delete", help="delete a pricing rule")
+    delete_parser.add_argument("rule_id", type=int)
+
+    quote_parser = commands.add_parser("quote", help="price a rental")
+    quote_parser.add_argument("bike_type")
+    quote_parser.add_argument("price_per_hour", type=float)
+    quote_parser.add_argument("hours", type=int)
+    quote_parser.add_argument("--at", help="YYYY-MM-DD HH:MM, local time")
+
+    args = parser.parse_args()
+    conn = connect(args.db)
+    migrate(conn)
+
+    try:
+        if args.command == "list":
+            for rule in list_rules(conn):
+                print(f"{rule['id']:>4}  {rule['kind']:<9} {describe(rule)}")
+        elif args.command == "add":
+            rule_id = add_rule(
+                conn, args.kind, args.multiplier, args.low, args.high, args.bike_type
+            )
+            print(f"Added pricing rule {rule_id}.")
+        elif args.command == "delete":
+            delete_rule(conn, args.rule_id)
+            print(f"Deleted pricing rule {args.rule_id}.")
+        else:
+            start = datetime.fromisoformat(args.at) if args.at else None
+            cost = quote(conn, args.bike_type, args.price_per_hour, args.hours, start)
+            print(f"${cost}")
+    except ValueError as e:
+        parser.exit(1, f"{e}\n")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
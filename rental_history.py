@@ -0,0 +1,245 @@
+"""Rental history: every finished rental, partitioned by month.
+
+    python rental_history.py list
+    python rental_history.py show --from 2024-01-01 --to 2024-03-31 [--bike 7]
+    python rental_history.py archive 2024-01 [--dir history-archive]
+
+Rentals only holds open rentals. When a bike is returned (or deleted while
+rented) its row moves, in the same transaction, into RentalHistory_YYYY_MM
+for the month of the return, with the return time and how it ended. Rows
+are never changed afterwards, so a finished month is read-only.
+
+The HistoryPartitions table lists the months. Queries for a date range only
+read the partitions for the months in that range. Archiving a finished
+month copies its partition into a standalone file (one per month) while
+the counters keep renting, then drops the table in one short transaction.
+Archived months can still be queried; they are opened read-only from their
+file.
+"""
+
+import argparse
+import os
+import sqlite3
+from datetime import date, datetime, timezone
+
+from db import DB_FILE, connect
+from migrations import migrate
+
+HISTORY_COLUMNS = (
+    "bike_id, customer_name, hours, total_cost, rented_at, returned_at, ended"
+)
+ARCHIVE_TABLE = "RentalHistory"
+ARCHIVE_DIR = "history-archive"
+
+
+def partition_table(month):
+    # "2024-03" -> "RentalHistory_2024_03"
+    return "RentalHistory_" + month.replace("-", "_")
+
+
+def create_partition(db, table):
+    db.execute(
+        f"""CREATE TABLE IF NOT EXISTS {table} (
+                    bike_id INTEGER,
+                    customer_name TEXT,
+                    hours INTEGER,
+                    total_cost REAL,
+                    rented_at TEXT,
+                    returned_at TEXT NOT NULL,
+                    ended TEXT NOT NULL
+                )"""
+    )
+    db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_bike_id ON {table} (bike_id)")
+
+
+def history_from_row(row):
+    return {
+        "bike_id": row[0],
+        "customer_name": row[1],
+        "hours": row[2],
+        "total_cost": row[3],
+        "rented_at": row[4],
+        "returned_at": row[5],
+        "ended": row[6],
+    }
+
+
+# Writes, called inside the return/delete transaction
+
+
+def close_rentals(db, bike_id, ended="returned"):
+    # Move the bike's open rental from Rentals into this month's partition.
+    # Returns how many rentals were closed (0 or 1).
+    now = datetime.now(timezone.utc)
+    month = now.strftime("%Y-%m")
+    table = partition_table(month)
+    if db.execute(
+        "INSERT OR IGNORE INTO HistoryPartitions (month) VALUES (?)", (month,)
+    ).rowcount:
+        create_partition(db, table)
+
+    db.execute(
+        f"""INSERT INTO {table} ({HISTORY_COLUMNS})
+            SELECT bike_id, customer_name, hours, total_cost, rented_at, ?, ?
+            FROM Rentals WHERE bike_id = ?""",
+        (now.strftime("%Y-%m-%d %H:%M:%S"), ended, bike_id),
+    )
+    return db.execute("DELETE FROM Rentals WHERE bike_id = ?", (bike_id,)).rowcount
+
+
+# Reads
+
+
+def partitions(conn, start_month=None, end_month=None):
+    # [(month, archive path or None)] for the months in range, oldest first
+    return conn.execute(
+        """SELECT month, archive_path FROM HistoryPartitions
+           WHERE month >= ? AND month <= ? ORDER BY month""",
+        (start_month or "0000-00", end_month or "9999-99"),
+    ).fetchall()
+
+
+def partition_tables(conn):
+    # Partitions still stored in the main database
+    return [
+        partition_table(month)
+        for month, archive_path in partitions(conn)
+        if archive_path is None
+    ]
+
+
+def history(conn, start=None, end=None, bike_id=None):
+    # Finished rentals returned between start and end (ISO dates, inclusive),
+    # oldest first. Only the partitions of those months are read.
+    where = ["returned_at >= ?", "returned_at < date(?, '+1 day')"]
+    params = [start or "0000-01-01", end or "9999-12-30"]
+    if bike_id is not None:
+        where.append("bike_id = ?")
+        params.append(bike_id)
+    query = (
+        f"SELECT {HISTORY_COLUMNS} FROM {{table}} "
+        f"WHERE {' AND '.join(where)} ORDER BY returned_at"
+    )
+
+    rows = []
+    for month, archive_path in partitions(
+        conn, start and start[:7], end and end[:7]
+    ):
+        if archive_path is None:
+            table = partition_table(month)
+            rows.extend(conn.execute(query.format(table=table), params))
+        else:
+            archive = sqlite3.connect(f"file:{archive_path}?mode=ro", uri=True)
+            try:
+                table = ARCHIVE_TABLE
+                rows.extend(archive.execute(query.format(table=table), params))
+            finally:
+                archive.close()
+    return [history_from_row(row) for row in rows]
+
+
+# Archiving
+
+
+def archive_partition(conn, month, archive_dir=ARCHIVE_DIR):
+    # Move a finished month out of the main database into its own file and
+    # return the file's path
+    if month >= datetime.now(timezone.utc).strftime("%Y-%m"):
+        raise ValueError("Only months that have ended can be archived.")
+    row = conn.execute(
+        "SELECT archive_path FROM HistoryPartitions WHERE month = ?", (month,)
+    ).fetchone()
+    if row is None:
+        raise ValueError(f"No rental history for {month}.")
+    if row[0] is not None:
+        return row[0]
+
+    table = partition_table(month)
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.abspath(os.path.join(archive_dir, f"rental-history-{month}.db"))
+    if os.path.exists(path):
+        os.remove(path)  # left over from an interrupted archive
+
+    # Copying only reads the main database, so rents and returns carry on
+    # meanwhile; no new rows can arrive for a month that has ended
+    archive = sqlite3.connect(path)
+    try:
+        create_partition(archive, ARCHIVE_TABLE)
+        archive.executemany(
+            f"""INSERT INTO {ARCHIVE_TABLE} ({HISTORY_COLUMNS})
+                VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            conn.execute(f"SELECT {HISTORY_COLUMNS} FROM {table}"),
+        )
+        archive.commit()
+        (copied,) = archive.execute(f"SELECT COUNT(*) FROM {ARCHIVE_TABLE}").fetchone()
+    finally:
+        archive.close()
+    if conn.in_transaction:
+        conn.commit()  # end the read transaction before taking the write lock
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        expected = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        if copied != expected:
+            raise sqlite3.DatabaseError(
+                f"Archive of {month} has {copied} rows, expected {expected}."
+            )
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(
+            "UPDATE HistoryPartitions SET archive_path = ? WHERE month = ?",
+            (path, month),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rental history")
+    parser.add_argument("--db", default=DB_FILE)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="list the monthly partitions")
+
+    show_parser = commands.add_parser("show", help="print finished rentals")
+    show_parser.add_argument("--from", dest="start")
+    show_parser.add_argument("--to", dest="end")
+    show_parser.add_argument("--bike", type=int)
+
+    archive_parser = commands.add_parser("archive", help="archive a finished month")
+    archive_parser.add_argument("month", help="YYYY-MM")
+    archive_parser.add_argument("--dir", default=ARCHIVE_DIR)
+
+    args = parser.parse_args()
+    conn = connect(args.db)
+    migrate(conn)
+
+    if args.command == "list":
+        for month, archive_path in partitions(conn):
+            print(f"{month}  {archive_path or 'in ' + args.db}")
+    elif args.command == "show":
+        for day in (args.start, args.end):
+            if day:
+                try:
+                    date.fromisoformat(day)
+                except ValueError:
+                    parser.exit(1, f"Not a date (YYYY-MM-DD): {day}\n")
+        for rental in history(conn, args.start, args.end, args.bike):
+            print(
+                f"{rental['returned_at']}  bike {rental['bike_id']:<6} "
+                f"{rental['customer_name']:<20} {rental['hours']:>3}h "
+                f"${rental['total_cost']:<8} {rental['ended']}"
+            )
+    else:
+        try:
+            path = archive_partition(conn, args.month, args.dir)
+        except ValueError as e:
+            parser.exit(1, f"{e}\n")
+        print(f"Archived {args.month} to {path}.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
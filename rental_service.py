@@ -0,0 +1,379 @@
+from datetime import datetime
+from functools import lru_cache
+from inspect import signature
+import sqlite3
+
+import analytics
+from auth import auth_cache, hash_password, is_hashed, verify_password
+from fleet_store import BIKE_COLUMNS, RENTAL_COLUMNS, bike_from_row, rental_from_row
+import rental_history
+from rental_tx import (
+    RentalError,
+    cancel_in_tx,
+    immediate,
+    is_busy,
+    rent_in_tx,
+    reserve_in_tx,
+    return_in_tx,
+)
+import reservations
+
+# The rental operations without any Tk: the desktop app, the HTTP API and
+# scripts all call these. Every function takes an open connection. Write
+# operations have an *_in_tx form that runs inside a transaction the caller
+# already opened (used for batching) and a plain form that opens its own
+# BEGIN IMMEDIATE transaction. Refusals raise RentalError.
+
+MAX_INTEGER = 2**63 - 1  # largest integer SQLite stores
+
+
+def as_count(value, message):
+    # Accept the digit strings the forms produce as well as JSON integers,
+    # as long as SQLite can store them
+    if isinstance(value, str) and value.strip().isdecimal():
+        value = int(value.strip())
+    if (
+        isinstance(value, int)
+        and not isinstance(value, bool)
+        and 0 <= value <= MAX_INTEGER
+    ):
+        return value
+    raise RentalError(message, "Input Error")
+
+
+def as_text(value):
+    return value.strip() if isinstance(value, str) else ""
+
+
+def as_time(value):
+    # "YYYY-MM-DD HH:MM" (local time) or ISO 8601 with an offset -> stored
+    # UTC text
+    try:
+        moment = datetime.fromisoformat(as_text(value))
+    except ValueError:
+        raise RentalError("Please enter times as YYYY-MM-DD HH:MM.", "Input Error")
+    return reservations.to_utc_text(moment)
+
+
+# Users
+
+
+def login(conn, username, password):
+    username, password = as_text(username), as_text(password)
+    if not username or not password:
+        raise RentalError("Username and Password cannot be empty!", "Login Error")
+
+    user = conn.execute(
+        "SELECT username, password, role FROM Users WHERE username=?", (username,)
+    ).fetchone()
+    if not user:
+        raise RentalError("Invalid username or password!", "Login Error")
+    username, stored, role = user
+
+    # A recent login with the same password skips the slow key derivation
+    if auth_cache.check(username, stored, password):
+        return {"username": username, "role": role}
+
+    matches, needs_rehash = verify_password(stored, password)
+    if not matches:
+        raise RentalError("Invalid username or password!", "Login Error")
+
+    if needs_rehash:
+        # Plaintext (or outdated) password: replace it with a current hash,
+        # unless someone changed it in the meantime
+        new_hash = hash_password(password)
+        immediate(
+            conn,
+            lambda db: db.execute(
+                "UPDATE Users SET password=? WHERE username=? AND password=?",
+                (new_hash, username, stored),
+            ),
+        )
+        stored = new_hash
+
+    auth_cache.remember(username, stored, password)
+    return {"username": username, "role": role}
+
+
+def new_account(username, password):
+    # The sign-up form's checks; returns the cleaned (username, password)
+    username, password = as_text(username), as_text(password)
+    if len(username) < 4:
+        raise RentalError("Username must be at least 4 characters long!")
+    if not password:
+        raise RentalError("Password cannot be empty!")
+    return username, password
+
+
+def sign_up_in_tx(db, username, password, is_admin=False):
+    username, password = new_account(username, password)
+    return sign_up_hashed_in_tx(db, username, hash_password(password), is_admin)
+
+
+def sign_up_hashed_in_tx(db, username, password_hash, is_admin=False):
+    # For a password hashed before the transaction (see sign_up), so the slow
+    # KDF does not run while the write lock is held. The hash is stored as
+    # given, so this is never offered to clients (see INTERNAL_OPERATIONS).
+    username = as_text(username)
+    if len(username) < 4:
+        raise RentalError("Username must be at least 4 characters long!")
+    if not isinstance(password_hash, str) or not is_hashed(password_hash):
+        raise RentalError("Password cannot be empty!")
+
+    existing_user = db.execute(
+        "SELECT username FROM Users WHERE username=?", (username,)
+    ).fetchone()
+    if existing_user:
+        raise RentalError("Username already exists! Choose a different one.")
+
+    role = "admin" if is_admin else "user"
+    db.execute(
+        "INSERT INTO Users (username, password, role) VALUES (?, ?, ?)",
+        (username, password_hash, role),
+    )
+    return {"username": username, "role": role}
+
+
+# Rentals
+
+
+def rent_bike_in_tx(db, bike_id, customer_name, hours):
+    message = "Please enter valid numeric values for Bike ID and Rental Hours."
+    bike_id = as_count(bike_id, message)
+    hours = as_count(hours, message)
+    customer_name = as_text(customer_name)
+    if not customer_name:
+        raise RentalError("Customer Name cannot be empty.", "Input Error")
+
+    bike_name, total_cost = rent_in_tx(db, bike_id, customer_name, hours)
+    return {
+        "bike_id": bike_id,
+        "bike_name": bike_name,
+        "customer_name": customer_name,
+        "hours": hours,
+        "total_cost": total_cost,
+    }
+
+
+def return_bike_in_tx(db, bike_id):
+    bike_id = as_count(bike_id, "Please enter a valid numeric Bike ID.")
+    bike_name = return_in_tx(db, bike_id)
+    return {"bike_id": bike_id, "bike_name": bike_name}
+
+
+def list_rentals(conn):
+    return [
+        rental_from_row(row)
+        for row in conn.execute(f"SELECT {RENTAL_COLUMNS} FROM Rentals")
+    ]
+
+
+# Reservations
+
+
+def reserve_bike_in_tx(db, bike_id, customer_name, starts_at, ends_at):
+    bike_id = as_count(bike_id, "Please enter a valid numeric Bike ID.")
+    customer_name = as_text(customer_name)
+    if not customer_name:
+        raise RentalError("Customer Name cannot be empty.", "Input Error")
+    starts_at, ends_at = as_time(starts_at), as_time(ends_at)
+    if starts_at >= ends_at:
+        raise RentalError("The reservation must end after it starts.", "Input Error")
+    if ends_at <= reservations.now_text():
+        raise RentalError("The reservation is already over.", "Input Error")
+
+    reservation_id = reserve_in_tx(db, bike_id, customer_name, starts_at, ends_at)
+    return {
+        "id": reservation_id,
+        "bike_id": bike_id,
+        "customer_name": customer_name,
+        "starts_at": starts_at,
+        "ends_at": ends_at,
+    }
+
+
+def cancel_reservation_in_tx(db, reservation_id):
+    reservation_id = as_count(reservation_id, "Please enter a valid reservation ID.")
+    cancel_in_tx(db, reservation_id)
+    return {"id": reservation_id}
+
+
+def list_reservations(conn, bike_id):
+    bike_id = as_count(bike_id, "Please enter a valid numeric Bike ID.")
+    return reservations.bike_reservations(conn, bike_id)
+
+
+def list_free_bikes(conn, starts_at, ends_at, bike_type=None, after_id=0, limit=100):
+    # Keyset page of bikes free for the whole slot
+    starts_at, ends_at = as_time(starts_at), as_time(ends_at)
+    if starts_at >= ends_at:
+        raise RentalError("The slot must end after it starts.", "Input Error")
+    after_id = as_count(after_id, "after must be a bike ID.")
+    limit = min(as_count(limit, "limit must be a number."), 1000)
+    return reservations.free_bikes(
+        conn, starts_at, ends_at, as_text(bike_type), after_id, limit
+    )
+
+
+# Bikes
+
+
+def add_bike_in_tx(db, name, bike_type, price_per_hour):
+    name, bike_type = as_text(name), as_text(bike_type)
+    if not name or not bike_type:
+        raise RentalError("Please enter valid bike details.", "Input Error")
+    price = as_count(price_per_hour, "Please enter valid bike details.")
+
+    bike_id = db.execute(
+        "INSERT INTO Bikes (name, type, price_per_hour, available) VALUES (?, ?, ?, 1)",
+        (name, bike_type, price),
+    ).lastrowid
+    return get_bike(db, bike_id)
+
+
+def delete_bike_in_tx(db, bike_id):
+    bike_id = as_count(bike_id, "Please enter a valid numeric Bike ID.")
+    bike = db.execute("SELECT type FROM Bikes WHERE id = ?", (bike_id,)).fetchone()
+    if bike is None:
+        raise RentalError("Bike ID not found.")
+    db.execute("DELETE FROM Bikes WHERE id = ?", (bike_id,))
+    db.execute("DELETE FROM Reservations WHERE bike_id = ?", (bike_id,))
+    ended = rental_history.close_rentals(db, bike_id, ended="deleted")
+    # Its revenue stays in the totals; only the open rental ends
+    analytics.record_end(db, bike[0], ended)
+    return {"bike_id": bike_id}
+
+
+def get_bike(conn, bike_id):
+    bike_id = as_count(bike_id, "Please enter a valid numeric Bike ID.")
+    row = conn.execute(
+        f"SELECT {BIKE_COLUMNS} FROM Bikes WHERE id = ?", (bike_id,)
+    ).fetchone()
+    if row is None:
+        raise RentalError("Bike ID not found.")
+    return bike_from_row(row)
+
+
+def list_bikes(conn, after_id=0, limit=100):
+    # Keyset page of bikes ordered by id, like the desktop bike list
+    after_id = as_count(after_id, "after must be a bike ID.")
+    limit = min(as_count(limit, "limit must be a number."), 1000)
+    return [
+        bike_from_row(row)
+        for row in conn.execute(
+            f"SELECT {BIKE_COLUMNS} FROM Bikes WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id, limit),
+        )
+    ]
+
+
+# Self-contained write operations
+
+
+def sign_up(conn, username, password, is_admin=False):
+    username, password = new_account(username, password)
+    password_hash = hash_password(password)
+    return immediate(
+        conn, lambda db: sign_up_hashed_in_tx(db, username, password_hash, is_admin)
+    )
+
+
+def rent_bike(conn, bike_id, customer_name, hours, stats=None):
+    return immediate(
+        conn,
+        lambda db: rent_bike_in_tx(db, bike_id, customer_name, hours),
+        stats=stats,
+    )
+
+
+def return_bike(conn, bike_id, stats=None):
+    return immediate(conn, lambda db: return_bike_in_tx(db, bike_id), stats=stats)
+
+
+def add_bike(conn, name, bike_type, price_per_hour):
+    return immediate(
+        conn, lambda db: add_bike_in_tx(db, name, bike_type, price_per_hour)
+    )
+
+
+def delete_bike(conn, bike_id):
+    return immediate(conn, lambda db: delete_bike_in_tx(db, bike_id))
+
+
+def reserve_bike(conn, bike_id, customer_name, starts_at, ends_at, stats=None):
+    return immediate(
+        conn,
+        lambda db: reserve_bike_in_tx(db, bike_id, customer_name, starts_at, ends_at),
+        stats=stats,
+    )
+
+
+def cancel_reservation(conn, reservation_id):
+    return immediate(conn, lambda db: cancel_reservation_in_tx(db, reservation_id))
+
+
+# Batches
+
+WRITE_OPERATIONS = {
+    "sign_up": sign_up_in_tx,
+    "rent": rent_bike_in_tx,
+    "return": return_bike_in_tx,
+    "add_bike": add_bike_in_tx,
+    "delete_bike": delete_bike_in_tx,
+    "reserve": reserve_bike_in_tx,
+    "cancel_reservation": cancel_reservation_in_tx,
+}
+
+# Operations only this code may queue, never a client: the group committer
+# turns a sign_up into sign_up_hashed once the password is hashed
+INTERNAL_OPERATIONS = {
+    "sign_up_hashed": sign_up_hashed_in_tx,
+}
+
+
+@lru_cache(maxsize=None)
+def operation_signature(operation):
+    return signature(operation)
+
+
+def run_operation(db, name, params, operations=WRITE_OPERATIONS):
+    # Run one named write operation inside an open transaction, in its own
+    # savepoint so a failure only rolls back this operation. Returns (True,
+    # result) or (False, error): a RentalError for a refusal, or whatever
+    # else the operation raised, so one bad operation cannot take the rest
+    # of a group down with it. A busy database is still raised, for the
+    # caller to retry the whole transaction.
+    db.execute("SAVEPOINT operation")
+    try:
+        if name not in operations:
+            raise RentalError(f"Unknown operation: {name}")
+        operation = operations[name]
+        try:
+            operation_signature(operation).bind(db, **params)
+        except TypeError:
+            raise RentalError(f"Invalid parameters for {name}.", "Input Error")
+        result = operation(db, **params)
+    except sqlite3.OperationalError as e:
+        if is_busy(e):
+            raise
+        error = e
+    except Exception as e:
+        error = e
+    else:
+        db.execute("RELEASE operation")
+        return True, result
+    db.execute("ROLLBACK TO operation")
+    db.execute("RELEASE operation")
+    return False, error
+
+
+def run_batch(conn, operations, stats=None):
+    # Run many write operations in one transaction (one commit); a refused
+    # operation is rolled back on its own and the rest still commit.
+    # operations is a list of (name, params dict); returns a list of (True,
+    # result) or (False, error) as from run_operation.
+    return immediate(
+        conn,
+        lambda db: [run_operation(db, name, params) for name, params in operations],
+        stats=stats,
+    )
@@ -0,0 +1,192 @@
+import random
+import sqlite3
+import time
+
+import analytics
+import pricing
+import rental_history
+import reservations
+
+# Rent and return as single write transactions. BEGIN IMMEDIATE takes the
+# write lock before anything is read, and the availability flag is flipped
+# with a conditional UPDATE whose row count decides the outcome, so two
+# terminals sharing bike-rental.db can never both rent the same bike.
+# Reservations are checked and inserted under the same lock, so two
+# terminals can never book overlapping slots either.
+
+BUSY_RETRIES = 10
+BACKOFF_START = 0.005  # seconds
+BACKOFF_MAX = 0.25
+
+SQLITE_BUSY = 5
+SQLITE_LOCKED = 6
+
+
+class RentalError(Exception):
+    # An operation that was refused; the message and title are meant for the
+    # user (they match the messagebox the desktop app shows)
+
+    def __init__(self, message, title="Error"):
+        super().__init__(message)
+        self.title = title
+
+
+def is_busy(error):
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (SQLITE_BUSY, SQLITE_LOCKED)
+    return "locked" in str(error) or "busy" in str(error)
+
+
+def immediate(conn, work, retries=BUSY_RETRIES, stats=None):
+    # Run work(conn) in a BEGIN IMMEDIATE transaction and commit it. When the
+    # database is busy the whole transaction is retried with jittered
+    # exponential backoff. stats, if given, collects retry counts and the
+    # time spent waiting for the lock.
+    delay = BACKOFF_START
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            if not is_busy(e) or attempt >= retries:
+                raise
+        else:
+            if stats is not None:
+                stats["lock_wait"] = stats.get("lock_wait", 0.0) + (
+                    time.perf_counter() - started
+                )
+            try:
+                result = work(conn)
+                conn.commit()
+                return result
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                if not is_busy(e) or attempt >= retries:
+                    raise
+            except BaseException:
+                conn.rollback()
+                raise
+
+        attempt += 1
+        if stats is not None:
+            stats["retries"] = stats.get("retries", 0) + 1
+            stats["lock_wait"] = stats.get("lock_wait", 0.0) + (
+                time.perf_counter() - started
+            )
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay = min(delay * 2, BACKOFF_MAX)
+
+
+def rent_in_tx(db, bike_id, customer_name, hours):
+    # Rent inside an already open write transaction. Returns (bike name,
+    # total cost); raises RentalError if the bike is unknown or already rented
+    bike = db.execute(
+        "SELECT name, price_per_hour, type FROM Bikes WHERE id = ?", (bike_id,)
+    ).fetchone()
+    if bike is None:
+        raise RentalError("Bike not available or invalid ID.")
+
+    # Someone else's reservation in the coming hours keeps the bike here
+    starts_at = reservations.now_text()
+    ends_at = db.execute(
+        "SELECT datetime(?, '+' || ? || ' hours')", (starts_at, hours)
+    ).fetchone()[0]
+    clash = reservations.conflict(db, bike_id, starts_at, ends_at, customer_name)
+    if clash is not None:
+        raise RentalError(
+            f"Bike {bike_id} is reserved from "
+            f"{reservations.local_time(clash['starts_at'])}.",
+            "Reservation Conflict",
+        )
+
+    updated = db.execute(
+        "UPDATE Bikes SET available = 0 WHERE id = ? AND available = 1",
+        (bike_id,),
+    ).rowcount
+    if updated != 1:
+        raise RentalError("Bike not available or invalid ID.")
+
+    total_cost = pricing.quote(db, bike[2], bike[1], hours)
+    db.execute(
+        "INSERT INTO Rentals (bike_id, customer_name, hours, total_cost) VALUES (?, ?, ?, ?)",
+        (bike_id, customer_name, hours, total_cost),
+    )
+    analytics.record_rent(db, bike_id, bike[2], hours, total_cost)
+    return bike[0], total_cost
+
+
+def return_in_tx(db, bike_id):
+    # Return inside an already open write transaction. Returns the bike name;
+    # raises RentalError if the bike is unknown or not rented
+    bike = db.execute("SELECT name, type FROM Bikes WHERE id = ?", (bike_id,)).fetchone()
+    if bike is None:
+        raise RentalError("Bike ID not found.")
+
+    updated = db.execute(
+        "UPDATE Bikes SET available = 1 WHERE id = ? AND available = 0",
+        (bike_id,),
+    ).rowcount
+    if updated != 1:
+        raise RentalError("Bike is already available.")
+
+    ended = rental_history.close_rentals(db, bike_id)
+    analytics.record_end(db, bike[1], ended)
+    return bike[0]
+
+
+def reserve_in_tx(db, bike_id, customer_name, starts_at, ends_at):
+    # Book a slot inside an already open write transaction. starts_at and
+    # ends_at are stored UTC text (see reservations); raises RentalError if
+    # the slot overlaps another reservation or an open rental.
+    if db.execute("SELECT 1 FROM Bikes WHERE id = ?", (bike_id,)).fetchone() is None:
+        raise RentalError("Bike ID not found.")
+
+    clash = reservations.conflict(db, bike_id, starts_at, ends_at)
+    if clash is not None:
+        raise RentalError(
+            f"Bike {bike_id} is already reserved from "
+            f"{reservations.local_time(clash['starts_at'])} to "
+            f"{reservations.local_time(clash['ends_at'])}.",
+            "Reservation Conflict",
+        )
+    rented_until = reservations.rental_end(db, bike_id, ends_at)
+    if rented_until is not None and rented_until > starts_at:
+        raise RentalError(
+            f"Bike {bike_id} is rented until "
+            f"{reservations.local_time(rented_until)}.",
+            "Reservation Conflict",
+        )
+
+    return db.execute(
+        """INSERT INTO Reservations (bike_id, customer_name, starts_at, ends_at)
+           VALUES (?, ?, ?, ?)""",
+        (bike_id, customer_name, starts_at, ends_at),
+    ).lastrowid
+
+
+def cancel_in_tx(db, reservation_id):
+    deleted = db.execute(
+        "DELETE FROM Reservations WHERE id = ?", (reservation_id,)
+    ).rowcount
+    if not deleted:
+        raise RentalError("Reservation not found.")
+
+
+def rent(conn, bike_id, customer_name, hours, stats=None):
+    return immediate(
+        conn, lambda db: rent_in_tx(db, bike_id, customer_name, hours), stats=stats
+    )
+
+
+def return_bike(conn, bike_id, stats=None):
+    return immediate(conn, lambda db: return_in_tx(db, bike_id), stats=stats)
+
+
+def reserve(conn, bike_id, customer_name, starts_at, ends_at, stats=None):
+    return immediate(
+        conn,
+        lambda db: reserve_in_tx(db, bike_id, customer_name, starts_at, ends_at),
+        stats=stats,
+    )
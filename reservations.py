@@ -0,0 +1,134 @@
+from datetime import datetime, timezone
+
+from fleet_store import BIKE_COLUMNS, bike_from_row
+
+# Future bookings of a bike for a time slot [starts_at, ends_at). Times are
+# stored as UTC text in the same format as Rentals.rented_at, so they sort
+# and compare as strings.
+#
+# The reservations of one bike never overlap: every booking is checked in
+# the same BEGIN IMMEDIATE transaction that inserts it (see rental_tx). That
+# makes the (bike_id, starts_at) index an interval index. Sorted by start,
+# the ends are sorted too, so the only reservation that can overlap a slot
+# is the last one starting before the slot ends: one index probe, O(log n)
+# however many reservations the bike has.
+#
+# An open rental occupies its bike from rented_at for the rented hours, so
+# it blocks reservations in that time as well. Rentals from before rental
+# timestamps existed have no known start and do not.
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+RESERVATION_COLUMNS = "id, bike_id, customer_name, starts_at, ends_at"
+
+# End of the last reservation of a bike starting before ?; a slot is free of
+# reservations if this is NULL or not after the slot's start
+LAST_END = """(SELECT ends_at FROM Reservations
+               WHERE bike_id = {bike} AND starts_at < ?
+               ORDER BY starts_at DESC LIMIT 1)"""
+# End of the bike's open rental if it started before ?
+RENTAL_END = """(SELECT datetime(rented_at, '+' || hours || ' hours') FROM Rentals
+                 WHERE bike_id = {bike} AND rented_at < ?)"""
+
+
+def now_text():
+    return datetime.now(timezone.utc).strftime(TIME_FORMAT)
+
+
+def to_utc_text(moment):
+    # datetime -> stored text; naive times are local time, as typed at the
+    # counter
+    return moment.astimezone(timezone.utc).strftime(TIME_FORMAT)
+
+
+def local_time(text):
+    # Stored text -> local "YYYY-MM-DD HH:MM" for display
+    moment = datetime.strptime(text, TIME_FORMAT).replace(tzinfo=timezone.utc)
+    return moment.astimezone().strftime("%Y-%m-%d %H:%M")
+
+
+def reservation_from_row(row):
+    return {
+        "id": row[0],
+        "bike_id": row[1],
+        "customer_name": row[2],
+        "starts_at": row[3],
+        "ends_at": row[4],
+    }
+
+
+def conflict(db, bike_id, starts_at, ends_at, customer_name=None):
+    # The reservation overlapping [starts_at, ends_at), or None. With
+    # customer_name, that customer's own reservations do not count.
+    row = db.execute(
+        f"""SELECT {RESERVATION_COLUMNS} FROM Reservations
+            WHERE bike_id = ? AND starts_at < ?
+            ORDER BY starts_at DESC LIMIT 1""",
+        (bike_id, ends_at),
+    ).fetchone()
+    if row is None or row[4] <= starts_at:
+        return None
+    if customer_name is not None and row[2] == customer_name:
+        # A longer slot can overlap several reservations; look for another
+        # customer's among them
+        row = db.execute(
+            f"""SELECT {RESERVATION_COLUMNS} FROM Reservations
+                WHERE bike_id = ? AND starts_at < ? AND ends_at > ?
+                  AND customer_name != ?
+                ORDER BY starts_at DESC LIMIT 1""",
+            (bike_id, ends_at, starts_at, customer_name),
+        ).fetchone()
+        if row is None:
+            return None
+    return reservation_from_row(row)
+
+
+def rental_end(db, bike_id, before):
+    # When the bike's open rental ends, if it started before `before`
+    return db.execute(
+        f"SELECT {RENTAL_END.format(bike='?')}", (bike_id, before)
+    ).fetchone()[0]
+
+
+def free_clause(bike="Bikes.id"):
+    # WHERE clause for bikes free for a whole slot, and a function giving
+    # its parameters for (starts_at, ends_at)
+    clause = (
+        f"COALESCE({LAST_END.format(bike=bike)} <= ?, 1) "
+        f"AND COALESCE({RENTAL_END.format(bike=bike)} <= ?, 1)"
+    )
+    return clause, lambda starts_at, ends_at: [ends_at, starts_at, ends_at, starts_at]
+
+
+# Reads
+
+
+def bike_reservations(conn, bike_id, after=None, limit=100):
+    # Reservations of a bike that end after `after` (default now), by start
+    return [
+        reservation_from_row(row)
+        for row in conn.execute(
+            f"""SELECT {RESERVATION_COLUMNS} FROM Reservations
+                WHERE bike_id = ? AND ends_at > ?
+                ORDER BY starts_at LIMIT ?""",
+            (bike_id, after or now_text(), limit),
+        )
+    ]
+
+
+def free_bikes(conn, starts_at, ends_at, bike_type=None, after_id=0, limit=100):
+    # Keyset page of bikes with no reservation or rental in the slot. Each
+    # bike costs one probe of each index.
+    clause, params = free_clause()
+    where = ["id > ?", clause]
+    values = [after_id] + params(starts_at, ends_at)
+    if bike_type:
+        where.append("type = ?")
+        values.append(bike_type)
+    return [
+        bike_from_row(row)
+        for row in conn.execute(
+            f"""SELECT {BIKE_COLUMNS} FROM Bikes WHERE {' AND '.join(where)}
+                ORDER BY id LIMIT ?""",
+            values + [limit],
+        )
+    ]
@@ -0,0 +1,65 @@
+class TreeSync:
+    # Keeps a ttk.Treeview in step with a list of rows by diffing against the
+    # rows it showed last time. Only rows that were added, changed or removed
+    # cause insert()/item()/delete() calls on the widget.
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.items = {}  # row key -> Treeview item id
+        self.rows = {}  # row key -> (values, tags) last shown
+        self.order = []  # row keys in display order
+
+    def sync(self, rows):
+        # rows: iterable of (key, values, tags) in display order
+        rows = [(key, tuple(values), tuple(tags)) for key, values, tags in rows]
+        keys = [row[0] for row in rows]
+        wanted = set(keys)
+
+        for key in self.order:
+            if key not in wanted:
+                self._delete(key)
+
+        kept = [key for key in self.order if key in self.items]
+        in_order = kept == [key for key in keys if key in self.items]
+
+        for index, (key, values, tags) in enumerate(rows):
+            item = self.items.get(key)
+            if item is None:
+                self.items[key] = self.tree.insert(
+                    "", index, values=values, tags=tags
+                )
+            else:
+                if self.rows[key] != (values, tags):
+                    self.tree.item(item, values=values, tags=tags)
+                if not in_order:
+                    self.tree.move(item, "", index)
+            self.rows[key] = (values, tags)
+
+        self.order = keys
+
+    def update(self, key, values, tags=()):
+        # Refresh a single row in place, appending it if it is not shown yet
+        values, tags = tuple(values), tuple(tags)
+        item = self.items.get(key)
+        if item is None:
+            self.items[key] = self.tree.insert("", "end", values=values, tags=tags)
+            self.order.append(key)
+        elif self.rows[key] != (values, tags):
+            self.tree.item(item, values=values, tags=tags)
+        self.rows[key] = (values, tags)
+
+    def remove(self, key):
+        if key in self.items:
+            self._delete(key)
+            self.order.remove(key)
+
+    def clear(self):
+        for item in self.items.values():
+            self.tree.delete(item)
+        self.items.clear()
+        self.rows.clear()
+        self.order = []
+
+    def _delete(self, key):
+        self.tree.delete(self.items.pop(key))
+        del self.rows[key]